@@ -0,0 +1,67 @@
+import argparse
+import logging
+import os
+import sys
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measures engine performance")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative slowdown that counts as a regression")
+    parser.add_argument("--only", choices=["math", "gl", "frame"], action="append",
+                        help="run only these suites")
+    parser.add_argument("--quick", action="store_true", help="fewer sizes and frames, e.g. for CI")
+    parser.add_argument("--display", action="store_true", help="use the display instead of a headless context")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING)
+    if not args.display:
+        os.environ["GAME_ENGINE_HEADLESS"] = "1"
+
+    # imported after selecting the backend, see game_engine/__init__.py
+    import pyglet
+    from benchmarks import math_benchmarks, gl_benchmarks, frame_benchmarks
+    from benchmarks.harness import save_results, load_results, compare, print_results
+    from game_engine.render_state import RENDER_STATE
+
+    suites = {"math": math_benchmarks, "gl": gl_benchmarks, "frame": frame_benchmarks}
+    selected = args.only or list(suites)
+
+    # the GL benchmarks need a current context
+    context_window = pyglet.window.Window(64, 64, visible=False)
+    results = []
+    for name in selected:
+        print(f"Running {name} benchmarks", file=sys.stderr)
+        context_window.switch_to()
+        RENDER_STATE.invalidate()
+        results.extend(suites[name].run(args.quick))
+
+    if args.output:
+        save_results(args.output, results)
+    if args.save_baseline:
+        save_results(args.baseline, results)
+        print_results(results)
+        return 0
+
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one", file=sys.stderr)
+        print_results(results)
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import math
+from typing import List, Tuple
+
+import numpy as np
+from pyglet.gl import glFinish
+
+import game_engine.game
+from game_engine.asset import ColorMeshSurface
+from game_engine.camera import Camera
+from game_engine.math import vec3, identity, translate, TransformBatch
+from game_engine.render_queue import RENDER_QUEUE
+from game_engine.vertex_objects import Uniform, InstanceBuffer
+from game_engine.window import Window
+
+from benchmarks.harness import BenchmarkResult
+
+WIDTH = 640
+HEIGHT = 360
+
+
+def cube() -> ColorMeshSurface:
+    corners = np.array([[x, y, z] for x in [-.5, .5] for y in [-.5, .5] for z in [-.5, .5]], dtype=np.float32)
+    indices = [0, 1, 3, 3, 2, 0, 4, 6, 7, 7, 5, 4, 0, 4, 5, 5, 1, 0,
+               2, 3, 7, 7, 6, 2, 0, 2, 6, 6, 4, 0, 1, 5, 7, 7, 3, 1]
+    return ColorMeshSurface(corners, (corners + 0.5), indices)
+
+
+def grid_positions(count: int) -> np.ndarray:
+    side = int(math.ceil(math.sqrt(count)))
+    index = np.arange(count)
+    return np.stack([index % side - side / 2, index // side - side / 2, np.full(count, -side)],
+                    axis=1).astype(np.float32) * 1.5
+
+
+class SyntheticScene(game_engine.game.BaseGame):
+    """
+    count cubes drawn one by one, through the render queue or with one instanced draw
+    """
+
+    def __init__(self, count: int, mode: str):
+        self.count = count
+        self.mode = mode
+
+    def init(self):
+        self.mesh = cube()
+        positions = grid_positions(self.count)
+        self.models = []
+        for position in positions:
+            model = identity()
+            translate(model, vec3(arr=position.tolist()))
+            self.models.append(Uniform("u_Model", model))
+        self.instances = InstanceBuffer()
+        self.instances.set_instances(TransformBatch.from_trs(positions))
+
+    def render(self, data: game_engine.game.BaseData):
+        # the camera is in the FrameUniforms block
+        uniforms = []
+        if self.mode == "instanced":
+            self.mesh.draw_instanced(self.instances, uniforms)
+            return
+        queue = RENDER_QUEUE if self.mode == "queue" else None
+        for model in self.models:
+            self.mesh.draw(uniforms + [model], queue)
+
+
+class SceneData(game_engine.game.BaseData):
+    def __init__(self):
+        super().__init__()
+        self.camera = Camera(vec3(0, 0, 5), vec3(0, 0, 0))
+        self.view_matrix = self.camera.get_view_matrix()
+
+
+def frame_time(count: int, mode: str, frames: int, warmup: int = 5) -> Tuple[BenchmarkResult, Window]:
+    window = Window(f"benchmark {mode} {count}", WIDTH, HEIGHT, game=SyntheticScene(count, mode),
+                    data=SceneData(), vsync=False, offscreen=True, fixed_frame_time=1 / 60)
+    window.wait_for_assets = True
+    for _ in range(warmup):
+        window.on_draw()
+    glFinish()
+
+    times = []
+    for _ in range(frames):
+        start = window.clock()
+        window.on_draw()
+        # include the GPU work of the frame
+        glFinish()
+        times.append(window.clock() - start)
+    result = BenchmarkResult(f"frame/{mode} {count} cubes", float(np.median(times)) * 1000.0, "ms", False)
+    return result, window
+
+
+def run(quick: bool = False) -> List[BenchmarkResult]:
+    frames = 10 if quick else 60
+    counts = [100] if quick else [100, 1000]
+    scenes = [(count, mode) for count in counts for mode in ["direct", "queue", "instanced"]]
+    if not quick:
+        scenes.append((10000, "instanced"))
+
+    results = []
+    # pyglet shares the objects of a new context with the previously created one,
+    # closing windows early would take the shared shaders with them
+    windows = []
+    for count, mode in scenes:
+        result, window = frame_time(count, mode, frames)
+        results.append(result)
+        windows.append(window)
+    for window in windows:
+        window.close()
+    return results
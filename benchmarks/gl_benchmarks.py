@@ -0,0 +1,86 @@
+from typing import List
+
+import numpy as np
+from pyglet.gl import glFinish, GL_BGR, GL_UNSIGNED_BYTE, GL_STATIC_DRAW, GL_DYNAMIC_DRAW
+
+from game_engine.asset import Texture, get_color_mesh_shader
+from game_engine.dynamic_buffer import DynamicBuffer
+from game_engine.math import vec3, identity
+from game_engine.uniform_buffer import FRAME_UNIFORMS
+from game_engine.vertex_objects import Uniform, array_buffer
+
+from benchmarks.harness import BenchmarkResult, rate, latency
+
+BUFFER_SIZES = [("64KB", 64 * 1024), ("1MB", 1024 * 1024), ("16MB", 16 * 1024 * 1024)]
+TEXTURE_SIZES = [(256, 256), (1024, 1024), (1920, 1080)]
+
+
+def buffer_benchmarks(quick: bool) -> List[BenchmarkResult]:
+    results = []
+    sizes = BUFFER_SIZES[:2] if quick else BUFFER_SIZES
+    for label, size in sizes:
+        vbo = array_buffer(np.random.rand(size // 4).astype(np.float32))
+        for usage, usage_name in [(GL_STATIC_DRAW, "static"), (GL_DYNAMIC_DRAW, "dynamic")]:
+            def upload():
+                vbo.upload(usage)
+                # count the transfer, not just queueing it
+                glFinish()
+
+            results.append(rate(f"gl/VBO.upload {usage_name} {label}", upload,
+                                items_per_call=size / (1024 * 1024), unit="MB/s"))
+
+        # ring buffer sized for a few frames of this data, like per frame UI geometry
+        dynamic = DynamicBuffer(size=4 * size)
+
+        def write():
+            dynamic.write(vbo.data)
+            dynamic.fence()
+            glFinish()
+
+        results.append(rate(f"gl/DynamicBuffer.write {label}", write,
+                            items_per_call=size / (1024 * 1024), unit="MB/s"))
+        dynamic.delete()
+        vbo.delete()
+    return results
+
+
+def uniform_benchmarks() -> List[BenchmarkResult]:
+    shader = get_color_mesh_shader()
+    shader.bind()
+    matrix = identity()
+    vector = vec3(1, 2, 3)
+    # view and projection are uploaded once per frame into the FrameUniforms block
+    uniforms = [Uniform("u_Model", matrix)]
+
+    def bind_uniforms():
+        for uniform in uniforms:
+            uniform.bind(shader)
+
+    return [
+        rate("gl/Shader.uniform mat4", lambda: shader.uniform("u_Model", matrix)),
+        rate("gl/Shader.uniform missing", lambda: shader.uniform("u_DoesNotExist", vector)),
+        rate("gl/Uniform.bind per draw", bind_uniforms, items_per_call=len(uniforms)),
+        rate("gl/FrameUniforms.set", lambda: FRAME_UNIFORMS.set(matrix, matrix)),
+    ]
+
+
+def texture_benchmarks(quick: bool) -> List[BenchmarkResult]:
+    results = []
+    sizes = TEXTURE_SIZES[:2] if quick else TEXTURE_SIZES
+    for width, height in sizes:
+        image = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        for streaming, mode in [(False, "full"), (True, "streaming")]:
+            texture = Texture(image, GL_BGR, GL_UNSIGNED_BYTE, streaming=streaming)
+
+            def upload():
+                texture.image = image
+                texture.upload()
+                glFinish()
+
+            results.append(latency(f"gl/Texture.upload {mode} {width}x{height}", upload, repeat=3))
+            texture.delete()
+    return results
+
+
+def run(quick: bool = False) -> List[BenchmarkResult]:
+    return buffer_benchmarks(quick) + uniform_benchmarks() + texture_benchmarks(quick)
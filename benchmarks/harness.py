@@ -0,0 +1,97 @@
+import json
+import logging
+import platform
+import timeit
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+LOG = logging.getLogger()
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+def seconds_per_call(function: Callable[[], None], repeat: int = 5, min_time: float = 0.05) -> float:
+    """
+    Best time of repeat runs, each run calls function often enough to take at least min_time
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number
+
+
+def rate(name: str, function: Callable[[], None], items_per_call: float = 1.0, unit: str = "calls/s",
+         **kwargs) -> BenchmarkResult:
+    return BenchmarkResult(name, items_per_call / seconds_per_call(function, **kwargs), unit, True)
+
+
+def latency(name: str, function: Callable[[], None], **kwargs) -> BenchmarkResult:
+    return BenchmarkResult(name, seconds_per_call(function, **kwargs) * 1000.0, "ms", False)
+
+
+def environment() -> Dict[str, str]:
+    result = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine()}
+    try:
+        from pyglet.gl import gl_info
+        result["gl_renderer"] = gl_info.get_renderer()
+        result["gl_version"] = gl_info.get_version()
+    except Exception:
+        pass
+    return result
+
+
+def save_results(file_name: str, results: List[BenchmarkResult]):
+    data = {
+        "environment": environment(),
+        "results": {r.name: {"value": r.value, "unit": r.unit, "higher_is_better": r.higher_is_better}
+                    for r in results},
+    }
+    with open(file_name, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    LOG.info(f"Wrote {len(results)} results to {file_name}")
+
+
+def load_results(file_name: str) -> Optional[List[BenchmarkResult]]:
+    try:
+        with open(file_name) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return [BenchmarkResult(name, r["value"], r["unit"], r["higher_is_better"])
+            for name, r in data["results"].items()]
+
+
+def compare(results: List[BenchmarkResult], baseline: List[BenchmarkResult],
+            tolerance: float = 0.1) -> List[str]:
+    """
+    Prints every result next to its baseline and returns the names that got worse by more than tolerance
+    """
+    baseline_by_name = {r.name: r for r in baseline}
+    regressions = []
+    print(f"{'benchmark':<48} {'baseline':>14} {'current':>14} {'change':>8}")
+    for result in results:
+        reference = baseline_by_name.get(result.name)
+        if reference is None or reference.value == 0:
+            print(f"{result.name:<48} {'-':>14} {result.value:>14.4g} {'':>8}  {result.unit}")
+            continue
+        change = result.value / reference.value - 1
+        worse = -change if result.higher_is_better else change
+        marker = ""
+        if worse > tolerance:
+            marker = "  REGRESSION"
+            regressions.append(result.name)
+        print(f"{result.name:<48} {reference.value:>14.4g} {result.value:>14.4g} {change:>+8.1%}  "
+              f"{result.unit}{marker}")
+    return regressions
+
+
+def print_results(results: List[BenchmarkResult]):
+    for result in results:
+        print(f"{result.name:<48} {result.value:>14.4g}  {result.unit}")
@@ -0,0 +1,35 @@
+from typing import List
+
+import numpy as np
+
+from game_engine.math import vec3, mat4, identity, translate, rotate, scale, TransformBatch
+
+from benchmarks.harness import BenchmarkResult, rate
+
+
+def run(quick: bool = False) -> List[BenchmarkResult]:
+    a = identity()
+    translate(a, vec3(1, 2, 3))
+    rotate(a, vec3(10, 20, 30))
+    b = a.copy()
+    out = identity()
+    m = identity()
+    position = vec3(0.1, 0.2, 0.3)
+    angles = vec3(1, 2, 3)
+
+    results = [
+        rate("math/mat4 multiply", lambda: a * b),
+        rate("math/mat4 multiply into", lambda: a.multiply(b, out)),
+        rate("math/translate", lambda: translate(m, position)),
+        rate("math/rotate", lambda: rotate(m, angles)),
+        rate("math/scale", lambda: scale(m, 1.0)),
+    ]
+
+    count = 1000 if quick else 10000
+    positions = np.random.rand(count, 3).astype(np.float32)
+    rotations = np.random.rand(count, 3).astype(np.float32) * 360
+    batch = TransformBatch(count)
+    results.append(rate(f"math/TransformBatch.from_trs {count}",
+                        lambda: TransformBatch.from_trs(positions, rotations, 1.0, out=batch),
+                        items_per_call=count, unit="matrices/s"))
+    return results
@@ -0,0 +1,9 @@
+import os
+
+import pyglet
+
+# pyglet picks its window backend when pyglet.window is first imported, so the headless (EGL)
+# backend has to be selected before any game_engine module pulls in pyglet.gl
+if os.environ.get("GAME_ENGINE_HEADLESS", "") not in ["", "0"]:
+    pyglet.options['headless'] = True
+    pyglet.options['shadow_window'] = False
@@ -1,35 +1,232 @@
 import logging
 import os
 import inspect
-from typing import List
+import threading
+import time
+import weakref
+from collections import deque
+from typing import List, NamedTuple, Optional, Union
 import ctypes
 
 import cv2
 import numpy as np
-from pyglet.gl import glGenTextures, glBindTexture, glTexParameterf, glTexImage2D, GLuint, GL_BGR, GL_RGB, GL_UNSIGNED_BYTE, GL_BYTE
-from pyglet.gl import GL_RGBA, GL_RGB8, glFlush, glDrawArrays, GL_TRIANGLES, glGenBuffers, glBindBuffer, GL_PIXEL_UNPACK_BUFFER
-from pyglet.gl import GL_TEXTURE_2D, glActiveTexture, GL_TEXTURE0, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_LINEAR, GLubyte
+import pyglet
+from pyglet.gl import glGenTextures, glTexParameterf, glTexImage2D, GLuint, GL_BGR, GL_RGB, GL_UNSIGNED_BYTE, GL_BYTE
+from pyglet.gl import GL_RGBA, GL_RGB8, glFlush, glDrawArrays, glDrawElements, GL_TRIANGLES, glGenBuffers, GL_PIXEL_UNPACK_BUFFER
+from pyglet.gl import GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_LINEAR, GLubyte
 from pyglet.gl import glBufferData, GL_STREAM_DRAW, glTexSubImage2D, GL_WRITE_ONLY, glMapBuffer, glUnmapBuffer, glPixelStorei, GL_UNPACK_ALIGNMENT
+from pyglet.gl import glDeleteTextures, glDeleteBuffers, glDrawArraysInstanced, glDrawElementsInstanced
+from pyglet.gl import glTexParameteri, glGenerateMipmap, glCompressedTexImage2D, glGetCompressedTexImage, glGetTexImage
+from pyglet.gl import glGetTexLevelParameteriv, glGetFloatv, GLint, GLfloat, gl_info, GL_PACK_ALIGNMENT
+from pyglet.gl import GL_BGRA, GL_RED, GL_R8, GL_RGBA8, GL_LINEAR_MIPMAP_LINEAR, GL_TEXTURE_MAX_LEVEL
+from pyglet.gl import GL_TEXTURE_MAX_ANISOTROPY_EXT, GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT, GL_TEXTURE_COMPRESSED
+from pyglet.gl import GL_TEXTURE_COMPRESSED_IMAGE_SIZE, GL_TEXTURE_INTERNAL_FORMAT
+from pyglet.gl import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT1_EXT
+from pyglet.gl import GL_COMPRESSED_RGBA_S3TC_DXT3_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
 
 from game_engine.shader import Shader
-from game_engine.vertex_objects import VBO, VAO, VertexAttribute, Uniform, array_buffer
-from game_engine.math import vec3, vec2, identity
+from game_engine.shader_registry import SHADER_REGISTRY
+from game_engine.vertex_objects import VBO, VAO, VertexAttribute, Uniform, array_buffer, index_buffer
+from game_engine.vertex_objects import deduplicate_vertices, InstanceBuffer
+from game_engine.math import vec3, vec2, identity, to_array
 from game_engine.helper import timer
+from game_engine.render_state import RENDER_STATE
+from game_engine.render_stats import RENDER_STATS
+from game_engine.culling import Bounds
+from game_engine.ktx import KTXImage, read_ktx
+from game_engine.uniform_buffer import FRAME_UNIFORMS
 
 LOG = logging.getLogger()
 
+GPU_MIPMAPS = "gpu"
+CPU_MIPMAPS = "cpu"
+
+# pixel format -> sized internal format
+INTERNAL_FORMATS = {
+    GL_BGR: GL_RGB8,
+    GL_RGB: GL_RGB8,
+    GL_BGRA: GL_RGBA8,
+    GL_RGBA: GL_RGBA8,
+    GL_RED: GL_R8,
+}
+
+# bytes per texel in GPU memory, drivers pad RGB texels to 4 bytes
+TEXEL_BYTES = {
+    GL_RGB: 4,
+    GL_RGB8: 4,
+    GL_RGBA8: 4,
+    GL_R8: 1,
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT: 0.5,
+    GL_COMPRESSED_RGBA_S3TC_DXT1_EXT: 0.5,
+    GL_COMPRESSED_RGBA_S3TC_DXT3_EXT: 1,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT: 1,
+}
+
+# pixel format -> components per pixel
+FORMAT_COMPONENTS = {
+    GL_BGR: 3,
+    GL_RGB: 3,
+    GL_BGRA: 4,
+    GL_RGBA: 4,
+    GL_RED: 1,
+}
+
+# internal format -> base internal format, as stored in KTX files
+BASE_FORMATS = {
+    GL_RGB8: GL_RGB,
+    GL_RGBA8: GL_RGBA,
+    GL_R8: GL_RED,
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT: GL_RGB,
+    GL_COMPRESSED_RGBA_S3TC_DXT1_EXT: GL_RGBA,
+    GL_COMPRESSED_RGBA_S3TC_DXT3_EXT: GL_RGBA,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT: GL_RGBA,
+}
+
+
+def mipmap_levels(width: int, height: int) -> int:
+    # down to 1x1, every level halves the size rounded down
+    return max(width, height).bit_length()
+
+
+def mipmap_pyramid(image: np.ndarray) -> List[np.ndarray]:
+    """
+    All mipmap levels below image, box filtered
+    """
+    levels = []
+    while image.shape[0] > 1 or image.shape[1] > 1:
+        size = (max(1, image.shape[1] // 2), max(1, image.shape[0] // 2))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        levels.append(image)
+    return levels
+
+
+def unpack_alignment(image: np.ndarray) -> int:
+    # GL expects rows to start at 4 byte boundaries, which RGB images with odd widths don't
+    row_bytes = image.nbytes // max(image.shape[0], 1)
+    for alignment in [8, 4, 2]:
+        if row_bytes % alignment == 0:
+            return alignment
+    return 1
+
+
+# context -> its maximum anisotropy, asked once per context instead of for every texture
+MAX_ANISOTROPY = weakref.WeakKeyDictionary()
+
+
+def max_anisotropy() -> float:
+    context = pyglet.gl.current_context
+    value = MAX_ANISOTROPY.get(context) if context is not None else None
+    if value is not None:
+        return value
+    if not gl_info.have_extension("GL_EXT_texture_filter_anisotropic") and \
+            not gl_info.have_extension("GL_ARB_texture_filter_anisotropic"):
+        value = 1.0
+    else:
+        supported = GLfloat(1.0)
+        glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT, ctypes.byref(supported))
+        value = supported.value
+    if context is not None:
+        MAX_ANISOTROPY[context] = value
+    return value
+
 
 class Texture:
-    def __init__(self, image, f, t):
+    def __init__(self, image, f, t, streaming: bool = False, pixel_buffers: bool = False,
+                 mipmaps: Optional[str] = None, anisotropy: float = 1.0, min_filter: Optional[int] = None,
+                 mag_filter: int = GL_LINEAR, internal_format: Optional[int] = None):
+        """
+        streaming: allocate the texture storage once and update it with glTexSubImage2D
+        pixel_buffers: in streaming mode, ping-pong two pixel unpack buffers so the copy
+                       into GL memory overlaps rendering (the texture lags one upload behind)
+        mipmaps: GPU_MIPMAPS runs glGenerateMipmap after every upload,
+                 CPU_MIPMAPS uploads a box filtered pyramid built with cv2 (not through pixel buffers)
+        anisotropy: samples of anisotropic filtering, clamped to what the driver supports
+        min_filter: defaults to trilinear filtering with mipmaps, GL_LINEAR without
+        internal_format: defaults to the sized format matching f, a compressed format like
+                         GL_COMPRESSED_RGB_S3TC_DXT1_EXT lets the driver compress on upload (see to_ktx)
+        """
+        if mipmaps not in [None, GPU_MIPMAPS, CPU_MIPMAPS]:
+            raise AttributeError(f"Unknown mipmap mode {mipmaps}")
+        if mipmaps == CPU_MIPMAPS and streaming and pixel_buffers:
+            raise AttributeError("CPU mipmaps can't be uploaded through pixel buffers")
         self.image = image
         self.format = f
         self.type = t
+        self.mipmaps = mipmaps
+        self.anisotropy = anisotropy
+        if min_filter is None:
+            min_filter = GL_LINEAR_MIPMAP_LINEAR if mipmaps is not None else GL_LINEAR
+        self.min_filter = min_filter
+        self.mag_filter = mag_filter
+        self.internal_format = internal_format if internal_format is not None else INTERNAL_FORMATS.get(f, GL_RGB)
+        self.streaming = streaming
+        self.use_pixel_buffers = streaming and pixel_buffers
+        self.pixel_buffers = None
+        self.pixel_buffer_index = 0
+        self.storage_size = None
         self.uploaded = False
+        self.handle = None
+        self.create_handle()
+
+    def create_handle(self):
         self.handle = GLuint()
         glGenTextures(1, self.handle)
-        glBindTexture(GL_TEXTURE_2D, self.handle)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.handle)
+        self.apply_filtering()
+        if self.use_pixel_buffers:
+            self.pixel_buffers = (GLuint * 2)()
+            glGenBuffers(2, self.pixel_buffers)
+
+    def delete(self):
+        """
+        Frees the GL texture, the image is kept and uploaded again if the texture is bound later
+        """
+        if self.handle is None:
+            return
+        RENDER_STATE.forget_texture(self.handle)
+        glDeleteTextures(1, self.handle)
+        self.handle = None
+        if self.pixel_buffers is not None:
+            for buffer in self.pixel_buffers:
+                RENDER_STATE.forget_buffer(buffer)
+            glDeleteBuffers(2, self.pixel_buffers)
+            self.pixel_buffers = None
+        self.storage_size = None
+        self.uploaded = False
+
+    def apply_filtering(self):
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, self.mag_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, self.min_filter)
+        supported = max_anisotropy()
+        if supported > 1.0:
+            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, min(max(self.anisotropy, 1.0), supported))
+
+    def set_filtering(self, min_filter: Optional[int] = None, mag_filter: Optional[int] = None,
+                      anisotropy: Optional[float] = None):
+        """
+        Changes the filters that are given, e.g. for a quality setting
+        """
+        if min_filter is not None:
+            self.min_filter = min_filter
+        if mag_filter is not None:
+            self.mag_filter = mag_filter
+        if anisotropy is not None:
+            self.anisotropy = anisotropy
+        if self.handle is not None:
+            RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.handle)
+            self.apply_filtering()
+
+    @property
+    def levels(self) -> int:
+        return mipmap_levels(self.width, self.height) if self.mipmaps is not None else 1
+
+    @property
+    def gpu_bytes(self) -> int:
+        texels = sum(max(1, self.width >> level) * max(1, self.height >> level) for level in range(self.levels))
+        size = int(texels * TEXEL_BYTES.get(self.internal_format, 4))
+        if self.use_pixel_buffers:
+            size += 2 * self.image.nbytes
+        return size
 
     @property
     def image(self):
@@ -43,45 +240,433 @@ class Texture:
         self.uploaded = False
 
     def upload(self):
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.handle)
-
-        texture_data = bytes(self.image.flat)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, self.width,
-                     self.height, 0, self.format, self.type, texture_data)
-        glFlush()
+        if self.handle is None:
+            self.create_handle()
+        RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.handle)
+
+        # GL reads straight from the array memory, no python level copy
+        texture_data = np.ascontiguousarray(self.image)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, unpack_alignment(texture_data))
+        uploaded_bytes = texture_data.nbytes
+        if self.streaming and self.storage_size == (self.width, self.height):
+            if self.pixel_buffers is None:
+                glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self.width, self.height,
+                                self.format, self.type, texture_data.ctypes.data)
+                if self.mipmaps == CPU_MIPMAPS:
+                    uploaded_bytes += self.upload_mipmaps(texture_data, True)
+            else:
+                self.upload_through_pixel_buffers(texture_data)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, self.internal_format, self.width,
+                         self.height, 0, self.format, self.type, texture_data.ctypes.data)
+            if self.mipmaps == CPU_MIPMAPS:
+                uploaded_bytes += self.upload_mipmaps(texture_data, False)
+            self.storage_size = (self.width, self.height)
+            if self.pixel_buffers is not None:
+                # prime the buffer the next upload will read from
+                self.fill_pixel_buffer(self.pixel_buffers[self.pixel_buffer_index], texture_data)
+                RENDER_STATE.bind_buffer(GL_PIXEL_UNPACK_BUFFER, 0)
+            else:
+                glFlush()
+        if self.mipmaps == GPU_MIPMAPS:
+            glGenerateMipmap(GL_TEXTURE_2D)
         self.uploaded = True
+        RENDER_STATS.texture_uploads += 1
+        RENDER_STATS.texture_upload_bytes += uploaded_bytes
+
+    def upload_mipmaps(self, texture_data: np.ndarray, update: bool) -> int:
+        """
+        Uploads the levels below the base level, into the existing storage if update is set
+        """
+        uploaded_bytes = 0
+        for level, image in enumerate(mipmap_pyramid(texture_data), 1):
+            image = np.ascontiguousarray(image)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, unpack_alignment(image))
+            height, width = image.shape[:2]
+            if update:
+                glTexSubImage2D(GL_TEXTURE_2D, level, 0, 0, width, height,
+                                self.format, self.type, image.ctypes.data)
+            else:
+                glTexImage2D(GL_TEXTURE_2D, level, self.internal_format, width, height, 0,
+                             self.format, self.type, image.ctypes.data)
+            uploaded_bytes += image.nbytes
+        return uploaded_bytes
+
+    def to_ktx(self) -> KTXImage:
+        """
+        Reads all levels back from GL for write_ktx. With a compressed internal format this prepares
+        compressed textures offline, loading the file later skips the compression in the driver.
+        """
+        self.bind()
+        compressed = GLint(0)
+        glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_COMPRESSED, ctypes.byref(compressed))
+        internal_format = GLint(0)
+        glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_INTERNAL_FORMAT, ctypes.byref(internal_format))
+
+        type_size = self.type_size
+        pixel_bytes = FORMAT_COMPONENTS.get(self.format, 4) * type_size
+        # KTX pads rows to 4 bytes
+        glPixelStorei(GL_PACK_ALIGNMENT, 4)
+        levels = []
+        for level in range(self.levels):
+            if compressed.value:
+                size = GLint(0)
+                glGetTexLevelParameteriv(GL_TEXTURE_2D, level, GL_TEXTURE_COMPRESSED_IMAGE_SIZE, ctypes.byref(size))
+                data = ctypes.create_string_buffer(size.value)
+                glGetCompressedTexImage(GL_TEXTURE_2D, level, data)
+            else:
+                width, height = max(1, self.width >> level), max(1, self.height >> level)
+                data = ctypes.create_string_buffer(-(-width * pixel_bytes // 4) * 4 * height)
+                glGetTexImage(GL_TEXTURE_2D, level, self.format, self.type, data)
+            levels.append(data.raw)
+
+        base_format = BASE_FORMATS.get(internal_format.value, GL_RGB)
+        if compressed.value:
+            return KTXImage(0, 1, 0, internal_format.value, base_format, self.width, self.height, levels)
+        return KTXImage(self.type, type_size, self.format, internal_format.value, base_format,
+                        self.width, self.height, levels)
+
+    @property
+    def type_size(self) -> int:
+        # bytes per component of the client side image
+        return np.asarray(self.image).itemsize
+
+    def upload_through_pixel_buffers(self, texture_data: np.ndarray):
+        # the texture is updated from the buffer filled during the previous upload,
+        # while the current image is copied into the other one
+        RENDER_STATE.bind_buffer(GL_PIXEL_UNPACK_BUFFER, self.pixel_buffers[self.pixel_buffer_index])
+        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self.width, self.height, self.format, self.type, 0)
+
+        self.pixel_buffer_index = (self.pixel_buffer_index + 1) % 2
+        self.fill_pixel_buffer(self.pixel_buffers[self.pixel_buffer_index], texture_data)
+
+        # client memory uploads must not be interpreted as buffer offsets
+        RENDER_STATE.bind_buffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+    @staticmethod
+    def fill_pixel_buffer(buffer, texture_data: np.ndarray):
+        RENDER_STATE.bind_buffer(GL_PIXEL_UNPACK_BUFFER, buffer)
+        # orphan the old storage so we don't wait for GL to finish reading it
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, texture_data.nbytes, None, GL_STREAM_DRAW)
+        pointer = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+        if pointer:
+            ctypes.memmove(pointer, texture_data.ctypes.data, texture_data.nbytes)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
 
     def bind(self):
+        RENDER_STATS.texture_binds += 1
         if not self.uploaded:
             self.upload()
         else:
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, self.handle)
+            RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.handle)
 
     def unbind(self):
-        glBindTexture(GL_TEXTURE_2D, 0)
+        RENDER_STATE.bind_texture(GL_TEXTURE_2D, 0)
+
+
+class KTXTexture(Texture):
+    """
+    Texture from a KTX file (see read_ktx). Compressed levels are handed to GL as they are stored,
+    so neither the CPU nor the driver decodes or compresses anything at load time.
+    Files without mipmaps can get GPU_MIPMAPS if they are uncompressed.
+    """
+
+    def __init__(self, ktx: KTXImage, mipmaps: Optional[str] = None, anisotropy: float = 1.0,
+                 min_filter: Optional[int] = None, mag_filter: int = GL_LINEAR):
+        if mipmaps not in [None, GPU_MIPMAPS]:
+            raise AttributeError(f"KTX textures only support {GPU_MIPMAPS} mipmaps, got {mipmaps}")
+        if mipmaps == GPU_MIPMAPS and ktx.compressed:
+            raise AttributeError("Mipmaps of compressed textures have to be stored in the KTX file")
+        if min_filter is None and (len(ktx.levels) > 1 or mipmaps is not None):
+            min_filter = GL_LINEAR_MIPMAP_LINEAR
+        super().__init__(ktx, ktx.gl_format, ktx.gl_type, mipmaps=mipmaps, anisotropy=anisotropy,
+                         min_filter=min_filter, mag_filter=mag_filter, internal_format=ktx.internal_format)
+
+    @property
+    def image(self) -> KTXImage:
+        return self._image
+
+    @image.setter
+    def image(self, value: KTXImage):
+        self._image = value
+        self.width = value.width
+        self.height = value.height
+        self.uploaded = False
+
+    @property
+    def levels(self) -> int:
+        if self.mipmaps is not None:
+            return mipmap_levels(self.width, self.height)
+        return len(self.image.levels)
+
+    @property
+    def type_size(self) -> int:
+        return self.image.gl_type_size
+
+    def to_ktx(self) -> KTXImage:
+        # GL holds exactly the levels of the file unless it generated the mipmaps
+        if self.mipmaps is None:
+            return self.image
+        return super().to_ktx()
+
+    @property
+    def gpu_bytes(self) -> int:
+        if self.image.compressed:
+            return sum(len(level) for level in self.image.levels)
+        return super().gpu_bytes
 
+    def upload(self):
+        if self.handle is None:
+            self.create_handle()
+        RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.handle)
+
+        ktx = self.image
+        # rows in KTX files are padded to 4 bytes
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        for level, data in enumerate(ktx.levels):
+            width, height = ktx.level_size(level)
+            if ktx.compressed:
+                glCompressedTexImage2D(GL_TEXTURE_2D, level, ktx.internal_format, width, height, 0, len(data), data)
+            else:
+                glTexImage2D(GL_TEXTURE_2D, level, ktx.internal_format, width, height, 0,
+                             ktx.gl_format, ktx.gl_type, data)
+        # files may stop before the 1x1 level
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, self.levels - 1)
+        if self.mipmaps == GPU_MIPMAPS:
+            glGenerateMipmap(GL_TEXTURE_2D)
+        glFlush()
+
+        self.uploaded = True
+        RENDER_STATS.texture_uploads += 1
+        RENDER_STATS.texture_upload_bytes += sum(len(level) for level in ktx.levels)
 
-def load_image_from_mat(mat):
+
+def load_image_from_mat(mat, streaming: bool = False, pixel_buffers: bool = False):
     img = cv2.flip(mat, 0)
-    return Texture(img, GL_BGR, GL_UNSIGNED_BYTE)
+    return Texture(img, GL_BGR, GL_UNSIGNED_BYTE, streaming, pixel_buffers)
 
 
-def load_image_from_file(file_name: str):
+def decode_image_file(file_name: str):
+    """
+    Reads and flips an image without touching GL, safe to call from worker threads
+    """
     img = cv2.imread(file_name, cv2.IMREAD_COLOR)
     if img is None:
         LOG.error(f"Could not load image {file_name}")
         return None
-    return load_image_from_mat(img)
+    return cv2.flip(img, 0)
+
+
+def load_image_from_file(file_name: str, **options):
+    """
+    Shared through ASSET_CACHE, hand the texture back with ASSET_CACHE.release when done with it.
+    options are passed on to Texture, e.g. mipmaps and anisotropy
+    """
+    # the cache module builds on this one
+    from game_engine.cache import ASSET_CACHE
+    return ASSET_CACHE.get_texture(file_name, **options)
+
+
+def load_texture_from_ktx(file_name: str, **options) -> KTXTexture:
+    return KTXTexture(read_ktx(file_name), **options)
+
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class VideoFrame(NamedTuple):
+    image: np.ndarray
+    timestamp: float
+    index: int
+
+
+class VideoSource:
+    """
+    Decodes a cv2.VideoCapture (camera index or file name) on a worker thread.
+    Frames are flipped and resized into a ring of preallocated images. When the ring is full
+    the worker either drops the oldest frame (DROP_OLDEST) or waits for the renderer (BLOCK).
+    File sources decode as fast as possible unless paced is set, then frames are published
+    at their presentation time.
+    """
+
+    def __init__(self, source: Union[int, str], capacity: int = 3, policy: str = DROP_OLDEST,
+                 flip_code: Optional[int] = 0, scale: float = 1.0, loop: bool = False, paced: bool = False):
+        if policy not in [DROP_OLDEST, BLOCK]:
+            raise AttributeError(f"Unknown frame policy {policy}")
+        if capacity < 1:
+            raise AttributeError(f"Capacity has to be at least 1, got {capacity}")
+        self.source = source
+        self.policy = policy
+        self.flip_code = flip_code
+        self.scale = scale
+        self.loop = loop
+        self.is_file = isinstance(source, str)
+        self.paced = paced and self.is_file
+
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video source {source}")
+
+        self.raw_frame = None
+        self.flipped_frame = None
+        self.frame_index = 0
+        self.dropped_frames = 0
+        self.finished = False
+        self.start_time = time.monotonic()
+
+        # the first frame is decoded synchronously to size the ring
+        ok, self.raw_frame = self.capture.read()
+        if not ok:
+            raise IOError(f"Could not read from video source {source}")
+        first_frame = self.process_frame(self.raw_frame, None)
+
+        # capacity ready frames + one held by the renderer + one being decoded
+        self.frames = [first_frame] + [np.empty_like(first_frame) for _ in range(capacity + 1)]
+        self.capacity = capacity
+        self.free_slots = deque(range(1, len(self.frames)))
+        self.ready = deque([(0, self.get_timestamp(), 0)])
+        self.held_slot = None
+
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"VideoSource({source})", daemon=True)
+        self.thread.start()
+
+    @property
+    def shape(self):
+        return self.frames[0].shape
+
+    def get_timestamp(self) -> float:
+        if self.is_file:
+            return self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return time.monotonic() - self.start_time
+
+    def process_frame(self, raw: np.ndarray, out: Optional[np.ndarray]) -> np.ndarray:
+        if self.scale != 1.0:
+            if self.flip_code is not None:
+                self.flipped_frame = cv2.flip(raw, self.flip_code, dst=self.flipped_frame)
+                raw = self.flipped_frame
+            if out is None:
+                return cv2.resize(raw, (0, 0), fx=self.scale, fy=self.scale)
+            height, width = out.shape[:2]
+            return cv2.resize(raw, (width, height), dst=out)
+
+        if self.flip_code is not None:
+            return cv2.flip(raw, self.flip_code, dst=out)
+        if out is None:
+            return raw.copy()
+        np.copyto(out, raw)
+        return out
+
+    def acquire_slot(self) -> Optional[int]:
+        with self.condition:
+            while not self.free_slots:
+                if not self.running:
+                    return None
+                if self.policy == DROP_OLDEST:
+                    slot, _, _ = self.ready.popleft()
+                    self.dropped_frames += 1
+                    return slot
+                self.condition.wait()
+            return self.free_slots.popleft()
+
+    def read_raw_frame(self) -> bool:
+        ok, self.raw_frame = self.capture.read(self.raw_frame)
+        if not ok and self.is_file and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.start_time = time.monotonic()
+            ok, self.raw_frame = self.capture.read(self.raw_frame)
+        return ok
+
+    def run(self):
+        while self.running:
+            slot = self.acquire_slot()
+            if slot is None:
+                break
+
+            if not self.read_raw_frame():
+                with self.condition:
+                    self.free_slots.append(slot)
+                    self.finished = True
+                    self.condition.notify_all()
+                break
+            timestamp = self.get_timestamp()
+            self.frame_index += 1
+
+            frame = self.process_frame(self.raw_frame, self.frames[slot])
+            if frame.shape != self.frames[slot].shape:
+                LOG.warning(f"Video source {self.source} changed its frame size, dropping frame")
+                with self.condition:
+                    self.free_slots.append(slot)
+                continue
+
+            if self.paced:
+                delay = self.start_time + timestamp - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with self.condition:
+                self.ready.append((slot, timestamp, self.frame_index))
+                self.condition.notify_all()
+
+    def poll(self, latest: bool = True) -> Optional[VideoFrame]:
+        """
+        Returns the next decoded frame without blocking, or None if there is no new frame.
+        With latest=True all but the newest frame are skipped.
+        The returned image stays valid until the next successful poll.
+        """
+        with self.condition:
+            if not self.ready:
+                return None
+            slot, timestamp, index = self.ready.popleft()
+            if latest:
+                while self.ready:
+                    self.free_slots.append(slot)
+                    slot, timestamp, index = self.ready.popleft()
+            if self.held_slot is not None:
+                self.free_slots.append(self.held_slot)
+            self.held_slot = slot
+            self.condition.notify_all()
+        return VideoFrame(self.frames[slot], timestamp, index)
+
+    def wait_for_frame(self, timeout: Optional[float] = None) -> Optional[VideoFrame]:
+        # blocking variant of poll(latest=False), meant for tools and tests
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready or self.finished or not self.running, timeout)
+        return self.poll(latest=False)
+
+    @property
+    def exhausted(self) -> bool:
+        with self.condition:
+            return self.finished and not self.ready
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.capture.release()
 
 
 def get_current_directory():
     return os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 
 
-TEXTURE_MESH_SHADER = None
-COLOR_MESH_SHADER = None
+def load_builtin_shader(name: str) -> Shader:
+    """
+    One of the shaders next to this file, shared through the shader registry
+    """
+    dir_name = get_current_directory()
+    return SHADER_REGISTRY.get(f"{dir_name}/{name}.vert", f"{dir_name}/{name}.frag")
+
+
+def get_texture_mesh_shader() -> Shader:
+    return load_builtin_shader("texture")
+
+
+def get_color_mesh_shader() -> Shader:
+    return load_builtin_shader("color")
 
 
 class MeshSurface:
@@ -89,80 +674,183 @@ class MeshSurface:
         self.vertex_attributes = vertex_attributes
         self.uniforms = uniforms
         self.vao = VAO()
+        self.vertex_buffer = None
+        self.index_buffer = None
         self.is_setup = False
+        # shader version the VAO was set up for, attribute locations can move when a shader is reloaded
+        self.setup_version = None
+        self.texture = None
+        self.bounds = None
+        # blended surfaces are drawn after opaque ones, sorted back to front by a render queue
+        self.blended = False
+
+        # the instanced path uses its own shader and a second VAO with the instance attributes
+        self.instanced_shader_name = None
+        self.instanced_vao = None
+        self.instanced_setup_key = None
+
+    def delete(self):
+        """
+        Frees the GL buffers, they are recreated from the kept vertex data on the next draw
+        """
+        self.vao.delete()
+        if self.instanced_vao is not None:
+            self.instanced_vao.delete()
+            self.instanced_setup_key = None
+        self.vertex_buffer.delete()
+        if self.index_buffer is not None:
+            self.index_buffer.delete()
+        self.is_setup = False
+
+    @property
+    def gpu_bytes(self) -> int:
+        size = self.vertex_buffer.data.nbytes
+        if self.index_buffer is not None:
+            size += self.index_buffer.data.nbytes
+        return size
+
+    def set_vertex_data(self, data: np.ndarray, nums_per_vertex: int, indices=None, deduplicate: bool = True):
+        """
+        Creates the vertex buffer and, if indices are given or deduplication is enabled, the index buffer.
+        The first three numbers of every vertex are its position, they define the bounds of the mesh.
+        """
+        self.bounds = Bounds.from_points(np.asarray(data).reshape((-1, nums_per_vertex))[:, :3])
+        if indices is None and deduplicate:
+            data, indices = deduplicate_vertices(data)
+        self.vertex_buffer = array_buffer(data, nums_per_vertex)
+        if indices is not None:
+            self.index_buffer = index_buffer(indices, len(self.vertex_buffer))
 
     def setup(self):
         self.shader.bind()
         self.vao.bind()
         self.vertex_buffer.bind()
+        if self.index_buffer is not None:
+            # the element array binding is stored in the VAO
+            self.index_buffer.bind()
 
         for index, attrib in enumerate(self.vertex_attributes):
             attrib.bind(index, self.shader)
         self.is_setup = True
-
-    def draw(self, uniforms: List[Uniform]):
-        if not self.is_setup:
+        self.setup_version = self.shader.version
+
+    def draw(self, uniforms: List[Uniform], queue=None):
+        """
+        Draws right away, or submits the draw to a RenderQueue that sorts and issues it later
+        """
+        if queue is not None:
+            queue.submit(self, uniforms)
+            return
+        self.render(uniforms)
+
+    def render(self, uniforms: List[Uniform]):
+        if not self.is_setup or self.setup_version != self.shader.version:
             self.setup()
 
         self.shader.bind()
         self.vao.bind()
 
-        for uniform in self.uniforms + uniforms:
+        uniforms = self.uniforms + uniforms
+        FRAME_UNIFORMS.set_from_uniforms(uniforms)
+        for uniform in uniforms:
             uniform.bind(self.shader)
 
-        glDrawArrays(GL_TRIANGLES, 0, len(self.vertex_buffer))
+        if self.index_buffer is not None:
+            glDrawElements(GL_TRIANGLES, len(self.index_buffer), self.index_buffer.element_type, 0)
+            RENDER_STATS.count_draw(len(self.index_buffer))
+        else:
+            glDrawArrays(GL_TRIANGLES, 0, len(self.vertex_buffer))
+            RENDER_STATS.count_draw(len(self.vertex_buffer))
+        # shader and VAO stay bound, the next surface sharing them skips the rebind
 
-        self.vao.unbind()
-        self.shader.unbind()
+    @property
+    def instanced_shader(self) -> Shader:
+        return load_builtin_shader(self.instanced_shader_name)
+
+    def setup_instanced(self, instances: InstanceBuffer):
+        shader = self.instanced_shader
+        shader.bind()
+        if self.instanced_vao is None:
+            self.instanced_vao = VAO()
+        self.instanced_vao.bind()
+
+        self.vertex_buffer.bind()
+        if self.index_buffer is not None:
+            self.index_buffer.bind()
+        for index, attrib in enumerate(self.vertex_attributes):
+            attrib.bind(index, shader)
+
+        instances.bind()
+        for index, attrib in enumerate(instances.attributes, len(self.vertex_attributes)):
+            attrib.bind(index, shader)
+        self.instanced_setup_key = (id(instances), instances.handle.value, shader.version)
+
+    def draw_instanced(self, instances: InstanceBuffer, uniforms: List[Uniform]):
+        """
+        Draws one copy of the mesh per instance with a single draw call.
+        The model matrix comes from the instance buffer, u_Model is ignored.
+        """
+        if len(instances) == 0:
+            return
+        if not instances.uploaded:
+            instances.upload()
+        shader = self.instanced_shader
+        if self.instanced_setup_key != (id(instances), instances.handle.value, shader.version):
+            self.setup_instanced(instances)
+
+        shader.bind()
+        self.instanced_vao.bind()
+
+        uniforms = self.uniforms + uniforms
+        FRAME_UNIFORMS.set_from_uniforms(uniforms)
+        for uniform in uniforms:
+            uniform.bind(shader)
+
+        if self.index_buffer is not None:
+            glDrawElementsInstanced(GL_TRIANGLES, len(self.index_buffer), self.index_buffer.element_type, 0,
+                                    len(instances))
+            RENDER_STATS.count_draw(len(self.index_buffer), len(instances))
+        else:
+            glDrawArraysInstanced(GL_TRIANGLES, 0, len(self.vertex_buffer), len(instances))
+            RENDER_STATS.count_draw(len(self.vertex_buffer), len(instances))
 
 
 class ColorMeshSurface(MeshSurface):
-    def __init__(self, points: List[vec3], colors: List[vec3]):
+    def __init__(self, points: Union[List[vec3], np.ndarray], colors: Union[List[vec3], np.ndarray],
+                 indices=None, deduplicate: bool = True):
         attributes = [VertexAttribute('a_Position', 3, 6, 0),
                       VertexAttribute('a_Color', 3, 6, 3)]
         uniforms = [Uniform("u_Model", identity())]
         super().__init__(attributes, uniforms)
-        data = []
-        for point, color in zip(points, colors):
-            data += point.to_list()
-            data += color.to_list()
-        self.vertex_buffer = array_buffer(data, 6)
+        data = np.hstack((to_array(points, 3), to_array(colors, 3)))
+        self.set_vertex_data(data, 6, indices, deduplicate)
+        self.instanced_shader_name = "color_instanced"
 
-        global COLOR_MESH_SHADER
-        if COLOR_MESH_SHADER is None:
-            dir_name = get_current_directory()
-            COLOR_MESH_SHADER = Shader(
-                f"{dir_name}/color.vert", f"{dir_name}/color.frag")
-            LOG.info("Loaded color mesh shader")
-        self.shader = COLOR_MESH_SHADER
+        self.shader = get_color_mesh_shader()
 
 
 class TextureMeshSurface(MeshSurface):
-    def __init__(self, points: List[vec3], uvs: List[vec2], texture: Texture):
+    def __init__(self, points: Union[List[vec3], np.ndarray], uvs: Union[List[vec2], np.ndarray], texture: Texture,
+                 indices=None, deduplicate: bool = True):
         attributes = [VertexAttribute('a_Position', 3, 5, 0),
                       VertexAttribute('a_UV', 2, 5, 3)]
         uniforms = [Uniform("u_TextureSampler", 0)]
         super().__init__(attributes, uniforms)
-        data = []
-        for point, uv in zip(points, uvs):
-            data += point.to_list()
-            data += uv.to_list()
-        self.vertex_buffer = array_buffer(data, 5)
+        data = np.hstack((to_array(points, 3), to_array(uvs, 2)))
+        self.set_vertex_data(data, 5, indices, deduplicate)
         self.texture = texture
+        self.instanced_shader_name = "texture_instanced"
 
-        global TEXTURE_MESH_SHADER
-        if TEXTURE_MESH_SHADER is None:
-            dir_name = get_current_directory()
-            TEXTURE_MESH_SHADER = Shader(
-                f"{dir_name}/texture.vert", f"{dir_name}/texture.frag")
-            LOG.info("Loaded texture mesh shader")
-        self.shader = TEXTURE_MESH_SHADER
+        self.shader = get_texture_mesh_shader()
 
-    def draw(self, additional_uniforms):
+    def render(self, additional_uniforms):
         self.texture.bind()
         found_model = list(
             filter(lambda u: u.name == "u_Model", additional_uniforms))
         if not found_model:
-            additional_uniforms.append(Uniform("u_Model", identity()))
-        super().draw(additional_uniforms)
-        self.texture.unbind()
+            additional_uniforms = additional_uniforms + [Uniform("u_Model", identity())]
+        super().render(additional_uniforms)
+
+    def draw_instanced(self, instances: InstanceBuffer, uniforms: List[Uniform]):
+        self.texture.bind()
+        super().draw_instanced(instances, uniforms)
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from pyglet.gl import GL_BGR, GL_UNSIGNED_BYTE
+
+from game_engine.asset import Texture, KTXTexture, decode_image_file
+from game_engine.ktx import read_ktx
+
+LOG = logging.getLogger()
+
+
+def hash_file(file_name: str) -> str:
+    sha = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, key: Hashable, resource, gpu_bytes: int):
+        self.key = key
+        self.resource = resource
+        self.gpu_bytes = gpu_bytes
+        self.aliases = set()
+        # get() calls without a matching release(), entries with users are never evicted
+        self.users = 0
+
+    def __repr__(self):
+        return f"CacheEntry({self.key}, {self.gpu_bytes} bytes, {self.users} users)"
+
+
+class AssetCache:
+    """
+    Shares textures and meshes between users and keeps their estimated GPU memory below a budget.
+    Every get() counts as a user until the resource is handed back with release().
+    Resources are stored least recently used first. When the budget is exceeded the oldest ones
+    without users are evicted and their GL objects deleted. Resources that are still in use are kept,
+    even if that means going over the budget, deleting them would only make their next bind upload
+    a copy the cache doesn't know about.
+    """
+
+    def __init__(self, budget_bytes: int = 512 * 1024 * 1024, hash_contents: bool = True):
+        self.budget_bytes = budget_bytes
+        self.hash_contents = hash_contents
+        self.entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        # (path, options) -> content key, so the same file under different paths is shared
+        self.aliases: Dict[Hashable, Hashable] = {}
+        # id(resource) -> key, for release()
+        self.resource_keys: Dict[int, Hashable] = {}
+        self.gpu_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.aliases.get(key, key) in self.entries
+
+    def get(self, key: Hashable, create: Callable[[], Any], alias: Hashable = None):
+        """
+        Returns the resource stored under key, creating it with create() if it is missing.
+        alias is an additional key (e.g. path and options) that maps to the same resource.
+        The caller is a user of the resource until it calls release().
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            entry.users += 1
+        else:
+            self.misses += 1
+            resource = create()
+            if resource is None:
+                return None
+            entry = CacheEntry(key, resource, resource.gpu_bytes)
+            entry.users = 1
+            self.entries[key] = entry
+            self.resource_keys[id(resource)] = key
+            self.gpu_bytes += entry.gpu_bytes
+            self.evict()
+
+        if alias is not None and alias != key:
+            self.aliases[alias] = key
+            entry.aliases.add(alias)
+        return entry.resource
+
+    def release(self, resource):
+        """
+        Hands back a resource from get(), it may be evicted once nobody uses it anymore
+        """
+        key = self.resource_keys.get(id(resource))
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None or entry.resource is not resource:
+            raise AttributeError(f"{resource} is not in the asset cache")
+        if entry.users == 0:
+            raise AttributeError(f"{resource} was released more often than it was requested")
+        entry.users -= 1
+        self.evict()
+
+    @staticmethod
+    def texture_alias(file_name: str, options: dict) -> Hashable:
+        return file_name, tuple(sorted(options.items()))
+
+    def texture_key(self, file_name: str, options: dict) -> Optional[Hashable]:
+        """
+        Content key of a texture file, doesn't touch the cache and can run on a worker thread
+        """
+        alias = self.texture_alias(file_name, options)
+        if not self.hash_contents:
+            return alias
+        try:
+            return hash_file(file_name), alias[1]
+        except OSError as e:
+            LOG.error(f"Could not hash {file_name}: {e}")
+            return None
+
+    def cached_texture(self, file_name: str, **options) -> Optional[Texture]:
+        """
+        The texture if it is cached under this path and options, counts as a get()
+        """
+        key = self.aliases.get(self.texture_alias(file_name, options))
+        if key is None or key not in self.entries:
+            return None
+        return self.get(key, None)
+
+    def get_texture(self, file_name: str, image=None, key: Hashable = None, **options) -> Optional[Texture]:
+        """
+        options are passed on to Texture and are part of the cache key, .ktx files become a KTXTexture.
+        image (or the KTXImage) and key can come from a worker, see AssetLoader.load_texture.
+        """
+        texture = self.cached_texture(file_name, **options)
+        if texture is not None:
+            return texture
+
+        alias = self.texture_alias(file_name, options)
+        if key is None:
+            key = self.texture_key(file_name, options)
+            if key is None:
+                return None
+
+        def create():
+            if file_name.lower().endswith(".ktx"):
+                try:
+                    ktx = image if image is not None else read_ktx(file_name)
+                except IOError as e:
+                    LOG.error(f"Could not load {file_name}: {e}")
+                    return None
+                return KTXTexture(ktx, **options)
+            decoded = image if image is not None else decode_image_file(file_name)
+            if decoded is None:
+                return None
+            return Texture(decoded, GL_BGR, GL_UNSIGNED_BYTE, **options)
+
+        return self.get(key, create, alias)
+
+    def get_mesh(self, key: Hashable, create: Callable[[], Any]):
+        """
+        create() has to return a MeshSurface (or anything with gpu_bytes and delete()), see release()
+        """
+        return self.get(key, create)
+
+    def update_size(self, key: Hashable):
+        """
+        Re-reads gpu_bytes of a resource whose storage changed, e.g. a texture with a new image
+        """
+        entry = self.entries[self.aliases.get(key, key)]
+        self.gpu_bytes -= entry.gpu_bytes
+        entry.gpu_bytes = entry.resource.gpu_bytes
+        self.gpu_bytes += entry.gpu_bytes
+        self.evict()
+
+    def remove(self, key: Hashable):
+        """
+        Deletes an unused resource, resources with users have to be released first
+        """
+        entry = self.entries[self.aliases.get(key, key)]
+        if entry.users > 0:
+            raise AttributeError(f"{entry} is still in use")
+        self.delete_entry(entry)
+
+    def delete_entry(self, entry: CacheEntry):
+        del self.entries[entry.key]
+        for alias in entry.aliases:
+            self.aliases.pop(alias, None)
+        self.resource_keys.pop(id(entry.resource), None)
+        self.gpu_bytes -= entry.gpu_bytes
+        entry.resource.delete()
+
+    def evict(self):
+        if self.gpu_bytes <= self.budget_bytes:
+            return
+        for entry in [entry for entry in self.entries.values() if entry.users == 0]:
+            self.delete_entry(entry)
+            self.evictions += 1
+            LOG.info(f"Evicted {entry.key} from the asset cache")
+            if self.gpu_bytes <= self.budget_bytes:
+                return
+
+    def clear(self):
+        """
+        Deletes every resource, including those still in use, e.g. when shutting down
+        """
+        for entry in list(self.entries.values()):
+            self.delete_entry(entry)
+
+
+ASSET_CACHE = AssetCache()
@@ -39,3 +39,4 @@ class Camera:
 
         rotation_speed = 1
         self.rotation.y += horizontal_rotation * rotation_speed
+        data.view_matrix = self.get_view_matrix()
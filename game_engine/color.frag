@@ -1,5 +1,9 @@
-varying vec3 v_Color;
+#version 140
+
+in vec3 v_Color;
+
+out vec4 o_Color;
 
 void main() {
-    gl_FragColor = vec4(v_Color, 1.0);
+    o_Color = vec4(v_Color, 1.0);
 }
@@ -1,14 +1,19 @@
-attribute vec3 a_Position;
-attribute vec3 a_Color;
+#version 140
+
+in vec3 a_Position;
+in vec3 a_Color;
 
 uniform mat4 u_Model;
-uniform mat4 u_View;
-uniform mat4 u_Projection;
 
-varying vec3 v_Color;
+layout(std140, row_major) uniform FrameUniforms {
+    mat4 u_View;
+    mat4 u_Projection;
+    mat4 u_ViewProjection;
+};
+
+out vec3 v_Color;
 
 void main() {
-    mat4 ModelViewProjection = u_Projection * u_View * u_Model;
-    gl_Position = ModelViewProjection * vec4(a_Position, 1);
+    gl_Position = u_ViewProjection * u_Model * vec4(a_Position, 1);
     v_Color = a_Color;
 }
@@ -0,0 +1,19 @@
+#version 140
+
+in vec3 a_Position;
+in vec3 a_Color;
+in mat4 a_Model;
+in vec4 a_Tint;
+
+layout(std140, row_major) uniform FrameUniforms {
+    mat4 u_View;
+    mat4 u_Projection;
+    mat4 u_ViewProjection;
+};
+
+out vec4 v_Color;
+
+void main() {
+    gl_Position = u_ViewProjection * a_Model * vec4(a_Position, 1);
+    v_Color = vec4(a_Color, 1.0) * a_Tint;
+}
@@ -0,0 +1,105 @@
+import numpy as np
+
+from game_engine.math import mat4
+
+
+class Bounds:
+    """
+    Axis aligned box and enclosing sphere of a set of points in model space
+    """
+    __slots__ = ('minimum', 'maximum', 'center', 'radius')
+
+    def __init__(self, minimum, maximum, center=None, radius: float = None):
+        self.minimum = np.asarray(minimum, dtype=np.float32)
+        self.maximum = np.asarray(maximum, dtype=np.float32)
+        self.center = (self.minimum + self.maximum) / 2 if center is None else np.asarray(center, dtype=np.float32)
+        if radius is None:
+            radius = float(np.linalg.norm(self.maximum - self.center))
+        self.radius = radius
+
+    @classmethod
+    def from_points(cls, points: np.ndarray):
+        points = np.asarray(points, dtype=np.float32).reshape((-1, 3))
+        if len(points) == 0:
+            return cls(np.zeros(3), np.zeros(3), radius=0.0)
+        minimum = points.min(axis=0)
+        maximum = points.max(axis=0)
+        center = (minimum + maximum) / 2
+        # the sphere around the box center that contains every point
+        radius = float(np.sqrt(np.max(np.sum((points - center) ** 2, axis=1))))
+        return cls(minimum, maximum, center, radius)
+
+    @property
+    def extents(self) -> np.ndarray:
+        return (self.maximum - self.minimum) / 2
+
+    def __repr__(self):
+        return f"Bounds({self.minimum.tolist()}, {self.maximum.tolist()}, radius={self.radius})"
+
+
+def frustum_planes(view_projection: mat4) -> np.ndarray:
+    """
+    Extracts the 6 normalized planes (a, b, c, d) of a row-major view-projection matrix.
+    A point p is inside a plane if a * p.x + b * p.y + c * p.z + d >= 0.
+    """
+    m = view_projection.numbers.astype(np.float64)
+    planes = np.array([
+        m[3] + m[0],  # left
+        m[3] - m[0],  # right
+        m[3] + m[1],  # bottom
+        m[3] - m[1],  # top
+        m[3] + m[2],  # near
+        m[3] - m[2],  # far
+    ])
+    planes /= np.linalg.norm(planes[:, :3], axis=1)[:, np.newaxis]
+    return planes.astype(np.float32)
+
+
+class Frustum:
+    def __init__(self, view_projection: mat4):
+        self.planes = frustum_planes(view_projection)
+
+    @classmethod
+    def from_matrices(cls, projection: mat4, view: mat4):
+        # e.g. Window.projection_matrix and Camera.get_view_matrix()
+        return cls(projection * view)
+
+    def cull_spheres(self, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of the (N, 3) world space spheres that are at least partially inside
+        """
+        centers = np.asarray(centers, dtype=np.float32).reshape((-1, 3))
+        distances = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        return np.all(distances >= -np.asarray(radii, dtype=np.float32).reshape((-1, 1)), axis=1)
+
+    def cull_boxes(self, centers: np.ndarray, extents: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of the (N, 3) world space boxes (center, half size) that are at least partially inside
+        """
+        centers = np.asarray(centers, dtype=np.float32).reshape((-1, 3))
+        extents = np.asarray(extents, dtype=np.float32).reshape((-1, 3))
+        distances = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        # projection of the box onto each plane normal
+        reach = extents @ np.abs(self.planes[:, :3]).T
+        return np.all(distances >= -reach, axis=1)
+
+
+def world_spheres(models: np.ndarray, centers: np.ndarray, radii: np.ndarray):
+    """
+    Moves model space bounding spheres into world space for (N, 4, 4) row-major model matrices
+    """
+    rotation_scale = models[:, :3, :3]
+    world_centers = np.einsum('nij,nj->ni', rotation_scale, centers) + models[:, :3, 3]
+    # non uniform scale grows the sphere by the largest axis scale
+    scale = np.sqrt(np.max(np.sum(rotation_scale ** 2, axis=1), axis=1))
+    return world_centers, radii * scale
+
+
+def world_boxes(models: np.ndarray, centers: np.ndarray, extents: np.ndarray):
+    """
+    Moves model space boxes into world space, the result encloses the rotated box
+    """
+    rotation_scale = models[:, :3, :3]
+    world_centers = np.einsum('nij,nj->ni', rotation_scale, centers) + models[:, :3, 3]
+    world_extents = np.einsum('nij,nj->ni', np.abs(rotation_scale), extents)
+    return world_centers, world_extents
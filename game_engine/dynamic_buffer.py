@@ -0,0 +1,207 @@
+import logging
+from collections import deque
+from ctypes import memmove, POINTER
+
+import numpy as np
+from pyglet.gl import GLuint, GLenum, GLsizeiptr, GLvoid, GLbitfield, GL_ARRAY_BUFFER, GL_STREAM_DRAW
+from pyglet.gl import glGenBuffers, glDeleteBuffers, glBufferData, glMapBufferRange, glUnmapBuffer
+from pyglet.gl import glFenceSync, glClientWaitSync, glDeleteSync, glCopyBufferSubData, gl_info
+from pyglet.gl import GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER
+from pyglet.gl import GL_MAP_WRITE_BIT, GL_MAP_UNSYNCHRONIZED_BIT, GL_MAP_INVALIDATE_RANGE_BIT
+from pyglet.gl import GL_SYNC_GPU_COMMANDS_COMPLETE, GL_SYNC_FLUSH_COMMANDS_BIT, GL_WAIT_FAILED, GL_TIMEOUT_EXPIRED
+from pyglet.gl.lib import link_GL, MissingFunctionException
+
+from game_engine.render_state import RENDER_STATE
+from game_engine.render_stats import RENDER_STATS
+
+LOG = logging.getLogger()
+
+# ARB_buffer_storage (GL 4.4) is not part of the pyglet bindings
+glBufferStorage = link_GL('glBufferStorage', None, [GLenum, GLsizeiptr, POINTER(GLvoid), GLbitfield],
+                          'ARB_buffer_storage')
+GL_MAP_PERSISTENT_BIT = 0x0040
+GL_MAP_COHERENT_BIT = 0x0080
+
+# nanoseconds a fence wait blocks before it is logged and retried
+FENCE_TIMEOUT = 100 * 1000 * 1000
+
+
+def supports_persistent_mapping() -> bool:
+    return gl_info.have_version(4, 4) or gl_info.have_extension("GL_ARB_buffer_storage")
+
+
+class DynamicBuffer:
+    """
+    Buffer for geometry that is rebuilt every frame, e.g. UI quads.
+    One large buffer is allocated once and written front to back like a ring, each write() returns the
+    byte offset of its data. After issuing the draws that read the written data, call fence().
+    A region is only written again after the GPU passed its fence, so writes never wait for the GPU
+    unless the ring wrapped around within the last few frames.
+    With ARB_buffer_storage the buffer stays mapped, otherwise every write maps just its range unsynchronized.
+    If the data of one frame does not fit, the buffer is replaced by one twice the size. Offsets stay valid,
+    but the handle changes, so vertex arrays using the buffer have to be set up again.
+    """
+
+    def __init__(self, buffer_type: int = GL_ARRAY_BUFFER, size: int = 4 * 1024 * 1024, persistent: bool = None):
+        self.type = buffer_type
+        self.size = size
+        self.persistent = supports_persistent_mapping() if persistent is None else persistent
+        self.handle = None
+        self.mapped = None
+
+        self.head = 0
+        # regions written since the last fence, the GPU has not been asked to read them yet
+        self.unfenced = []
+        # (sync, start, end) of regions the GPU may still be reading, oldest first
+        self.fences = deque()
+        # number of writes that had to wait for the GPU
+        self.stalls = 0
+
+    def create(self):
+        self.handle = GLuint()
+        glGenBuffers(1, self.handle)
+        RENDER_STATE.bind_buffer(self.type, self.handle)
+        if self.persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            try:
+                glBufferStorage(self.type, self.size, None, flags)
+                self.mapped = glMapBufferRange(self.type, 0, self.size, flags)
+            except MissingFunctionException:
+                LOG.info("Persistent buffer mapping is not available, mapping every write instead")
+                self.delete()
+                self.persistent = False
+                self.create()
+                return
+        else:
+            glBufferData(self.type, self.size, None, GL_STREAM_DRAW)
+
+    def delete(self):
+        if self.handle is None:
+            return
+        if self.mapped is not None:
+            RENDER_STATE.bind_buffer(self.type, self.handle)
+            glUnmapBuffer(self.type)
+            self.mapped = None
+        while self.fences:
+            self.delete_sync(self.fences[0][0])
+        self.unfenced = []
+        self.head = 0
+        RENDER_STATE.forget_buffer(self.handle)
+        glDeleteBuffers(1, self.handle)
+        self.handle = None
+
+    def bind(self):
+        if self.handle is None:
+            self.create()
+        RENDER_STATE.bind_buffer(self.type, self.handle)
+
+    def unbind(self):
+        RENDER_STATE.bind_buffer(self.type, 0)
+
+    def allocate(self, size: int, alignment: int = 16) -> int:
+        """
+        Reserves size bytes and returns their offset, see write()
+        """
+        if self.handle is None:
+            self.create()
+        start = -(-self.head // alignment) * alignment
+        if start + size > self.size:
+            # the tail of the buffer stays unused for this round
+            start = 0
+        end = start + size
+
+        if end > self.size or any(s < end and start < e for s, e in self.unfenced):
+            # the data of this frame alone does not fit anymore
+            self.grow(max(2 * self.size, self.size + size + alignment))
+            return self.allocate(size, alignment)
+
+        self.wait(start, end)
+        self.head = end
+        self.unfenced.append((start, end))
+        return start
+
+    def write(self, data: np.ndarray, alignment: int = 16) -> int:
+        """
+        Copies data into the next free region and returns its byte offset.
+        An alignment of the vertex size lets draws address the data with a base vertex.
+        """
+        data = np.ascontiguousarray(data)
+        offset = self.allocate(data.nbytes, alignment)
+        if self.mapped is not None:
+            memmove(self.mapped + offset, data.ctypes.data, data.nbytes)
+        else:
+            # no sync needed, the fences already guarantee that the GPU is done with the range
+            RENDER_STATE.bind_buffer(self.type, self.handle)
+            flags = GL_MAP_WRITE_BIT | GL_MAP_UNSYNCHRONIZED_BIT | GL_MAP_INVALIDATE_RANGE_BIT
+            pointer = glMapBufferRange(self.type, offset, data.nbytes, flags)
+            memmove(pointer, data.ctypes.data, data.nbytes)
+            glUnmapBuffer(self.type)
+        RENDER_STATS.buffer_uploads += 1
+        RENDER_STATS.buffer_upload_bytes += data.nbytes
+        return offset
+
+    def fence(self):
+        """
+        Protects everything written since the last fence until the GPU executed the draws issued so far
+        """
+        # drop fences the GPU has passed, so they don't pile up when the ring turns slowly
+        while self.fences and self.signaled(self.fences[0][0]):
+            self.delete_sync(self.fences[0][0])
+        if not self.unfenced:
+            return
+        sync = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        for start, end in self.unfenced:
+            self.fences.append((sync, start, end))
+        self.unfenced = []
+
+    def wait(self, start: int, end: int):
+        syncs = []
+        for sync, fence_start, fence_end in self.fences:
+            if fence_start < end and start < fence_end and sync not in syncs:
+                syncs.append(sync)
+        for sync in syncs:
+            if not self.signaled(sync):
+                self.stalls += 1
+                while True:
+                    result = glClientWaitSync(sync, GL_SYNC_FLUSH_COMMANDS_BIT, FENCE_TIMEOUT)
+                    if result == GL_WAIT_FAILED:
+                        LOG.error("Waiting for a dynamic buffer fence failed")
+                        break
+                    if result != GL_TIMEOUT_EXPIRED:
+                        break
+                    LOG.warning("Still waiting for the GPU to release a dynamic buffer region")
+            self.delete_sync(sync)
+
+    @staticmethod
+    def signaled(sync) -> bool:
+        return glClientWaitSync(sync, 0, 0) not in [GL_TIMEOUT_EXPIRED, GL_WAIT_FAILED]
+
+    def delete_sync(self, sync):
+        # one sync can guard several regions, e.g. both sides of a wrap
+        self.fences = deque(fence for fence in self.fences if fence[0] is not sync)
+        glDeleteSync(sync)
+
+    def grow(self, size: int):
+        LOG.info(f"Growing dynamic buffer from {self.size} to {size} bytes")
+        old_handle = self.handle
+        old_mapped = self.mapped
+        # the old buffer is deleted, GL keeps it alive for draws that are still reading it
+        while self.fences:
+            self.delete_sync(self.fences[0][0])
+
+        self.size = size
+        self.create()
+        # data written this frame but not drawn yet keeps its offset
+        RENDER_STATE.bind_buffer(GL_COPY_READ_BUFFER, old_handle)
+        RENDER_STATE.bind_buffer(GL_COPY_WRITE_BUFFER, self.handle)
+        for start, end in self.unfenced:
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, start, start, end - start)
+        self.head = max((end for _, end in self.unfenced), default=0)
+
+        if old_mapped is not None:
+            glUnmapBuffer(GL_COPY_READ_BUFFER)
+        RENDER_STATE.forget_buffer(old_handle)
+        glDeleteBuffers(1, old_handle)
+
+    def __repr__(self):
+        return f"DynamicBuffer({self.handle}, size={self.size}, head={self.head}, fences={len(self.fences)})"
@@ -0,0 +1,107 @@
+import logging
+
+import cv2
+import numpy as np
+from pyglet.gl import GLuint, glGenFramebuffers, glDeleteFramebuffers, glGenRenderbuffers, glDeleteRenderbuffers
+from pyglet.gl import glBindRenderbuffer, glRenderbufferStorage, glFramebufferTexture2D, glFramebufferRenderbuffer
+from pyglet.gl import glCheckFramebufferStatus, glGenTextures, glDeleteTextures, glTexImage2D, glTexParameterf
+from pyglet.gl import glReadPixels, glPixelStorei, glViewport, GL_FRAMEBUFFER, GL_RENDERBUFFER, GL_FRAMEBUFFER_COMPLETE
+from pyglet.gl import GL_COLOR_ATTACHMENT0, GL_DEPTH_STENCIL_ATTACHMENT, GL_DEPTH24_STENCIL8, GL_TEXTURE_2D
+from pyglet.gl import GL_RGBA8, GL_RGBA, GL_BGRA, GL_RGB, GL_BGR, GL_UNSIGNED_BYTE, GL_PACK_ALIGNMENT
+from pyglet.gl import GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_LINEAR
+
+from game_engine.render_state import RENDER_STATE
+
+LOG = logging.getLogger()
+
+CHANNELS = {GL_RGBA: 4, GL_BGRA: 4, GL_RGB: 3, GL_BGR: 3}
+
+
+def read_pixels(width: int, height: int, pixel_format: int = GL_RGBA, flip: bool = True) -> np.ndarray:
+    """
+    Reads back the bound framebuffer as a (height, width, channels) uint8 array.
+    This waits for the GPU to finish the frame. flip puts the top row first, like cv2 images.
+    """
+    if pixel_format not in CHANNELS:
+        raise AttributeError(f"Can't read pixels in format {pixel_format:#x}")
+    pixels = np.empty((height, width, CHANNELS[pixel_format]), dtype=np.uint8)
+    # rows of RGB data are not 4 byte aligned for every width
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    glReadPixels(0, 0, width, height, pixel_format, GL_UNSIGNED_BYTE, pixels.ctypes.data)
+    if flip:
+        pixels = np.ascontiguousarray(pixels[::-1])
+    return pixels
+
+
+class Framebuffer:
+    """
+    Offscreen render target with an RGBA color texture and a depth/stencil renderbuffer
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.handle = None
+        self.color_texture = None
+        self.depth_buffer = None
+        self.create_handle()
+
+    def create_handle(self):
+        self.color_texture = GLuint()
+        glGenTextures(1, self.color_texture)
+        RENDER_STATE.bind_texture(GL_TEXTURE_2D, self.color_texture)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+
+        self.depth_buffer = GLuint()
+        glGenRenderbuffers(1, self.depth_buffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, self.width, self.height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        self.handle = GLuint()
+        glGenFramebuffers(1, self.handle)
+        RENDER_STATE.bind_framebuffer(self.handle)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.color_texture, 0)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.depth_buffer)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        RENDER_STATE.bind_framebuffer(0)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"Framebuffer of size {self.width}x{self.height} is incomplete: {status:#x}")
+
+    def delete(self):
+        if self.handle is None:
+            return
+        RENDER_STATE.forget_framebuffer(self.handle)
+        glDeleteFramebuffers(1, self.handle)
+        RENDER_STATE.forget_texture(self.color_texture)
+        glDeleteTextures(1, self.color_texture)
+        glDeleteRenderbuffers(1, self.depth_buffer)
+        self.handle = None
+        self.color_texture = None
+        self.depth_buffer = None
+
+    def resize(self, width: int, height: int):
+        if (width, height) == (self.width, self.height):
+            return
+        self.delete()
+        self.width = width
+        self.height = height
+        self.create_handle()
+
+    def bind(self):
+        RENDER_STATE.bind_framebuffer(self.handle)
+        glViewport(0, 0, self.width, self.height)
+
+    @staticmethod
+    def unbind():
+        RENDER_STATE.bind_framebuffer(0)
+
+    def read_pixels(self, pixel_format: int = GL_RGBA, flip: bool = True) -> np.ndarray:
+        RENDER_STATE.bind_framebuffer(self.handle)
+        return read_pixels(self.width, self.height, pixel_format, flip)
+
+    def save(self, file_name: str):
+        cv2.imwrite(file_name, self.read_pixels(GL_BGR))
+        LOG.info(f"Saved framebuffer to {file_name}")
@@ -1,6 +1,7 @@
 from collections import defaultdict
 
 from game_engine.math import vec2, identity
+from game_engine.render_stats import RENDER_STATS
 
 
 class Mouse:
@@ -33,11 +34,22 @@ class BaseGame:
 
 class BaseData:
     def __init__(self):
+        # seconds since the last frame, the fixed step while updating with a fixed time step
         self.frame_time = 0
+        self.simulation_time = 0.0
+        # number of game.update calls this frame
+        self.updates = 0
+        # interpolation factor between the last two simulation steps for render
+        self.alpha = 1.0
+        # counters of the frame being drawn, render_stats.last_frame holds the finished previous frame
+        self.render_stats = RENDER_STATS
         self.mouse = Mouse()
         self.keyboard = Keyboard()
         self.window = WindowData()
         self.projection_matrix = identity()
+        # camera of the frame, uploaded with the projection into the FrameUniforms block before render.
+        # The shaders only read the camera from that block, keep this up to date, e.g. with Camera.update
+        self.view_matrix = identity()
 
     def __repr__(self):
         result = "[BaseData "
@@ -1,15 +1,25 @@
-from datetime import datetime
+import time
+
+from game_engine.profiler import PROFILER
 
 
 class timer:
-    def __init__(self):
+    def __init__(self, name: str = None):
+        # with a name the time is also recorded as a profiler scope of the current frame
+        self.name = name
+        self.scope = None
         self.start = None
         self.end = None
 
     def __enter__(self):
-        self.start = datetime.now()
+        if self.name is not None:
+            self.scope = PROFILER.scope(self.name)
+            self.scope.__enter__()
+        self.start = time.perf_counter_ns()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.end = datetime.now()
+        self.end = time.perf_counter_ns()
+        if self.scope is not None:
+            self.scope.__exit__(exc_type, exc_val, exc_tb)
         diff = self.end - self.start
-        print(f"This took {diff.total_seconds()*1000.0} ms")
+        print(f"This took {diff / 1e6} ms")
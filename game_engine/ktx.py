@@ -0,0 +1,87 @@
+import struct
+from typing import List, NamedTuple
+
+# KTX 1.1 container as described in the Khronos KTX file format specification
+KTX_IDENTIFIER = b"\xabKTX 11\xbb\r\n\x1a\n"
+KTX_ENDIANNESS = 0x04030201
+# endianness, glType, glTypeSize, glFormat, glInternalFormat, glBaseInternalFormat,
+# pixelWidth, pixelHeight, pixelDepth, numberOfArrayElements, numberOfFaces, numberOfMipmapLevels,
+# bytesOfKeyValueData
+KTX_HEADER = struct.Struct("<13I")
+KTX_IMAGE_SIZE = struct.Struct("<I")
+
+
+class KTXImage(NamedTuple):
+    """
+    A 2D texture as stored in a KTX file, levels holds the data of each mipmap level starting with the largest.
+    gl_type and gl_format are 0 for compressed formats.
+    """
+    gl_type: int
+    gl_type_size: int
+    gl_format: int
+    internal_format: int
+    base_internal_format: int
+    width: int
+    height: int
+    levels: List[bytes]
+
+    @property
+    def compressed(self) -> bool:
+        return self.gl_type == 0
+
+    def level_size(self, level: int):
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+
+def padding(size: int) -> int:
+    return -size % 4
+
+
+def read_ktx(file_name: str) -> KTXImage:
+    """
+    Parses a KTX file without touching GL, safe to call from worker threads.
+    Only little endian files with a single 2D image (plus its mipmaps) are supported.
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+
+    if data[:len(KTX_IDENTIFIER)] != KTX_IDENTIFIER:
+        raise IOError(f"{file_name} is not a KTX file")
+    offset = len(KTX_IDENTIFIER)
+    (endianness, gl_type, gl_type_size, gl_format, internal_format, base_internal_format, width, height, depth,
+     array_elements, faces, level_count, key_value_bytes) = KTX_HEADER.unpack_from(data, offset)
+    if endianness != KTX_ENDIANNESS:
+        raise IOError(f"{file_name} is big endian, only little endian KTX files are supported")
+    if depth > 0 or array_elements > 0 or faces != 1 or height == 0:
+        raise IOError(f"{file_name} is not a 2D texture")
+    offset += KTX_HEADER.size + key_value_bytes
+
+    levels = []
+    # 0 levels asks the loader to generate mipmaps, the file holds just the base level
+    for _ in range(max(level_count, 1)):
+        if offset + KTX_IMAGE_SIZE.size > len(data):
+            raise IOError(f"{file_name} is truncated")
+        image_size, = KTX_IMAGE_SIZE.unpack_from(data, offset)
+        offset += KTX_IMAGE_SIZE.size
+        if offset + image_size > len(data):
+            raise IOError(f"{file_name} is truncated")
+        levels.append(data[offset:offset + image_size])
+        offset += image_size + padding(image_size)
+
+    return KTXImage(gl_type, gl_type_size, gl_format, internal_format, base_internal_format, width, height, levels)
+
+
+def write_ktx(file_name: str, image: KTXImage):
+    """
+    Stores an image as KTX, e.g. one returned by Texture.to_ktx() to prepare compressed textures offline.
+    Rows of uncompressed levels have to be padded to 4 bytes already.
+    """
+    with open(file_name, "wb") as f:
+        f.write(KTX_IDENTIFIER)
+        f.write(KTX_HEADER.pack(KTX_ENDIANNESS, image.gl_type, image.gl_type_size, image.gl_format,
+                                image.internal_format, image.base_internal_format, image.width, image.height,
+                                0, 0, 1, len(image.levels), 0))
+        for level in image.levels:
+            f.write(KTX_IMAGE_SIZE.pack(len(level)))
+            f.write(level)
+            f.write(b"\0" * padding(len(level)))
@@ -0,0 +1,149 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from game_engine.asset import Texture, decode_image_file
+from game_engine.cache import ASSET_CACHE
+from game_engine.ktx import read_ktx
+
+LOG = logging.getLogger()
+
+
+class AssetHandle:
+    """
+    Returned immediately by the AssetLoader, asset is set once the main thread created it
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.asset = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+    @property
+    def ready(self) -> bool:
+        return self.done and self.error is None
+
+    @property
+    def failed(self) -> bool:
+        return self.done and self.error is not None
+
+    def __repr__(self):
+        return f"AssetHandle({self.name}, ready={self.ready}, failed={self.failed})"
+
+
+def decode_texture(file_name: str, options: dict):
+    # hashing for the cache key reads the whole file too, both happen on the worker
+    key = ASSET_CACHE.texture_key(file_name, options)
+    image = read_ktx(file_name) if file_name.lower().endswith(".ktx") else decode_image_file(file_name)
+    if key is None or image is None:
+        return None
+    return key, image
+
+
+def create_texture(file_name: str, options: dict, decoded) -> Texture:
+    key, image = decoded
+    texture = ASSET_CACHE.get_texture(file_name, image, key, **options)
+    if texture is not None and not texture.uploaded:
+        # upload now, so the cost is paid inside the loader's time budget and not on first draw
+        texture.upload()
+    return texture
+
+
+class AssetLoader:
+    """
+    Decodes assets on a thread pool and creates the GL objects on the main thread.
+    decode(*args) runs on a worker and must not call GL, create(decoded) runs in update().
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.executor = None
+        # deque append/popleft are thread safe, workers push finished decodes here
+        self.decoded = deque()
+        self.pending = 0
+
+    def submit(self, name: str, decode: Callable[..., Any], create: Callable[[Any], Any], *args) -> AssetHandle:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="AssetLoader")
+        handle = AssetHandle(name)
+        self.pending += 1
+        future = self.executor.submit(decode, *args)
+        future.add_done_callback(lambda f: self.decoded.append((handle, f, create)))
+        return handle
+
+    def load_texture(self, file_name: str, **options) -> AssetHandle:
+        """
+        .ktx files are loaded as they are stored, anything else is decoded with cv2.
+        options are passed on to the texture, e.g. mipmaps and anisotropy.
+        Textures are shared through ASSET_CACHE, a cached one is returned without decoding it again.
+        Hand it back with ASSET_CACHE.release when done with it.
+        """
+        texture = ASSET_CACHE.cached_texture(file_name, **options)
+        if texture is not None:
+            handle = AssetHandle(file_name)
+            handle.asset = texture
+            handle.done = True
+            return handle
+        return self.submit(file_name, decode_texture, partial(create_texture, file_name, options), file_name, options)
+
+    def load_mesh(self, name: str, parse: Callable[..., Any], create: Callable[[Any], Any], *args) -> AssetHandle:
+        """
+        parse(*args) produces the vertex data (e.g. numpy arrays) on a worker,
+        create(data) builds the MeshSurface on the main thread, returning None fails the handle
+        """
+        return self.submit(name, parse, create, *args)
+
+    def update(self, budget: Optional[float] = 0.004) -> int:
+        """
+        Creates decoded assets until the time budget (in seconds) is used up.
+        At least one asset is created per call, budget=None processes everything available.
+        Returns the number of created assets.
+        """
+        start = time.perf_counter()
+        created = 0
+        while self.decoded:
+            if budget is not None and created > 0 and time.perf_counter() - start >= budget:
+                break
+            handle, future, create = self.decoded.popleft()
+            self.finish(handle, future, create)
+            created += 1
+        return created
+
+    def finish(self, handle: AssetHandle, future: Future, create: Callable[[Any], Any]):
+        self.pending -= 1
+        handle.done = True
+        try:
+            decoded = future.result()
+            if decoded is None:
+                raise IOError(f"Could not decode {handle.name}")
+            asset = create(decoded)
+            if asset is None:
+                raise IOError(f"Could not create {handle.name}")
+            handle.asset = asset
+        except Exception as e:
+            handle.error = e
+            LOG.error(f"Could not load {handle.name}: {e}")
+
+    def wait_all(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until every submitted asset is created, e.g. behind a loading screen
+        """
+        start = time.perf_counter()
+        while self.pending > 0:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                return False
+            if not self.update(None):
+                time.sleep(0.001)
+        return True
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+ASSET_LOADER = AssetLoader()
@@ -6,6 +6,8 @@ import numpy as np
 
 # noinspection PyPep8Naming
 class vec2:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x: float = 0, y: float = 0):
         self.x = x
         self.y = y
@@ -69,7 +71,7 @@ class vec2:
 
     @property
     def length(self) -> float:
-        return np.linalg.norm(self.to_list())
+        return math.hypot(self.x, self.y)
 
     def normalize(self):
         length = self.length
@@ -80,6 +82,8 @@ class vec2:
 
 # noinspection PyPep8Naming
 class vec3:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x: float = 0, y: float = 0, z: float = 0, arr=None):
         if arr is not None:
             if len(arr) != 3:
@@ -150,7 +154,7 @@ class vec3:
 
     @property
     def length(self) -> float:
-        return float(np.linalg.norm(self.to_list()))
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
     def copy(self):
         return vec3(self.x, self.y, self.z)
@@ -185,140 +189,346 @@ class vec3:
 
 
 def cross(u, v) -> vec3:
-    return vec3(arr=np.cross(u.to_list(), v.to_list()))
+    return vec3(u.y * v.z - u.z * v.y,
+                u.z * v.x - u.x * v.z,
+                u.x * v.y - u.y * v.x)
 
 
 def dot(u: vec3, v: vec3) -> float:
     return u.x * v.x + u.y * v.y + u.z * v.z
 
 
+def to_array(vectors, size: int) -> np.ndarray:
+    """
+    Converts a list of vec2/vec3 into an (N, size) float32 array, arrays are passed through
+    """
+    if isinstance(vectors, np.ndarray):
+        return np.asarray(vectors, dtype=np.float32).reshape((-1, size))
+    result = np.array([v.to_list() for v in vectors], dtype=np.float32)
+    return result.reshape((-1, size))
+
+
 # noinspection PyPep8Naming
 class mat4:
     """
-    Row-major matrix
+    Row-major matrix backed by a contiguous 4x4 float32 numpy array
     """
+    __slots__ = ('_numbers',)
 
     def __init__(self, arr=None):
-        if arr is None:
-            arr = []
-        self.numbers = []
-        for r in range(4):
-            self.numbers.append([])
-            for c in range(4):
-                if len(arr) > r and len(arr[r]) > c:
-                    num = float(arr[r][c])
-                else:
-                    num = 0
-                self.numbers[r].append(num)
+        numbers = np.zeros((4, 4), dtype=np.float32)
+        if arr is not None:
+            try:
+                values = np.asarray(arr, dtype=np.float32)
+            except ValueError:
+                # ragged nested lists, copy whatever fits into the matrix
+                for r, row in enumerate(arr[:4]):
+                    for c, num in enumerate(row[:4]):
+                        numbers[r][c] = float(num)
+            else:
+                if values.ndim == 2:
+                    numbers[:values.shape[0], :values.shape[1]] = values[:4, :4]
+        self._numbers = numbers
+
+    @classmethod
+    def from_numbers(cls, numbers: np.ndarray):
+        """
+        Wraps an existing 4x4 float32 array without copying it
+        """
+        m = cls.__new__(cls)
+        m._numbers = numbers
+        return m
+
+    @property
+    def numbers(self) -> np.ndarray:
+        return self._numbers
+
+    @numbers.setter
+    def numbers(self, value):
+        self._numbers = np.ascontiguousarray(value, dtype=np.float32).reshape((4, 4))
 
     def __eq__(self, other):
         if type(other) != mat4:
             return False
-        for r in range(4):
-            for c in range(4):
-                if self.numbers[r][c] != other.numbers[r][c]:
-                    return False
-        return True
+        return bool(np.array_equal(self._numbers, other._numbers))
 
     def __str__(self):
-        return f"[{self.numbers[0]}, {self.numbers[1]}, {self.numbers[2]}, {self.numbers[3]}]"
+        rows = self._numbers.tolist()
+        return f"[{rows[0]}, {rows[1]}, {rows[2]}, {rows[3]}]"
 
     def __repr__(self):
         return self.__str__()
 
-    def __mul__(self, other):
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self._numbers
+        return self._numbers.astype(dtype)
+
+    def multiply(self, other, out=None):
+        """
+        Multiplies this matrix with a mat4 or a vec3 (treated as a point).
+        If out is given the result is written into it instead of allocating a new object.
+        """
         if type(other) == mat4:
-            return mat4(list(np.matmul(self.numbers, other.numbers)))
+            if out is None:
+                return mat4.from_numbers(np.matmul(self._numbers, other._numbers))
+            np.matmul(self._numbers, other._numbers, out=out._numbers)
+            return out
         elif type(other) == vec3:
-            res = list(np.matmul(self.numbers, [other.x, other.y, other.z, 1]))
-            return vec3(arr=res[:-1])
+            n = self._numbers
+            x = float(n[0, 0] * other.x + n[0, 1] * other.y + n[0, 2] * other.z + n[0, 3])
+            y = float(n[1, 0] * other.x + n[1, 1] * other.y + n[1, 2] * other.z + n[1, 3])
+            z = float(n[2, 0] * other.x + n[2, 1] * other.y + n[2, 2] * other.z + n[2, 3])
+            if out is None:
+                return vec3(x, y, z)
+            out.x, out.y, out.z = x, y, z
+            return out
         else:
             raise AttributeError(other)
 
+    def __mul__(self, other):
+        return self.multiply(other)
+
+    def __matmul__(self, other):
+        return self.multiply(other)
+
+    def __imul__(self, other):
+        if type(other) != mat4:
+            raise AttributeError(other)
+        # matmul can't write into one of its inputs, so go through a temporary
+        self._numbers[...] = np.matmul(self._numbers, other._numbers)
+        return self
+
+    def __imatmul__(self, other):
+        return self.__imul__(other)
+
     def copy(self):
-        m = mat4()
-        m.numbers = self.numbers.copy()
-        return m
+        return mat4.from_numbers(self._numbers.copy())
 
     def to_list(self, column_major=False):
-        res = []
         if column_major:
-            for r in range(4):
-                for c in range(4):
-                    res.append(self.numbers[c][r])
-        else:
-            for r in range(4):
-                for c in range(4):
-                    res.append(self.numbers[r][c])
-        return res
+            return self._numbers.T.ravel().tolist()
+        return self._numbers.ravel().tolist()
+
+
+_IDENTITY = np.identity(4, dtype=np.float32)
 
 
-def identity():
-    return mat4([
-        [1, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 0, 1, 0],
-        [0, 0, 0, 1]
-    ])
+def identity(out: mat4 = None):
+    if out is None:
+        return mat4.from_numbers(_IDENTITY.copy())
+    out.numbers[...] = _IDENTITY
+    return out
 
 
-def scale(m: mat4, s):
+def _target(m: mat4, out: mat4) -> np.ndarray:
+    if out is None:
+        return m.numbers
+    if out is not m:
+        out.numbers[...] = m.numbers
+    return out.numbers
+
+
+def scale(m: mat4, s, out: mat4 = None):
+    """
+    Applies a scale on top of m (S * m), in place unless out is given
+    """
     if type(s) in [float, int]:
         s = vec3(s, s, s)
 
-    m1 = mat4()
-    m1.numbers = m.numbers
-    m2 = mat4([
-        [s.x, 0, 0, 0],
-        [0, s.y, 0, 0],
-        [0, 0, s.z, 0],
-        [0, 0, 0, 1],
-    ])
-    res = m2 * m1
-    m.numbers = res.numbers
-
-
-def translate(m: mat4, v: vec3):
-    m1 = mat4()
-    m1.numbers = m.numbers
-    m2 = mat4([
-        [1, 0, 0, v.x],
-        [0, 1, 0, v.y],
-        [0, 0, 1, v.z],
-        [0, 0, 0, 1],
-    ])
-    res = m2 * m1
-    m.numbers = res.numbers
-
-
-def rotate(m: mat4, v: vec3, radians=False):
-    if not radians:
-        v *= math.pi / 180
+    numbers = _target(m, out)
+    numbers[0] *= s.x
+    numbers[1] *= s.y
+    numbers[2] *= s.z
+
+
+def translate(m: mat4, v: vec3, out: mat4 = None):
+    """
+    Applies a translation on top of m (T * m), in place unless out is given
+    """
+    numbers = _target(m, out)
+    last_row = numbers[3]
+    numbers[0] += v.x * last_row
+    numbers[1] += v.y * last_row
+    numbers[2] += v.z * last_row
+
+
+def rotation_matrix(v: vec3, radians=False) -> np.ndarray:
+    """
+    Returns the 3x3 rotation Rx * Ry * Rz for the euler angles in v
+    """
+    factor = 1 if radians else math.pi / 180
 
     precision = 15
-    sin_x = round(math.sin(v.x), precision)
-    cos_x = round(math.cos(v.x), precision)
-    rot_x = mat4([
-        [1, 0, 0, 0],
-        [0, cos_x, -sin_x, 0],
-        [0, sin_x, cos_x, 0],
-        [0, 0, 0, 1]
-    ])
-    sin_y = round(math.sin(v.y), precision)
-    cos_y = round(math.cos(v.y), precision)
-    rot_y = mat4([
-        [cos_y, 0, sin_y, 0],
-        [0, 1, 0, 0],
-        [-sin_y, 0, cos_y, 0],
-        [0, 0, 0, 1]
-    ])
-    sin_z = round(math.sin(v.z), precision)
-    cos_z = round(math.cos(v.z), precision)
-    rot_z = mat4([
-        [cos_z, -sin_z, 0, 0],
-        [sin_z, cos_z, 0, 0],
-        [0, 0, 1, 0],
-        [0, 0, 0, 1]
-    ])
-    res = rot_x * rot_y * rot_z * m
-    m.numbers = res.numbers
+    sin_x = round(math.sin(v.x * factor), precision)
+    cos_x = round(math.cos(v.x * factor), precision)
+    sin_y = round(math.sin(v.y * factor), precision)
+    cos_y = round(math.cos(v.y * factor), precision)
+    sin_z = round(math.sin(v.z * factor), precision)
+    cos_z = round(math.cos(v.z * factor), precision)
+    return np.array([
+        [cos_y * cos_z, -cos_y * sin_z, sin_y],
+        [sin_x * sin_y * cos_z + cos_x * sin_z, -sin_x * sin_y * sin_z + cos_x * cos_z, -sin_x * cos_y],
+        [-cos_x * sin_y * cos_z + sin_x * sin_z, cos_x * sin_y * sin_z + sin_x * cos_z, cos_x * cos_y],
+    ], dtype=np.float32)
+
+
+def rotate(m: mat4, v: vec3, radians=False, out: mat4 = None):
+    """
+    Applies the rotation Rx * Ry * Rz on top of m, in place unless out is given
+    """
+    numbers = _target(m, out)
+    numbers[:3] = np.matmul(rotation_matrix(v, radians), numbers[:3])
+
+
+def transform_points(m: mat4, points, out: np.ndarray = None) -> np.ndarray:
+    """
+    Transforms an (M, 3) array of points by m in one call
+    """
+    points = np.asarray(points, dtype=np.float32)
+    n = m.numbers
+    if out is None:
+        out = np.empty(points.shape, dtype=np.float32)
+    np.matmul(points, n[:3, :3].T, out=out)
+    out += n[:3, 3]
+    return out
+
+
+def rotation_matrices(angles, radians=False) -> np.ndarray:
+    """
+    Vectorized rotation_matrix: returns (N, 3, 3) rotations Rx * Ry * Rz for (N, 3) euler angles
+    """
+    angles = np.asarray(angles, dtype=np.float32).reshape((-1, 3))
+    if not radians:
+        angles = angles * np.float32(math.pi / 180)
+    sin = np.sin(angles)
+    cos = np.cos(angles)
+    sin_x, sin_y, sin_z = sin[:, 0], sin[:, 1], sin[:, 2]
+    cos_x, cos_y, cos_z = cos[:, 0], cos[:, 1], cos[:, 2]
+
+    result = np.empty((len(angles), 3, 3), dtype=np.float32)
+    result[:, 0, 0] = cos_y * cos_z
+    result[:, 0, 1] = -cos_y * sin_z
+    result[:, 0, 2] = sin_y
+    result[:, 1, 0] = sin_x * sin_y * cos_z + cos_x * sin_z
+    result[:, 1, 1] = -sin_x * sin_y * sin_z + cos_x * cos_z
+    result[:, 1, 2] = -sin_x * cos_y
+    result[:, 2, 0] = -cos_x * sin_y * cos_z + sin_x * sin_z
+    result[:, 2, 1] = cos_x * sin_y * sin_z + sin_x * cos_z
+    result[:, 2, 2] = cos_x * cos_y
+    return result
+
+
+class TransformBatch:
+    """
+    N row-major model matrices stored as one contiguous (N, 4, 4) float32 array
+    """
+    __slots__ = ('matrices',)
+
+    def __init__(self, count: int = 0, matrices: np.ndarray = None):
+        if matrices is None:
+            matrices = np.broadcast_to(_IDENTITY, (count, 4, 4)).copy()
+        else:
+            matrices = np.ascontiguousarray(matrices, dtype=np.float32)
+            if matrices.ndim != 3 or matrices.shape[1:] != (4, 4):
+                raise AttributeError(f"Can't construct TransformBatch, wrong shape of array: {matrices.shape}")
+        self.matrices = matrices
+
+    @classmethod
+    def from_trs(cls, positions, rotations=None, scales=None, radians=False, out=None):
+        """
+        Builds T * R * S for every entity.
+        positions: (N, 3), rotations: (N, 3) euler angles, scales: (N, 3), (N,) or a scalar
+        """
+        positions = np.asarray(positions, dtype=np.float32).reshape((-1, 3))
+        count = len(positions)
+        if out is None:
+            out = cls(matrices=np.empty((count, 4, 4), dtype=np.float32))
+        elif len(out) != count:
+            raise AttributeError(f"Output batch has {len(out)} matrices, expected {count}")
+        matrices = out.matrices
+
+        if rotations is None:
+            matrices[:, :3, :3] = _IDENTITY[:3, :3]
+        else:
+            matrices[:, :3, :3] = rotation_matrices(rotations, radians)
+
+        if scales is not None:
+            scales = np.asarray(scales, dtype=np.float32)
+            if scales.ndim < 2:
+                # uniform scale per entity (N,) or for all entities (scalar)
+                scales = scales.reshape((-1, 1))
+            # R * S scales the columns of the rotation
+            matrices[:, :3, :3] *= scales[:, np.newaxis, :]
+
+        matrices[:, :3, 3] = positions
+        matrices[:, 3, :3] = 0
+        matrices[:, 3, 3] = 1
+        return out
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def __getitem__(self, item) -> mat4:
+        # returns a view, changes to the mat4 are visible in the batch
+        return mat4.from_numbers(self.matrices[item])
+
+    def __setitem__(self, key, value: mat4):
+        self.matrices[key] = value.numbers
+
+    def copy(self):
+        return TransformBatch(matrices=self.matrices.copy())
+
+    def premultiply(self, m: mat4, out=None):
+        """
+        Computes m * matrices[i] for every matrix, e.g. view_projection * model
+        """
+        if out is None:
+            out = TransformBatch(matrices=np.empty_like(self.matrices))
+        np.matmul(m.numbers, self.matrices, out=out.matrices)
+        return out
+
+    def multiply(self, other, out=None):
+        """
+        Computes matrices[i] * other, where other is a mat4 or a TransformBatch of the same size
+        """
+        if type(other) == mat4:
+            other_numbers = other.numbers
+        elif type(other) == TransformBatch:
+            other_numbers = other.matrices
+        else:
+            raise AttributeError(other)
+        if out is None:
+            out = TransformBatch(matrices=np.empty_like(self.matrices))
+        np.matmul(self.matrices, other_numbers, out=out.matrices)
+        return out
+
+    def transform_points(self, points, out: np.ndarray = None) -> np.ndarray:
+        """
+        Transforms one point per matrix: points is (N, 3), result is (N, 3)
+        """
+        points = np.asarray(points, dtype=np.float32)
+        if out is None:
+            out = np.empty((len(self.matrices), 3), dtype=np.float32)
+        np.einsum('nij,nj->ni', self.matrices[:, :3, :3], points, out=out)
+        out += self.matrices[:, :3, 3]
+        return out
+
+    def transform_cloud(self, points, out: np.ndarray = None) -> np.ndarray:
+        """
+        Transforms a shared (M, 3) point cloud by every matrix, result is (N, M, 3)
+        """
+        points = np.asarray(points, dtype=np.float32)
+        if out is None:
+            out = np.empty((len(self.matrices), len(points), 3), dtype=np.float32)
+        np.matmul(points, self.matrices[:, :3, :3].transpose((0, 2, 1)), out=out)
+        out += self.matrices[:, np.newaxis, :3, 3]
+        return out
+
+    def to_array(self, column_major=False) -> np.ndarray:
+        """
+        Returns the matrices ready for upload, transposed to column-major if requested
+        """
+        if column_major:
+            return np.ascontiguousarray(self.matrices.transpose((0, 2, 1)))
+        return self.matrices
@@ -0,0 +1,338 @@
+import json
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pyglet.gl import GLuint, GLuint64, GLint, GL_TIME_ELAPSED, GL_TIMESTAMP, GL_QUERY_RESULT
+from pyglet.gl import GL_QUERY_RESULT_AVAILABLE, glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery
+from pyglet.gl import glQueryCounter, glGetQueryObjectiv, glGetQueryObjectui64v
+
+LOG = logging.getLogger()
+
+
+class ScopeRecord:
+    __slots__ = ('name', 'depth', 'start_ns', 'duration_ns', 'gpu_start_ns', 'gpu_duration_ns')
+
+    def __init__(self, name: str, depth: int, start_ns: int):
+        self.name = name
+        self.depth = depth
+        self.start_ns = start_ns
+        self.duration_ns = 0
+        # filled in once the timer queries are read back, relative to the start of the frame on the GPU
+        self.gpu_start_ns: Optional[int] = None
+        self.gpu_duration_ns: Optional[int] = None
+
+
+class FrameRecord:
+    __slots__ = ('index', 'start_ns', 'duration_ns', 'gpu_duration_ns', 'scopes')
+
+    def __init__(self, index: int, start_ns: int):
+        self.index = index
+        self.start_ns = start_ns
+        self.duration_ns = 0
+        self.gpu_duration_ns: Optional[int] = None
+        self.scopes: List[ScopeRecord] = []
+
+
+class QueryPool:
+    """
+    Recycles GL query objects so that timing a frame doesn't create any.
+    A query is tied to the target it was first used with, so every target needs its own pool.
+    """
+
+    def __init__(self, batch_size: int = 32):
+        self.batch_size = batch_size
+        self.free: List[int] = []
+        self.handles: List[int] = []
+
+    def acquire(self) -> int:
+        if not self.free:
+            handles = (GLuint * self.batch_size)()
+            glGenQueries(self.batch_size, handles)
+            self.handles.extend(handles)
+            self.free.extend(handles)
+        return self.free.pop()
+
+    def release(self, handle: int):
+        self.free.append(handle)
+
+    def delete(self):
+        if self.handles:
+            glDeleteQueries(len(self.handles), (GLuint * len(self.handles))(*self.handles))
+        self.handles = []
+        self.free = []
+
+
+def query_available(handle: int) -> bool:
+    available = GLint(0)
+    glGetQueryObjectiv(handle, GL_QUERY_RESULT_AVAILABLE, available)
+    return bool(available.value)
+
+
+def query_result(handle: int) -> int:
+    result = GLuint64(0)
+    glGetQueryObjectui64v(handle, GL_QUERY_RESULT, result)
+    return result.value
+
+
+class Scope:
+    __slots__ = ('profiler', 'name', 'gpu', 'record', 'queries')
+
+    def __init__(self, profiler: "Profiler", name: str, gpu: bool):
+        self.profiler = profiler
+        self.name = name
+        self.gpu = gpu
+        self.record = None
+        self.queries = None
+
+    def __enter__(self):
+        self.profiler.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.pop(self)
+
+
+class NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_SCOPE = NullScope()
+
+
+class Profiler:
+    """
+    Collects nestable CPU timings per frame and optionally GPU timings through timer queries.
+    The whole frame is measured with a GL_TIME_ELAPSED query, scopes with gpu=True with a pair of
+    GL_TIMESTAMP counters (elapsed queries can't nest). Queries are only read back after
+    gpu_latency frames, when the GPU has finished with them, so profiling never stalls the pipeline.
+    The last history frames are kept for percentiles and the Chrome trace export.
+    Scopes must be opened and closed on the thread that calls begin_frame/end_frame.
+    """
+
+    def __init__(self, history: int = 300, gpu: bool = True, gpu_latency: int = 3, enabled: bool = True):
+        self.enabled = enabled
+        self.gpu = gpu
+        self.gpu_latency = gpu_latency
+        self.frames: "deque[FrameRecord]" = deque(maxlen=history)
+        self.frame_index = 0
+        self.current: Optional[FrameRecord] = None
+        self.stack: List[Scope] = []
+
+        self.elapsed_queries = QueryPool()
+        self.timestamp_queries = QueryPool()
+        self.frame_query: Optional[int] = None
+        # frames whose queries haven't been read back yet: (frame, frame query, [(scope, start, end)])
+        self.pending: "deque[Tuple[FrameRecord, int, list]]" = deque()
+        self.scope_queries: List[tuple] = []
+
+    def scope(self, name: str, gpu: bool = False):
+        """
+        with PROFILER.scope("render"): ...
+        """
+        if not self.enabled or self.current is None:
+            return NULL_SCOPE
+        return Scope(self, name, gpu and self.gpu)
+
+    def push(self, scope: Scope):
+        record = ScopeRecord(scope.name, len(self.stack), time.perf_counter_ns())
+        scope.record = record
+        self.current.scopes.append(record)
+        self.stack.append(scope)
+        if scope.gpu:
+            start = self.timestamp_queries.acquire()
+            glQueryCounter(start, GL_TIMESTAMP)
+            scope.queries = start
+
+    def pop(self, scope: Scope):
+        record = scope.record
+        record.duration_ns = time.perf_counter_ns() - record.start_ns
+        if self.stack and self.stack[-1] is scope:
+            self.stack.pop()
+        else:
+            LOG.warning(f"Profiler scope {scope.name} closed out of order")
+            self.stack.remove(scope)
+        if scope.gpu:
+            end = self.timestamp_queries.acquire()
+            glQueryCounter(end, GL_TIMESTAMP)
+            self.scope_queries.append((record, scope.queries, end))
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = FrameRecord(self.frame_index, time.perf_counter_ns())
+        self.frame_index += 1
+        self.stack = []
+        self.scope_queries = []
+        if self.gpu:
+            try:
+                self.frame_query = self.elapsed_queries.acquire()
+                glBeginQuery(GL_TIME_ELAPSED, self.frame_query)
+            except Exception as e:
+                # timer queries need OpenGL 3.3 or ARB_timer_query
+                LOG.warning(f"Disabling GPU profiling: {e}")
+                self.gpu = False
+                self.frame_query = None
+
+    def end_frame(self):
+        if not self.enabled or self.current is None:
+            return
+        frame = self.current
+        frame.duration_ns = time.perf_counter_ns() - frame.start_ns
+        for scope in reversed(self.stack):
+            LOG.warning(f"Profiler scope {scope.name} was not closed")
+        self.stack = []
+        self.frames.append(frame)
+        self.current = None
+
+        if self.frame_query is not None:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.pending.append((frame, self.frame_query, self.scope_queries))
+            self.frame_query = None
+        self.scope_queries = []
+        self.read_back()
+
+    def read_back(self, wait: bool = False):
+        """
+        Reads the results of frames that are at least gpu_latency frames old
+        """
+        while self.pending:
+            frame, frame_query, scope_queries = self.pending[0]
+            if not wait and self.frame_index - frame.index <= self.gpu_latency:
+                break
+            if not wait and not query_available(frame_query):
+                break
+            self.pending.popleft()
+
+            frame.gpu_duration_ns = query_result(frame_query)
+            self.elapsed_queries.release(frame_query)
+            if scope_queries:
+                origin = min(query_result(start) for _, start, _ in scope_queries)
+            for record, start, end in scope_queries:
+                start_ns = query_result(start)
+                record.gpu_start_ns = start_ns - origin
+                record.gpu_duration_ns = query_result(end) - start_ns
+                self.timestamp_queries.release(start)
+                self.timestamp_queries.release(end)
+
+    def discard_queries(self):
+        """
+        Forgets all queries, e.g. after switching to a new context where they don't exist.
+        Frames that were still waiting for their results keep no GPU times.
+        """
+        self.pending.clear()
+        self.frame_query = None
+        self.scope_queries = []
+        self.elapsed_queries = QueryPool()
+        self.timestamp_queries = QueryPool()
+
+    def frame_times(self, gpu: bool = False) -> np.ndarray:
+        """
+        Frame times in milliseconds of the frames in the history, GPU times only of resolved frames
+        """
+        if gpu:
+            values = [f.gpu_duration_ns for f in self.frames if f.gpu_duration_ns is not None]
+        else:
+            values = [f.duration_ns for f in self.frames]
+        return np.array(values, dtype=np.float64) / 1e6
+
+    def scope_times(self, name: str, gpu: bool = False) -> np.ndarray:
+        """
+        Time in milliseconds spent per frame in all scopes with the given name
+        """
+        values = []
+        for frame in self.frames:
+            total = None
+            for record in frame.scopes:
+                if record.name != name:
+                    continue
+                duration = record.gpu_duration_ns if gpu else record.duration_ns
+                if duration is not None:
+                    total = (total or 0) + duration
+            if total is not None:
+                values.append(total)
+        return np.array(values, dtype=np.float64) / 1e6
+
+    def percentiles(self, name: str = None, gpu: bool = False, q=(50, 95, 99)) -> Dict[int, float]:
+        """
+        Percentiles in milliseconds of the whole frame or of one scope
+        """
+        times = self.frame_times(gpu) if name is None else self.scope_times(name, gpu)
+        if len(times) == 0:
+            return {p: 0.0 for p in q}
+        return dict(zip(q, np.percentile(times, q).tolist()))
+
+    def summary(self) -> Dict[str, Dict[int, float]]:
+        names = []
+        for frame in self.frames:
+            for record in frame.scopes:
+                if record.name not in names:
+                    names.append(record.name)
+        result = {"frame": self.percentiles()}
+        if len(self.frame_times(gpu=True)):
+            result["frame (gpu)"] = self.percentiles(gpu=True)
+        for name in names:
+            result[name] = self.percentiles(name)
+            gpu_times = self.percentiles(name, gpu=True)
+            if any(gpu_times.values()):
+                result[f"{name} (gpu)"] = gpu_times
+        return result
+
+    def report(self) -> str:
+        lines = [f"{'scope':<24} {'p50':>8} {'p95':>8} {'p99':>8}  (ms over {len(self.frames)} frames)"]
+        for name, values in self.summary().items():
+            lines.append(f"{name:<24} {values[50]:>8.3f} {values[95]:>8.3f} {values[99]:>8.3f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """
+        Trace in the Chrome trace event format, load it in chrome://tracing or Perfetto
+        """
+        events = []
+        if not self.frames:
+            return {"traceEvents": events, "displayTimeUnit": "ms"}
+        origin = self.frames[0].start_ns
+        for frame in self.frames:
+            frame_start = (frame.start_ns - origin) / 1000
+            events.append({"name": f"frame {frame.index}", "cat": "frame", "ph": "X", "pid": 0, "tid": 0,
+                           "ts": frame_start, "dur": frame.duration_ns / 1000})
+            for record in frame.scopes:
+                events.append({"name": record.name, "cat": "cpu", "ph": "X", "pid": 0, "tid": 0,
+                               "ts": (record.start_ns - origin) / 1000, "dur": record.duration_ns / 1000})
+            if frame.gpu_duration_ns is not None:
+                # GPU clock is not the CPU clock, GPU events are aligned to the start of their frame
+                events.append({"name": f"frame {frame.index}", "cat": "frame", "ph": "X", "pid": 0, "tid": 1,
+                               "ts": frame_start, "dur": frame.gpu_duration_ns / 1000})
+            for record in frame.scopes:
+                if record.gpu_duration_ns is None:
+                    continue
+                events.append({"name": record.name, "cat": "gpu", "ph": "X", "pid": 0, "tid": 1,
+                               "ts": frame_start + record.gpu_start_ns / 1000,
+                               "dur": record.gpu_duration_ns / 1000})
+        events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "CPU"}})
+        events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "GPU"}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, file_name: str):
+        with open(file_name, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        LOG.info(f"Wrote profile of {len(self.frames)} frames to {file_name}")
+
+    def clear(self):
+        self.frames.clear()
+
+    def delete(self):
+        self.read_back(wait=True)
+        self.elapsed_queries.delete()
+        self.timestamp_queries.delete()
+
+
+PROFILER = Profiler()
@@ -0,0 +1,185 @@
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+from game_engine.culling import Frustum, world_spheres
+from game_engine.math import identity
+from game_engine.render_state import RENDER_STATE
+from game_engine.uniform_buffer import FRAME_UNIFORMS
+from game_engine.vertex_objects import Uniform
+
+LOG = logging.getLogger()
+
+OPAQUE_PASS = 0
+BLENDED_PASS = 1
+
+# sort key layout, from the most significant bit down
+# opaque:  pass (2) | shader (10) | texture (12) | depth (24) | sequence (16)
+# blended: pass (2) | inverted depth (24) | shader (10) | texture (12) | sequence (16)
+PASS_SHIFT = 62
+SHADER_BITS = 10
+TEXTURE_BITS = 12
+DEPTH_BITS = 24
+SEQUENCE_BITS = 16
+MAX_DEPTH_VALUE = (1 << DEPTH_BITS) - 1
+
+
+def find_uniform(uniforms: List[Uniform], name: str):
+    # later uniforms override earlier ones when bound, so search from the back
+    for uniform in reversed(uniforms):
+        if uniform.name == name:
+            return uniform.data
+    return None
+
+
+def find_camera(uniforms: List[Uniform]):
+    """
+    (projection, view) from the u_Projection and u_View uniforms, falling back to the FrameUniforms block
+    """
+    projection = find_uniform(uniforms, "u_Projection")
+    view = find_uniform(uniforms, "u_View")
+    if projection is None:
+        projection = FRAME_UNIFORMS.projection
+    if view is None:
+        view = FRAME_UNIFORMS.view
+    return projection, view
+
+
+def view_depth(uniforms: List[Uniform]) -> float:
+    """
+    Distance along the view direction of the model origin, from the view (see find_camera) and u_Model
+    """
+    _, view = find_camera(uniforms)
+    model = find_uniform(uniforms, "u_Model")
+    if view is None:
+        return 0.0
+    view_numbers = view.numbers
+    if model is None:
+        origin = view_numbers[:3, 3]
+    else:
+        origin = view_numbers[:3, :3] @ model.numbers[:3, 3] + view_numbers[:3, 3]
+    # the camera looks down -z
+    return float(-origin[2])
+
+
+class RenderQueue:
+    """
+    Collects draws submitted through MeshSurface.draw(uniforms, queue) and issues them sorted by a 64 bit key.
+    Opaque draws are grouped by shader and texture and then go front to back,
+    blended draws are issued afterwards from back to front.
+    With culling enabled, surfaces whose bounds are outside the view frustum (from the u_Projection
+    and u_View uniforms or the FrameUniforms block) are dropped in one vectorized pass before sorting.
+    """
+
+    def __init__(self, far: float = 1000.0, culling: bool = True):
+        self.far = far
+        self.culling = culling
+        self.items = []
+        # GL name -> id within the key bits, only has to be consistent within a frame and is reset by flush()
+        self.shader_ids: Dict[int, int] = {}
+        self.texture_ids: Dict[int, int] = {}
+
+        self.draw_calls = 0
+        self.state_changes = 0
+        self.culled = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def small_id(ids: Dict[int, int], handle, bits: int) -> int:
+        key = getattr(handle, "value", handle)
+        small = ids.get(key)
+        if small is None:
+            small = len(ids) % (1 << bits)
+            ids[key] = small
+        return small
+
+    def make_key(self, surface, uniforms: List[Uniform], sequence: int) -> int:
+        shader_id = self.small_id(self.shader_ids, surface.shader.handle, SHADER_BITS)
+        texture = surface.texture
+        if texture is None:
+            texture_id = 0
+        else:
+            # not uploaded yet, the texture object stands in for its GL name until the end of the frame
+            handle = texture.handle if texture.handle is not None else id(texture)
+            texture_id = self.small_id(self.texture_ids, handle, TEXTURE_BITS)
+
+        depth = min(max(view_depth(surface.uniforms + uniforms) / self.far, 0.0), 1.0)
+        depth_value = int(depth * MAX_DEPTH_VALUE)
+        sequence &= (1 << SEQUENCE_BITS) - 1
+
+        if surface.blended:
+            key = BLENDED_PASS << PASS_SHIFT
+            key |= (MAX_DEPTH_VALUE - depth_value) << (SHADER_BITS + TEXTURE_BITS + SEQUENCE_BITS)
+            key |= shader_id << (TEXTURE_BITS + SEQUENCE_BITS)
+            key |= texture_id << SEQUENCE_BITS
+        else:
+            key = OPAQUE_PASS << PASS_SHIFT
+            key |= shader_id << (TEXTURE_BITS + DEPTH_BITS + SEQUENCE_BITS)
+            key |= texture_id << (DEPTH_BITS + SEQUENCE_BITS)
+            key |= depth_value << SEQUENCE_BITS
+        return key | sequence
+
+    def submit(self, surface, uniforms: List[Uniform]):
+        # copy the list, callers keep appending to theirs after submitting
+        uniforms = list(uniforms)
+        sequence = len(self.items)
+        self.items.append((self.make_key(surface, uniforms, sequence), sequence, surface, uniforms))
+
+    def cull(self):
+        """
+        Removes items outside the view frustum, items without bounds or camera uniforms are kept
+        """
+        groups = {}
+        visible = []
+        for item in self.items:
+            surface, uniforms = item[2], item[3]
+            projection, view = find_camera(uniforms)
+            if surface.bounds is None or projection is None or view is None:
+                visible.append(item)
+                continue
+            groups.setdefault((id(projection), id(view)), (projection, view, []))[2].append(item)
+
+        for projection, view, items in groups.values():
+            frustum = Frustum.from_matrices(projection, view)
+            default_model = identity().numbers
+            models = np.empty((len(items), 4, 4), dtype=np.float32)
+            centers = np.empty((len(items), 3), dtype=np.float32)
+            radii = np.empty(len(items), dtype=np.float32)
+            for index, (_, _, surface, uniforms) in enumerate(items):
+                model = find_uniform(surface.uniforms + uniforms, "u_Model")
+                models[index] = default_model if model is None else model.numbers
+                centers[index] = surface.bounds.center
+                radii[index] = surface.bounds.radius
+
+            mask = frustum.cull_spheres(*world_spheres(models, centers, radii))
+            visible.extend(item for item, inside in zip(items, mask) if inside)
+
+        self.culled = len(self.items) - len(visible)
+        self.items = visible
+
+    def flush(self):
+        """
+        Issues all submitted draws in key order and records draw calls and state changes of this frame
+        """
+        self.culled = 0
+        if self.culling:
+            self.cull()
+        self.items.sort(key=lambda item: (item[0], item[1]))
+        issued_before = RENDER_STATE.total_issued
+        for _, _, surface, uniforms in self.items:
+            surface.render(uniforms)
+        self.draw_calls = len(self.items)
+        self.state_changes = RENDER_STATE.total_issued - issued_before
+        self.clear()
+
+    def clear(self):
+        self.items = []
+        # GL names of deleted objects get reused, the ids of this frame don't carry over
+        self.shader_ids = {}
+        self.texture_ids = {}
+
+
+RENDER_QUEUE = RenderQueue()
@@ -0,0 +1,129 @@
+from collections import defaultdict
+
+from pyglet.gl import glUseProgram, glBindVertexArray, glBindBuffer, glBindTexture, glActiveTexture
+from pyglet.gl import glBindFramebuffer, GL_TEXTURE0, GL_ELEMENT_ARRAY_BUFFER, GL_FRAMEBUFFER
+
+
+def _handle_value(handle) -> int:
+    # handles are either plain ints (programs) or GLuint instances
+    return getattr(handle, "value", handle)
+
+
+class RenderState:
+    """
+    Shadows the GL binding state so that binds which would not change anything are skipped.
+    Every bind of programs, vertex arrays, buffers and textures has to go through this class,
+    otherwise the shadowed state gets out of sync. Call invalidate() after foreign GL code ran.
+    """
+
+    def __init__(self):
+        self.program = None
+        self.vertex_array = None
+        self.buffers = {}
+        self.active_texture_unit = None
+        self.textures = {}
+        self.framebuffer = None
+
+        self.issued = defaultdict(int)
+        self.skipped = defaultdict(int)
+
+    def invalidate(self):
+        self.program = None
+        self.vertex_array = None
+        self.buffers = {}
+        self.active_texture_unit = None
+        self.textures = {}
+        self.framebuffer = None
+
+    def reset_counters(self):
+        self.issued = defaultdict(int)
+        self.skipped = defaultdict(int)
+
+    @property
+    def total_issued(self) -> int:
+        return sum(self.issued.values())
+
+    @property
+    def total_skipped(self) -> int:
+        return sum(self.skipped.values())
+
+    def use_program(self, handle):
+        handle = _handle_value(handle)
+        if self.program == handle:
+            self.skipped["program"] += 1
+            return
+        glUseProgram(handle)
+        self.program = handle
+        self.issued["program"] += 1
+
+    def bind_vertex_array(self, handle):
+        handle = _handle_value(handle)
+        if self.vertex_array == handle:
+            self.skipped["vertex_array"] += 1
+            return
+        glBindVertexArray(handle)
+        self.vertex_array = handle
+        # the element array binding is part of the vertex array state
+        self.buffers.pop(GL_ELEMENT_ARRAY_BUFFER, None)
+        self.issued["vertex_array"] += 1
+
+    def bind_buffer(self, target: int, handle):
+        handle = _handle_value(handle)
+        if self.buffers.get(target) == handle:
+            self.skipped["buffer"] += 1
+            return
+        glBindBuffer(target, handle)
+        self.buffers[target] = handle
+        self.issued["buffer"] += 1
+
+    def active_texture(self, unit: int):
+        if self.active_texture_unit == unit:
+            self.skipped["active_texture"] += 1
+            return
+        glActiveTexture(GL_TEXTURE0 + unit)
+        self.active_texture_unit = unit
+        self.issued["active_texture"] += 1
+
+    def bind_texture(self, target: int, handle, unit: int = 0):
+        handle = _handle_value(handle)
+        key = (unit, target)
+        if self.textures.get(key) == handle:
+            self.skipped["texture"] += 1
+            return
+        self.active_texture(unit)
+        glBindTexture(target, handle)
+        self.textures[key] = handle
+        self.issued["texture"] += 1
+
+    def bind_framebuffer(self, handle):
+        handle = _handle_value(handle)
+        if self.framebuffer == handle:
+            self.skipped["framebuffer"] += 1
+            return
+        glBindFramebuffer(GL_FRAMEBUFFER, handle)
+        self.framebuffer = handle
+        self.issued["framebuffer"] += 1
+
+    def forget_program(self, handle):
+        if self.program == _handle_value(handle):
+            self.program = None
+
+    def forget_vertex_array(self, handle):
+        if self.vertex_array == _handle_value(handle):
+            self.vertex_array = None
+            self.buffers.pop(GL_ELEMENT_ARRAY_BUFFER, None)
+
+    def forget_buffer(self, handle):
+        handle = _handle_value(handle)
+        self.buffers = {target: h for target, h in self.buffers.items() if h != handle}
+
+    def forget_texture(self, handle):
+        handle = _handle_value(handle)
+        self.textures = {key: h for key, h in self.textures.items() if h != handle}
+
+    def forget_framebuffer(self, handle):
+        if self.framebuffer == _handle_value(handle):
+            self.framebuffer = None
+
+
+RENDER_STATE = RenderState()
@@ -0,0 +1,106 @@
+from typing import Dict, Optional
+
+import pyglet
+from pyglet.gl import glMatrixMode, glLoadIdentity, glOrtho, glDisable, glEnable, GL_PROJECTION, GL_MODELVIEW
+from pyglet.gl import GL_DEPTH_TEST
+
+from game_engine.render_state import RENDER_STATE
+
+
+class RenderStats:
+    """
+    Counters of the GL work issued during one frame.
+    The engine increments the fields directly, they are plain attributes to keep that cheap.
+    Window.on_draw resets them at the start of a frame and copies them into last_frame at the end.
+    """
+    __slots__ = ('draw_calls', 'instanced_draw_calls', 'vertices', 'instances', 'uniform_uploads',
+                 'texture_binds', 'texture_uploads', 'texture_upload_bytes', 'buffer_uploads',
+                 'buffer_upload_bytes', 'frame', 'last_frame')
+
+    COUNTERS = ('draw_calls', 'instanced_draw_calls', 'vertices', 'instances', 'uniform_uploads',
+                'texture_binds', 'texture_uploads', 'texture_upload_bytes', 'buffer_uploads',
+                'buffer_upload_bytes')
+
+    def __init__(self):
+        self.frame = 0
+        self.last_frame: Dict[str, int] = {}
+        self.reset()
+
+    def reset(self):
+        self.draw_calls = 0
+        self.instanced_draw_calls = 0
+        self.vertices = 0
+        self.instances = 0
+        self.uniform_uploads = 0
+        self.texture_binds = 0
+        self.texture_uploads = 0
+        self.texture_upload_bytes = 0
+        self.buffer_uploads = 0
+        self.buffer_upload_bytes = 0
+
+    def count_draw(self, vertices: int, instances: int = 0):
+        if instances:
+            self.instanced_draw_calls += 1
+            self.instances += instances
+            self.vertices += vertices * instances
+        else:
+            self.draw_calls += 1
+            self.vertices += vertices
+
+    def as_dict(self) -> Dict[str, int]:
+        result = {name: getattr(self, name) for name in self.COUNTERS}
+        result["state_changes"] = RENDER_STATE.total_issued
+        result["redundant_binds_skipped"] = RENDER_STATE.total_skipped
+        return result
+
+    def begin_frame(self):
+        self.reset()
+        RENDER_STATE.reset_counters()
+
+    def end_frame(self):
+        """
+        Stores the counters of the finished frame, read them through last_frame
+        """
+        self.last_frame = self.as_dict()
+        self.frame += 1
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={value}" for name, value in self.as_dict().items())
+        return f"RenderStats({values})"
+
+
+class RenderStatsOverlay:
+    """
+    Draws the counters of the last frame as text in the top left corner of the window
+    """
+
+    def __init__(self, stats: RenderStats, font_size: int = 10):
+        self.stats = stats
+        self.label = pyglet.text.Label("", font_size=font_size, multiline=True, width=400,
+                                       anchor_x="left", anchor_y="top")
+        self.text: Optional[str] = None
+
+    def draw(self, width: int, height: int):
+        text = "\n".join(f"{name}: {value}" for name, value in self.stats.last_frame.items())
+        if text != self.text:
+            self.label.text = text
+            self.text = text
+        self.label.x = 5
+        self.label.y = height - 5
+
+        # pyglet draws text with the fixed function pipeline, which needs its own matrices
+        RENDER_STATE.use_program(0)
+        RENDER_STATE.bind_vertex_array(0)
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        glOrtho(0, width, 0, height, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glDisable(GL_DEPTH_TEST)
+        self.label.draw()
+        glEnable(GL_DEPTH_TEST)
+        # pyglet bound its own buffers and textures
+        RENDER_STATE.invalidate()
+
+
+RENDER_STATS = RenderStats()
@@ -0,0 +1,525 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from game_engine.culling import Bounds, Frustum, world_spheres
+from game_engine.math import mat4, vec3, TransformBatch
+from game_engine.vertex_objects import Uniform
+
+
+class OctreeNode:
+    __slots__ = ('key', 'center', 'half_size', 'parent', 'children', 'objects', 'count')
+
+    def __init__(self, key, center: np.ndarray, half_size: float, parent=None):
+        self.key = key
+        self.center = center
+        # half size of the cell, the loose bounds reach twice as far
+        self.half_size = half_size
+        self.parent = parent
+        self.children: List[Optional[OctreeNode]] = [None] * 8
+        self.objects: Dict[int, "Proxy"] = {}
+        # number of objects in this node and all of its descendants
+        self.count = 0
+
+    @property
+    def loose_half_size(self) -> float:
+        return 2 * self.half_size
+
+
+class Proxy:
+    __slots__ = ('id', 'item', 'center', 'radius', 'node')
+
+    def __init__(self, proxy_id: int, item, center: np.ndarray, radius: float):
+        self.id = proxy_id
+        self.item = item
+        self.center = center
+        self.radius = radius
+        self.node: Optional[OctreeNode] = None
+
+    def __repr__(self):
+        return f"Proxy({self.id}, {self.item}, center={self.center.tolist()}, radius={self.radius})"
+
+
+class SpatialIndex:
+    """
+    Loose octree over bounding spheres.
+    An object is stored in the deepest cell whose size is at least its radius, the loose bounds
+    (twice the cell size) then always contain it. The cell is computed directly from center and
+    radius, so insert, move and remove only touch the O(log n) path from the root.
+    Objects outside of the world bounds, or larger than it, are kept in a flat list that every query checks.
+    """
+
+    def __init__(self, world_center=(0, 0, 0), world_half_size: float = 1024.0, max_depth: int = 8):
+        self.world_center = np.asarray(world_center, dtype=np.float64)
+        self.world_half_size = world_half_size
+        self.max_depth = max_depth
+        self.root = OctreeNode((0, 0, 0, 0), self.world_center, world_half_size)
+        self.outside: Dict[int, Proxy] = {}
+        self.proxies: Dict[int, Proxy] = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def cell_for(self, center: np.ndarray, radius: float):
+        offset = center - (self.world_center - self.world_half_size)
+        if np.any(offset < 0) or np.any(offset >= 2 * self.world_half_size):
+            return None
+        if radius > self.world_half_size:
+            # would reach past the loose bounds of the root
+            return None
+        if radius <= 0:
+            depth = self.max_depth
+        else:
+            depth = int(math.floor(math.log2(self.world_half_size / radius)))
+            depth = min(max(depth, 0), self.max_depth)
+        cell_size = 2 * self.world_half_size / (1 << depth)
+        ix, iy, iz = (int(v) for v in offset // cell_size)
+        return depth, ix, iy, iz
+
+    def get_node(self, cell) -> OctreeNode:
+        depth, ix, iy, iz = cell
+        node = self.root
+        for level in range(1, depth + 1):
+            shift = depth - level
+            child_index = ((ix >> shift) & 1) | (((iy >> shift) & 1) << 1) | (((iz >> shift) & 1) << 2)
+            child = node.children[child_index]
+            if child is None:
+                half_size = node.half_size / 2
+                direction = np.array([child_index & 1, (child_index >> 1) & 1, (child_index >> 2) & 1]) * 2 - 1
+                child = OctreeNode((level, ix >> shift, iy >> shift, iz >> shift),
+                                   node.center + direction * half_size, half_size, node)
+                node.children[child_index] = child
+            node = child
+        return node
+
+    def link(self, proxy: Proxy):
+        cell = self.cell_for(proxy.center, proxy.radius)
+        if cell is None:
+            proxy.node = None
+            self.outside[proxy.id] = proxy
+            return
+        node = self.get_node(cell)
+        node.objects[proxy.id] = proxy
+        proxy.node = node
+        while node is not None:
+            node.count += 1
+            node = node.parent
+
+    def unlink(self, proxy: Proxy):
+        node = proxy.node
+        if node is None:
+            del self.outside[proxy.id]
+            return
+        del node.objects[proxy.id]
+        while node is not None:
+            node.count -= 1
+            parent = node.parent
+            if node.count == 0 and parent is not None:
+                # drop empty branches so queries never walk them
+                parent.children[parent.children.index(node)] = None
+            node = parent
+        proxy.node = None
+
+    def insert(self, item: Any, center, radius: float) -> int:
+        """
+        Adds an item with a world space bounding sphere, returns the proxy id used for move/remove
+        """
+        proxy = Proxy(self.next_id, item, np.asarray(center, dtype=np.float64), float(radius))
+        self.next_id += 1
+        self.proxies[proxy.id] = proxy
+        self.link(proxy)
+        return proxy.id
+
+    def insert_bounds(self, item: Any, bounds: Bounds, model: mat4 = None) -> int:
+        """
+        Adds an item with model space bounds (e.g. MeshSurface.bounds) placed by a model matrix
+        """
+        center, radius = self.transform_bounds(bounds, model)
+        return self.insert(item, center, radius)
+
+    @staticmethod
+    def transform_bounds(bounds: Bounds, model: mat4 = None) -> Tuple[np.ndarray, float]:
+        if model is None:
+            return bounds.center, bounds.radius
+        centers, radii = world_spheres(model.numbers[np.newaxis], bounds.center[np.newaxis],
+                                       np.array([bounds.radius], dtype=np.float32))
+        return centers[0], float(radii[0])
+
+    def move(self, proxy_id: int, center, radius: float = None):
+        proxy = self.proxies[proxy_id]
+        center = np.asarray(center, dtype=np.float64)
+        if radius is None:
+            radius = proxy.radius
+        old_cell = None if proxy.node is None else proxy.node.key
+        new_cell = self.cell_for(center, radius)
+        proxy.center = center
+        proxy.radius = float(radius)
+        if old_cell is not None and old_cell == new_cell:
+            # still in the same cell, nothing to relink
+            return
+        self.unlink(proxy)
+        self.link(proxy)
+
+    def move_bounds(self, proxy_id: int, bounds: Bounds, model: mat4 = None):
+        center, radius = self.transform_bounds(bounds, model)
+        self.move(proxy_id, center, radius)
+
+    def remove(self, proxy_id: int):
+        proxy = self.proxies.pop(proxy_id)
+        self.unlink(proxy)
+
+    def get(self, proxy_id: int):
+        return self.proxies[proxy_id].item
+
+    def collect(self, node_visible) -> List[Proxy]:
+        """
+        Returns the proxies of every node whose loose bounds pass node_visible(center, loose_half_size)
+        """
+        candidates = list(self.outside.values())
+        stack = [self.root] if self.root.count else []
+        while stack:
+            node = stack.pop()
+            if not node_visible(node.center, node.loose_half_size):
+                continue
+            candidates.extend(node.objects.values())
+            stack.extend(child for child in node.children if child is not None)
+        return candidates
+
+    @staticmethod
+    def candidate_arrays(candidates: List[Proxy]):
+        centers = np.array([proxy.center for proxy in candidates], dtype=np.float64).reshape((-1, 3))
+        radii = np.array([proxy.radius for proxy in candidates], dtype=np.float64)
+        return centers, radii
+
+    def query_frustum(self, frustum: Frustum) -> List[Any]:
+        planes = frustum.planes.astype(np.float64)
+        normals = planes[:, :3]
+        reach_factors = np.abs(normals).sum(axis=1)
+
+        def node_visible(center, half_size):
+            return bool(np.all(normals @ center + planes[:, 3] >= -half_size * reach_factors))
+
+        candidates = self.collect(node_visible)
+        if not candidates:
+            return []
+        centers, radii = self.candidate_arrays(candidates)
+        mask = frustum.cull_spheres(centers, radii)
+        return [proxy.item for proxy, inside in zip(candidates, mask) if inside]
+
+    def query_radius(self, center, radius: float) -> List[Any]:
+        center = np.asarray(center, dtype=np.float64)
+
+        def node_visible(node_center, half_size):
+            # squared distance from the sphere center to the box
+            delta = np.maximum(np.abs(center - node_center) - half_size, 0)
+            return float(delta @ delta) <= radius * radius
+
+        candidates = self.collect(node_visible)
+        if not candidates:
+            return []
+        centers, radii = self.candidate_arrays(candidates)
+        distances = np.linalg.norm(centers - center, axis=1)
+        return [proxy.item for proxy, inside in zip(candidates, distances <= radii + radius) if inside]
+
+    def query_ray(self, origin, direction, max_distance: float = math.inf) -> List[Tuple[float, Any]]:
+        """
+        Returns (distance, item) for every sphere the ray hits, nearest first
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / direction
+
+        def node_visible(node_center, half_size):
+            with np.errstate(invalid='ignore'):
+                t1 = (node_center - half_size - origin) * inverse
+                t2 = (node_center + half_size - origin) * inverse
+            # 0 * inf for rays along a face of the box
+            t1 = np.where(np.isnan(t1), -math.inf, t1)
+            t2 = np.where(np.isnan(t2), math.inf, t2)
+            near = np.max(np.minimum(t1, t2))
+            far = np.min(np.maximum(t1, t2))
+            return far >= max(near, 0) and near <= max_distance
+
+        candidates = self.collect(node_visible)
+        if not candidates:
+            return []
+        centers, radii = self.candidate_arrays(candidates)
+        to_center = centers - origin
+        along = to_center @ direction
+        closest_squared = np.sum(to_center ** 2, axis=1) - along ** 2
+        hit = closest_squared <= radii ** 2
+        offset = np.sqrt(np.maximum(radii ** 2 - closest_squared, 0))
+        # distance to the entry point, or 0 if the origin is inside the sphere
+        distances = np.where(along - offset >= 0, along - offset, along + offset)
+        distances = np.where(np.sum(to_center ** 2, axis=1) <= radii ** 2, 0, distances)
+        hit &= (distances >= 0) & (distances <= max_distance)
+
+        hits = [(float(distance), proxy.item) for proxy, distance, is_hit in zip(candidates, distances, hit) if is_hit]
+        hits.sort(key=lambda h: h[0])
+        return hits
+
+
+class SceneNode:
+    """
+    Handle to one node of a SceneGraph, the transform data lives in the graph's flat arrays
+    """
+
+    def __init__(self, graph: "SceneGraph", index: int, parent: Optional["SceneNode"]):
+        self.graph = graph
+        self.index = index
+        self.parent = parent
+        self.children: List[SceneNode] = []
+        self.surface = None
+        self.proxy_id: Optional[int] = None
+
+    @property
+    def position(self) -> vec3:
+        return vec3(arr=self.graph.positions[self.index].tolist())
+
+    @position.setter
+    def position(self, value: vec3):
+        self.graph.positions[self.index] = value.to_list()
+        self.graph.mark_dirty(self.index)
+
+    @property
+    def rotation(self) -> vec3:
+        return vec3(arr=self.graph.rotations[self.index].tolist())
+
+    @rotation.setter
+    def rotation(self, value: vec3):
+        self.graph.rotations[self.index] = value.to_list()
+        self.graph.mark_dirty(self.index)
+
+    @property
+    def scale(self) -> vec3:
+        return vec3(arr=self.graph.scales[self.index].tolist())
+
+    @scale.setter
+    def scale(self, value):
+        if type(value) in [float, int]:
+            value = vec3(value, value, value)
+        self.graph.scales[self.index] = value.to_list()
+        self.graph.mark_dirty(self.index)
+
+    @property
+    def world_matrix(self) -> mat4:
+        """
+        World matrix as of the last SceneGraph.update(), a view into the graph's array
+        """
+        return mat4.from_numbers(self.graph.world[self.index])
+
+    @property
+    def local_matrix(self) -> mat4:
+        return mat4.from_numbers(self.graph.local[self.index])
+
+    def add_child(self, child: "SceneNode"):
+        self.graph.set_parent(child, self)
+
+    def __repr__(self):
+        return f"SceneNode({self.index}, parent={None if self.parent is None else self.parent.index})"
+
+
+class SceneGraph:
+    """
+    Node hierarchy whose transforms are stored in flat numpy arrays.
+    Changing a node only marks it dirty. update() rebuilds the local matrices of dirty nodes and
+    then walks the hierarchy level by level, recomputing world = parent_world * local for dirty
+    nodes and their descendants with one batched matmul per level. Without changes update() returns
+    right away, so static geometry costs nothing per frame.
+    """
+
+    def __init__(self, capacity: int = 64, spatial_index: SpatialIndex = None):
+        self.capacity = 0
+        self.count = 0
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.rotations = np.zeros((0, 3), dtype=np.float32)
+        self.scales = np.ones((0, 3), dtype=np.float32)
+        self.parents = np.zeros(0, dtype=np.int64)
+        self.depths = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.local_dirty = np.zeros(0, dtype=bool)
+        self.local = np.zeros((0, 4, 4), dtype=np.float32)
+        self.world = np.zeros((0, 4, 4), dtype=np.float32)
+        self.grow(capacity)
+
+        self.nodes: List[Optional[SceneNode]] = []
+        self.free_indices: List[int] = []
+        self.dirty_count = 0
+        self.levels: Optional[List[np.ndarray]] = None
+        # nodes whose world matrix changed during the last update
+        self.changed = np.zeros(0, dtype=np.int64)
+        self.spatial_index = spatial_index
+
+    def __len__(self):
+        return self.count
+
+    def grow(self, capacity: int):
+        old = self.capacity
+
+        def resized(array, fill):
+            result = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            result[:old] = array
+            result[old:] = fill
+            return result
+
+        self.positions = resized(self.positions, 0)
+        self.rotations = resized(self.rotations, 0)
+        self.scales = resized(self.scales, 1)
+        self.parents = resized(self.parents, -1)
+        self.depths = resized(self.depths, 0)
+        self.alive = resized(self.alive, False)
+        self.local_dirty = resized(self.local_dirty, False)
+        self.local = resized(self.local, np.identity(4, dtype=np.float32))
+        self.world = resized(self.world, np.identity(4, dtype=np.float32))
+        self.capacity = capacity
+
+    def mark_dirty(self, index: int):
+        if not self.local_dirty[index]:
+            self.local_dirty[index] = True
+            self.dirty_count += 1
+
+    def create_node(self, parent: SceneNode = None, position: vec3 = None, rotation: vec3 = None,
+                    scale=None, surface=None) -> SceneNode:
+        if self.free_indices:
+            index = self.free_indices.pop()
+        else:
+            index = len(self.nodes)
+            if index >= self.capacity:
+                self.grow(max(2 * self.capacity, 64))
+            self.nodes.append(None)
+
+        node = SceneNode(self, index, None)
+        self.nodes[index] = node
+        self.alive[index] = True
+        self.positions[index] = 0
+        self.rotations[index] = 0
+        self.scales[index] = 1
+        self.parents[index] = -1
+        self.depths[index] = 0
+        self.count += 1
+        self.local_dirty[index] = False
+        self.mark_dirty(index)
+        self.levels = None
+
+        if parent is not None:
+            self.set_parent(node, parent)
+        if position is not None:
+            node.position = position
+        if rotation is not None:
+            node.rotation = rotation
+        if scale is not None:
+            node.scale = scale
+        node.surface = surface
+        return node
+
+    def set_parent(self, node: SceneNode, parent: Optional[SceneNode]):
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is node:
+                raise AttributeError(f"Can't parent {node} to its own descendant {parent}")
+            ancestor = ancestor.parent
+
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        node.parent = parent
+        if parent is not None:
+            parent.children.append(node)
+        self.parents[node.index] = -1 if parent is None else parent.index
+
+        # depths of the whole subtree change with the new parent
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            self.depths[current.index] = 0 if current.parent is None else self.depths[current.parent.index] + 1
+            stack.extend(current.children)
+        self.mark_dirty(node.index)
+        self.levels = None
+
+    def remove_node(self, node: SceneNode):
+        """
+        Removes the node and all of its descendants
+        """
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            stack.extend(current.children)
+            index = current.index
+            if self.local_dirty[index]:
+                self.dirty_count -= 1
+            self.alive[index] = False
+            self.local_dirty[index] = False
+            self.nodes[index] = None
+            self.free_indices.append(index)
+            self.count -= 1
+            if current.proxy_id is not None and self.spatial_index is not None:
+                self.spatial_index.remove(current.proxy_id)
+                current.proxy_id = None
+        self.levels = None
+
+    def build_levels(self):
+        alive = np.nonzero(self.alive[:len(self.nodes)])[0]
+        depths = self.depths[alive]
+        self.levels = [alive[depths == depth] for depth in range(int(depths.max(initial=-1)) + 1)]
+
+    def update(self) -> bool:
+        """
+        Recomputes the world matrices of dirty nodes and their descendants.
+        Returns False without touching any array when nothing changed.
+        """
+        if self.dirty_count == 0:
+            if len(self.changed):
+                self.changed = np.zeros(0, dtype=np.int64)
+            return False
+        if self.levels is None:
+            self.build_levels()
+
+        size = len(self.nodes)
+        dirty = np.nonzero(self.local_dirty[:size])[0]
+        self.local[dirty] = TransformBatch.from_trs(self.positions[dirty], self.rotations[dirty],
+                                                    self.scales[dirty]).matrices
+
+        world_dirty = self.local_dirty[:size].copy()
+        for depth, level in enumerate(self.levels):
+            if depth == 0:
+                roots = level[world_dirty[level]]
+                self.world[roots] = self.local[roots]
+                continue
+            parents = self.parents[level]
+            world_dirty[level] |= world_dirty[parents]
+            nodes = level[world_dirty[level]]
+            if len(nodes):
+                self.world[nodes] = np.matmul(self.world[self.parents[nodes]], self.local[nodes])
+
+        self.local_dirty[:size] = False
+        self.dirty_count = 0
+        self.changed = np.nonzero(world_dirty)[0]
+        if self.spatial_index is not None:
+            self.update_spatial_index()
+        return True
+
+    def update_spatial_index(self):
+        for index in self.changed:
+            node = self.nodes[index]
+            if node is None or node.surface is None or node.surface.bounds is None:
+                continue
+            if node.proxy_id is None:
+                node.proxy_id = self.spatial_index.insert_bounds(node, node.surface.bounds, node.world_matrix)
+            else:
+                self.spatial_index.move_bounds(node.proxy_id, node.surface.bounds, node.world_matrix)
+
+    def draw(self, uniforms: List[Uniform], queue=None, nodes: List[SceneNode] = None):
+        """
+        Draws the surfaces of all nodes (or the given ones, e.g. from a spatial index query)
+        """
+        if nodes is None:
+            nodes = self.nodes
+        for node in nodes:
+            if node is None or node.surface is None:
+                continue
+            node.surface.draw(uniforms + [Uniform("u_Model", node.world_matrix)], queue)
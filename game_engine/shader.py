@@ -1,118 +1,382 @@
 import logging
+import weakref
 from builtins import bytes
 from ctypes import (
-    byref, c_char, c_char_p, c_int, c_float, cast, create_string_buffer, pointer,
+    byref, c_char, c_char_p, c_int, c_uint, c_float, cast, create_string_buffer, pointer,
     POINTER, addressof
 )
+from typing import Dict, NamedTuple, Optional, Tuple
 
+import pyglet
 from pyglet.gl import glCreateProgram, glDeleteProgram, GL_VERTEX_SHADER, GL_FRAGMENT_SHADER, glCreateShader
 from pyglet.gl import glCompileShader, glGetShaderiv, glShaderSource, GL_COMPILE_STATUS, glGetShaderInfoLog
 from pyglet.gl import glAttachShader, GL_INFO_LOG_LENGTH, glLinkProgram, glGetProgramiv, GL_LINK_STATUS
-from pyglet.gl import glGetProgramInfoLog, glUseProgram, glGetUniformLocation, glUniform1f, glUniform2f
+from pyglet.gl import glGetProgramInfoLog, glGetUniformLocation, glUniform1f, glUniform2f
 from pyglet.gl import glUniform3f, glUniform4f, glUniformMatrix4fv, glUniform1i, glUniform2i, glUniform3i
-from pyglet.gl import glUniform4i
+from pyglet.gl import glUniform4i, glGetAttribLocation, glGetActiveUniform, GL_ACTIVE_UNIFORMS, GL_ACTIVE_UNIFORM_MAX_LENGTH
+from pyglet.gl import GL_FLOAT, GL_FLOAT_VEC2, GL_FLOAT_VEC3, GL_FLOAT_VEC4, GL_FLOAT_MAT4, GL_INT, GL_INT_VEC2
+from pyglet.gl import GL_INT_VEC3, GL_INT_VEC4, GL_BOOL, GL_SAMPLER_2D, GL_SAMPLER_CUBE
+from pyglet.gl import glDetachShader, glDeleteShader, glGetIntegerv, glProgramParameteri, glProgramBinary
+from pyglet.gl import glGetProgramBinary, GL_NUM_PROGRAM_BINARY_FORMATS, GL_PROGRAM_BINARY_RETRIEVABLE_HINT
+from pyglet.gl import GL_PROGRAM_BINARY_LENGTH, GL_TRUE
+from pyglet.gl import glGetUniformBlockIndex, glUniformBlockBinding, GL_INVALID_INDEX
+from pyglet.gl.lib import GLException
 
 from game_engine.math import mat4, vec3, vec2
+from game_engine.render_state import RENDER_STATE
+from game_engine.render_stats import RENDER_STATS
+
+
+class UniformInfo(NamedTuple):
+    location: int
+    type: int
+    size: int
+
+
+# location -1 means the uniform is not active in the program, uploads to it are skipped
+MISSING_UNIFORM = UniformInfo(-1, 0, 0)
+
+# uniform block name -> binding point, programs declaring one of these blocks get it bound after linking
+UNIFORM_BLOCK_BINDINGS = {
+    "FrameUniforms": 0,
+}
+
+FLOAT_UNIFORM_FUNCTIONS = {
+    1: glUniform1f,
+    2: glUniform2f,
+    3: glUniform3f,
+    4: glUniform4f
+}
+
+INT_UNIFORM_FUNCTIONS = {
+    1: glUniform1i,
+    2: glUniform2i,
+    3: glUniform3i,
+    4: glUniform4i
+}
+
+
+def _upload_float(location, data):
+    glUniform1f(location, data)
+
+
+def _upload_vec2(location, data):
+    glUniform2f(location, data.x, data.y)
+
+
+def _upload_vec3(location, data):
+    glUniform3f(location, data.x, data.y, data.z)
+
+
+def _upload_vec4(location, data):
+    glUniform4f(location, *data)
+
+
+def _upload_int(location, data):
+    glUniform1i(location, data)
+
+
+def _upload_ivec(location, data):
+    INT_UNIFORM_FUNCTIONS[len(data)](location, *data)
+
+
+def _upload_mat4(location, data):
+    # mat4 is row-major, let GL transpose it
+    glUniformMatrix4fv(location, 1, True, data.numbers.ctypes.data_as(POINTER(c_float)))
+
+
+# GL uniform type -> upload function taking (location, data)
+UNIFORM_UPLOADERS = {
+    GL_FLOAT: _upload_float,
+    GL_FLOAT_VEC2: _upload_vec2,
+    GL_FLOAT_VEC3: _upload_vec3,
+    GL_FLOAT_VEC4: _upload_vec4,
+    GL_FLOAT_MAT4: _upload_mat4,
+    GL_INT: _upload_int,
+    GL_BOOL: _upload_int,
+    GL_SAMPLER_2D: _upload_int,
+    GL_SAMPLER_CUBE: _upload_int,
+    GL_INT_VEC2: _upload_ivec,
+    GL_INT_VEC3: _upload_ivec,
+    GL_INT_VEC4: _upload_ivec,
+}
+
+
+def read_source(file_name: str) -> str:
+    with open(file_name) as f:
+        return f.read()
+
+
+# context -> whether it offers program binary formats, asked once per context instead of once per program
+PROGRAM_BINARY_SUPPORT = weakref.WeakKeyDictionary()
+
+
+def supports_program_binaries() -> bool:
+    context = pyglet.gl.current_context
+    supported = PROGRAM_BINARY_SUPPORT.get(context) if context is not None else None
+    if supported is not None:
+        return supported
+    count = c_int(0)
+    try:
+        glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS, byref(count))
+        supported = count.value > 0
+    except GLException:
+        supported = False
+    if context is not None:
+        PROGRAM_BINARY_SUPPORT[context] = supported
+    return supported
 
 
 class Shader:
-    def __init__(self, vertex_shader_name: str = "", fragment_shader_name: str = ""):
+    def __init__(self, vertex_shader_name: str = "", fragment_shader_name: str = "",
+                 vertex_source: str = None, fragment_source: str = None, binary: Tuple[int, bytes] = None):
+        """
+        The sources are read from the files unless given.
+        binary: (format, data) from get_binary(), the sources are only compiled if GL rejects it
+        """
         self.log = logging.getLogger(__name__)
         self.log.setLevel(logging.INFO)
 
         self.handle = None
         self.linked = False
+        # incremented whenever the program is replaced, users re-query attribute locations on a change
+        self.version = 0
+        self.uniform_infos: Dict[str, UniformInfo] = {}
+        self.attribute_locations: Dict[str, int] = {}
         self.vertex_shader_name = vertex_shader_name
         self.fragment_shader_name = fragment_shader_name
 
-        self.compile()
-
-    def compile(self):
-        if self.handle is not None:
-            glDeleteProgram(self.handle)
-        self.handle = glCreateProgram()
-
-        if len(self.vertex_shader_name) > 0:
-            with open(self.vertex_shader_name) as f:
-                vertex_source = f.readlines()
-            self.create_shader(vertex_source, GL_VERTEX_SHADER)
-
-        if len(self.fragment_shader_name) > 0:
-            with open(self.fragment_shader_name) as f:
-                fragment_source = f.readlines()
-            self.create_shader(fragment_source, GL_FRAGMENT_SHADER)
-
-        self.link()
-
-    def create_shader(self, strings, t):
-        count = len(strings)
+        self.from_binary = binary is not None and self.load_binary(*binary)
+        if not self.from_binary:
+            self.compile(vertex_source, fragment_source)
+
+    def compile(self, vertex_source: str = None, fragment_source: str = None) -> bool:
+        """
+        Builds the program from source, reading the files for sources that are not given.
+        If a program already exists it is only replaced when the new one links, so a broken
+        edit during hot reloading keeps the last working version.
+        """
+        if vertex_source is None:
+            vertex_source = read_source(self.vertex_shader_name) if self.vertex_shader_name else ""
+        if fragment_source is None:
+            fragment_source = read_source(self.fragment_shader_name) if self.fragment_shader_name else ""
+
+        handle = glCreateProgram()
+        if supports_program_binaries():
+            glProgramParameteri(handle, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        shaders = [self.create_shader(handle, vertex_source, GL_VERTEX_SHADER),
+                   self.create_shader(handle, fragment_source, GL_FRAGMENT_SHADER)]
+
+        glLinkProgram(handle)
+        # drivers may link a program without the stage that failed to compile
+        compiled = all(shader is None or self.was_compile_successful(shader, log_errors=False) for shader in shaders)
+        # the program keeps what it needs, the shader objects are not used again
+        for shader in shaders:
+            if shader is not None:
+                glDetachShader(handle, shader)
+                glDeleteShader(shader)
+
+        if not compiled or not self.was_link_successful(handle):
+            self.log.warn("Could not link shader program")
+            if self.handle is not None:
+                glDeleteProgram(handle)
+                return False
+            self.handle = handle
+            self.linked = False
+            return False
+        self.replace_program(handle)
+        return True
+
+    def create_shader(self, program, source: str, t):
         # if we have no source code, ignore this shader
-        if count <= 0:
+        if len(source) == 0:
             self.log.info("Source string was empty. Not doing anything")
-            return
+            return None
 
         shader = glCreateShader(t)
 
-        string_buffers = [
-            create_string_buffer(bytes(s, "utf-8")) for s in strings]
-        src = (c_char_p * count)(*map(addressof, string_buffers))
-        glShaderSource(shader, count, cast(
-            pointer(src), POINTER(POINTER(c_char))), None)
+        # the whole file as one string
+        source_buffer = create_string_buffer(bytes(source, "utf-8"))
+        src = (c_char_p * 1)(addressof(source_buffer))
+        glShaderSource(shader, 1, cast(pointer(src), POINTER(POINTER(c_char))), None)
 
         glCompileShader(shader)
 
         if self.was_compile_successful(shader):
-            glAttachShader(self.handle, shader)
+            glAttachShader(program, shader)
         else:
             self.log.warn("Could not compile shader")
+        return shader
 
-    def was_compile_successful(self, shader):
+    def was_compile_successful(self, shader, log_errors: bool = True):
         status = c_int(0)
         glGetShaderiv(shader, GL_COMPILE_STATUS, byref(status))
-        if not status:
+        if not status and log_errors:
             glGetShaderiv(shader, GL_INFO_LOG_LENGTH, byref(status))
             buffer = create_string_buffer(status.value)
             glGetShaderInfoLog(shader, status, None, buffer)
             self.log.error(f"{buffer.value}")
         return status
 
-    def link(self):
-        glLinkProgram(self.handle)
-
-        if self.was_link_successful():
-            self.linked = True
-        else:
-            self.log.warn("Could not link shader program")
-
-    def was_link_successful(self):
+    def replace_program(self, handle):
+        if self.handle is not None:
+            RENDER_STATE.forget_program(self.handle)
+            glDeleteProgram(self.handle)
+        self.handle = handle
+        self.linked = True
+        self.version += 1
+        self.uniform_infos = {}
+        self.attribute_locations = {}
+        self.introspect_uniforms()
+        self.bind_uniform_blocks()
+
+    def was_link_successful(self, handle=None, log_errors: bool = True):
+        if handle is None:
+            handle = self.handle
         status = c_int(0)
-        glGetProgramiv(self.handle, GL_LINK_STATUS, byref(status))
-        if not status:
-            glGetProgramiv(self.handle, GL_INFO_LOG_LENGTH, byref(status))
+        glGetProgramiv(handle, GL_LINK_STATUS, byref(status))
+        if not status and log_errors:
+            glGetProgramiv(handle, GL_INFO_LOG_LENGTH, byref(status))
             buffer = create_string_buffer(status.value)
-            glGetProgramInfoLog(self.handle, status, None, buffer)
+            glGetProgramInfoLog(handle, status, None, buffer)
             self.log.error(f"{buffer.value}")
         return status
 
+    def get_binary(self) -> Optional[Tuple[int, bytes]]:
+        """
+        Returns (format, data) of the linked program, or None if the driver doesn't provide one
+        """
+        if not self.linked or not supports_program_binaries():
+            return None
+        length = c_int(0)
+        glGetProgramiv(self.handle, GL_PROGRAM_BINARY_LENGTH, byref(length))
+        if length.value == 0:
+            return None
+        buffer = create_string_buffer(length.value)
+        binary_format = c_uint(0)
+        glGetProgramBinary(self.handle, length, None, byref(binary_format), buffer)
+        return binary_format.value, buffer.raw
+
+    def load_binary(self, binary_format: int, data: bytes) -> bool:
+        """
+        Replaces the program with a binary from get_binary(), fails if the driver changed since
+        """
+        if not supports_program_binaries():
+            return False
+        handle = glCreateProgram()
+        try:
+            glProgramBinary(handle, binary_format, data, len(data))
+        except GLException:
+            glDeleteProgram(handle)
+            return False
+        if not self.was_link_successful(handle, log_errors=False):
+            glDeleteProgram(handle)
+            return False
+        self.replace_program(handle)
+        return True
+
+    def introspect_uniforms(self):
+        """
+        Builds the name -> (location, type, size) table of all active uniforms.
+        Array uniforms are registered under their plain name and each element name.
+        """
+        count = c_int(0)
+        glGetProgramiv(self.handle, GL_ACTIVE_UNIFORMS, byref(count))
+        max_length = c_int(0)
+        glGetProgramiv(self.handle, GL_ACTIVE_UNIFORM_MAX_LENGTH, byref(max_length))
+
+        name_buffer = create_string_buffer(max(max_length.value, 1))
+        length = c_int(0)
+        size = c_int(0)
+        uniform_type = c_uint(0)
+        for index in range(count.value):
+            glGetActiveUniform(self.handle, index, len(name_buffer), byref(length),
+                               byref(size), byref(uniform_type), name_buffer)
+            name = name_buffer.value.decode("utf-8")
+            location = glGetUniformLocation(self.handle, name_buffer.value)
+            info = UniformInfo(location, uniform_type.value, size.value)
+            self.uniform_infos[name] = info
+
+            if name.endswith("[0]"):
+                base_name = name[:-3]
+                self.uniform_infos[base_name] = info
+                for element in range(1, size.value):
+                    element_name = f"{base_name}[{element}]"
+                    element_location = glGetUniformLocation(self.handle, bytes(element_name, "utf-8"))
+                    self.uniform_infos[element_name] = UniformInfo(element_location, uniform_type.value, 1)
+
+        self.log.info(f"Found {count.value} active uniforms")
+
+    def bind_uniform_blocks(self):
+        # block bindings are program state and not guaranteed to survive a program binary, set them every time
+        for name, binding in UNIFORM_BLOCK_BINDINGS.items():
+            index = glGetUniformBlockIndex(self.handle, bytes(name, "utf-8"))
+            if index != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.handle, index, binding)
+
+    def get_uniform_info(self, name: str) -> UniformInfo:
+        info = self.uniform_infos.get(name)
+        if info is None:
+            # not reported by introspection, cache the lookup so we only ask GL once
+            location = glGetUniformLocation(self.handle, bytes(name, "utf-8"))
+            info = UniformInfo(location, 0, 1) if location != -1 else MISSING_UNIFORM
+            self.uniform_infos[name] = info
+        return info
+
+    def get_uniform_location(self, name: str) -> int:
+        return self.get_uniform_info(name).location
+
+    def get_attribute_location(self, name: str) -> int:
+        location = self.attribute_locations.get(name)
+        if location is None:
+            location = glGetAttribLocation(self.handle, bytes(name, "utf-8"))
+            self.attribute_locations[name] = location
+        return location
+
     def bind(self):
-        glUseProgram(self.handle)
+        RENDER_STATE.use_program(self.handle)
 
     @staticmethod
     def unbind():
-        glUseProgram(0)
+        RENDER_STATE.use_program(0)
 
     def uniform(self, name: str, data, index: int = -1):
         if index > -1:
             name = f"{name}[{index}]"
 
-        self.log.debug(f"Binding {name} with data: {data}")
-
         data_type = type(data)
+        if data_type == list:
+            for index, d in enumerate(data):
+                self.uniform(name, d, index)
+            return
+
+        if data_type == dict:
+            for key in data:
+                self.uniform(f"{name}.{key}", data[key])
+            return
+
+        info = self.uniform_infos.get(name)
+        if info is None:
+            info = self.get_uniform_info(name)
+        if info.location == -1:
+            return
+
+        uploader = UNIFORM_UPLOADERS.get(info.type)
+        if uploader is not None:
+            uploader(info.location, data)
+            RENDER_STATS.uniform_uploads += 1
+            return
+
+        # the type is unknown, select the upload from the python type
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"Binding {name} with data: {data}")
+
         if data_type == mat4:
-            self.uniform_matrixf(name, data)
+            _upload_mat4(info.location, data)
+            RENDER_STATS.uniform_uploads += 1
 
         elif data_type in [vec2, vec3]:
-            self.uniformf(name, *data)
+            self.uniformf(name, *data.to_list())
 
         elif data_type == float:
             self.uniformf(name, data)
@@ -120,56 +384,30 @@ class Shader:
         elif data_type == int:
             self.uniformi(name, data)
 
-        elif data_type == list:
-            for index, d in enumerate(data):
-                self.uniform(name, d, index)
-
-        elif data_type == dict:
-            for key in data:
-                self.uniform(f"{name}.{key}", data[key])
-
         else:
             self.log.error(f"Could not bind {name}")
-            return
-        self.log.debug(f"Bound {name} with data: {data}")
 
     def uniformf(self, name: str, *vals):
         # upload a floating point uniform
         # this program must be currently bound
         # check there are 1-4 values
         if len(vals) in range(1, 5):
-            c_vals = list(map(c_float, vals))
-            location = glGetUniformLocation(
-                self.handle, bytes(name, "utf-8"))
-            uniform_functions = {
-                1: glUniform1f,
-                2: glUniform2f,
-                3: glUniform3f,
-                4: glUniform4f
-            }
-            uniform_functions[len(c_vals)](location, *c_vals)
+            location = self.get_uniform_location(name)
+            FLOAT_UNIFORM_FUNCTIONS[len(vals)](location, *vals)
+            RENDER_STATS.uniform_uploads += 1
 
     def uniformi(self, name: str, *vals):
         # upload an integer uniform
         # this program must be currently bound
         # check there are 1-4 values
         if len(vals) in range(1, 5):
-            c_vals = list(map(c_int, vals))
-            # select the correct function
-            location = glGetUniformLocation(
-                self.handle, c_char_p(name.encode("utf-8")))
-            uniform_functions = {1: glUniform1i,
-                                 2: glUniform2i, 3: glUniform3i, 4: glUniform4i}
-            uniform_functions[len(c_vals)](location, *c_vals)
+            location = self.get_uniform_location(name)
+            INT_UNIFORM_FUNCTIONS[len(vals)](location, *vals)
+            RENDER_STATS.uniform_uploads += 1
 
     def uniform_matrixf(self, name: str, mat: mat4):
         # upload a uniform matrix
-        # works with matrices stored as lists,
-        # as well as euclid matrices
-        # obtain the uniform location
-        location = glGetUniformLocation(
-            self.handle, bytes(name, "utf-8"))
-        # upload the 4x4 floating point matrix
-        mat_values = (c_float * 16)(*mat.to_list())
-        # noinspection PyCallingNonCallable, PyTypeChecker
-        glUniformMatrix4fv(location, 1, True, mat_values)
+        # the location comes from the cached uniform table
+        location = self.get_uniform_location(name)
+        _upload_mat4(location, mat)
+        RENDER_STATS.uniform_uploads += 1
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pyglet.gl import gl_info
+
+from game_engine.shader import Shader, read_source
+
+LOG = logging.getLogger()
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "game_engine", "shaders")
+# binary format as little endian uint32 in front of the program binary
+BINARY_HEADER = struct.Struct("<I")
+
+
+def source_key(vertex_source: str, fragment_source: str) -> str:
+    sha = hashlib.sha1()
+    sha.update(vertex_source.encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(fragment_source.encode("utf-8"))
+    return sha.hexdigest()
+
+
+def driver_key() -> str:
+    # program binaries only load on the driver that created them
+    driver = f"{gl_info.get_vendor()}|{gl_info.get_renderer()}|{gl_info.get_version()}"
+    return hashlib.sha1(driver.encode("utf-8")).hexdigest()[:16]
+
+
+class ShaderRegistry:
+    """
+    Hands out one Shader per distinct source, so surfaces using the same files (or identical
+    sources under different names) share a program. With a cache_directory, e.g. DEFAULT_CACHE_DIRECTORY,
+    linked programs are stored there as binaries and loaded on the next start instead of compiling.
+    With watch enabled, poll() recompiles shaders whose files changed. The Shader objects are
+    updated in place, so surfaces pick up the new program without being recreated.
+    """
+
+    def __init__(self, cache_directory: Optional[str] = None, watch: bool = False,
+                 poll_interval: float = 0.5):
+        self.cache_directory = cache_directory
+        self.watch = watch
+        self.poll_interval = poll_interval
+        self.last_poll = 0.0
+
+        self.shaders: Dict[str, Shader] = {}
+        # (vertex file, fragment file) -> source key
+        self.files: Dict[Tuple[str, str], str] = {}
+        self.modification_times: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self.compiled = 0
+        self.loaded_binaries = 0
+
+    def __len__(self):
+        return len(self.shaders)
+
+    def get(self, vertex_file: str, fragment_file: str) -> Shader:
+        files = (vertex_file, fragment_file)
+        key = self.files.get(files)
+        if key is not None:
+            return self.shaders[key]
+
+        vertex_source = read_source(vertex_file)
+        fragment_source = read_source(fragment_file)
+        shader = self.get_from_source(vertex_source, fragment_source, vertex_file, fragment_file)
+        self.files[files] = source_key(vertex_source, fragment_source)
+        self.modification_times[files] = self.modification_time(files)
+        return shader
+
+    def get_from_source(self, vertex_source: str, fragment_source: str, vertex_file: str = "",
+                        fragment_file: str = "") -> Shader:
+        key = source_key(vertex_source, fragment_source)
+        shader = self.shaders.get(key)
+        if shader is not None:
+            return shader
+
+        binary = self.load_binary(key)
+        shader = Shader(vertex_file, fragment_file, vertex_source, fragment_source, binary)
+        if shader.from_binary:
+            self.loaded_binaries += 1
+            LOG.info(f"Loaded shader {vertex_file or key} from the binary cache")
+        else:
+            self.compiled += 1
+            self.store_binary(key, shader)
+        self.shaders[key] = shader
+        return shader
+
+    def binary_path(self, key: str) -> str:
+        return os.path.join(self.cache_directory, f"{key}-{driver_key()}.bin")
+
+    def load_binary(self, key: str) -> Optional[Tuple[int, bytes]]:
+        if self.cache_directory is None:
+            return None
+        try:
+            with open(self.binary_path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) <= BINARY_HEADER.size:
+            return None
+        binary_format, = BINARY_HEADER.unpack_from(data)
+        return binary_format, data[BINARY_HEADER.size:]
+
+    def store_binary(self, key: str, shader: Shader):
+        if self.cache_directory is None:
+            return
+        binary = shader.get_binary()
+        if binary is None:
+            return
+        binary_format, data = binary
+        path = self.binary_path(key)
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            # write to a temporary file first, a concurrent start never sees a partial binary
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(BINARY_HEADER.pack(binary_format))
+                f.write(data)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            LOG.warning(f"Could not write shader binary {path}: {e}")
+
+    @staticmethod
+    def modification_time(files: Tuple[str, str]) -> Tuple[float, float]:
+        try:
+            return os.stat(files[0]).st_mtime, os.stat(files[1]).st_mtime
+        except OSError:
+            # e.g. while an editor replaces the file
+            return 0.0, 0.0
+
+    def poll(self) -> List[Shader]:
+        """
+        Recompiles shaders whose files changed, call once per frame. Does nothing unless watching.
+        """
+        if not self.watch:
+            return []
+        now = time.perf_counter()
+        if now - self.last_poll < self.poll_interval:
+            return []
+        self.last_poll = now
+
+        reloaded = []
+        for files, old_times in list(self.modification_times.items()):
+            times = self.modification_time(files)
+            if times == old_times or times == (0.0, 0.0):
+                continue
+            self.modification_times[files] = times
+            shader = self.reload(files)
+            if shader is not None:
+                reloaded.append(shader)
+        return reloaded
+
+    def reload(self, files: Tuple[str, str]) -> Optional[Shader]:
+        """
+        Recompiles the shader of the files in place, so every surface holding it draws the edit.
+        Other files sharing the shader are forgotten, get() builds their unchanged source again.
+        """
+        old_key = self.files[files]
+        shader = self.shaders[old_key]
+        vertex_source = read_source(files[0])
+        fragment_source = read_source(files[1])
+        key = source_key(vertex_source, fragment_source)
+        if key == old_key:
+            return None
+
+        if not shader.compile(vertex_source, fragment_source):
+            LOG.error(f"Reloading {files[0]} failed, keeping the previous version")
+            return None
+        LOG.info(f"Reloaded {files[0]} and {files[1]}")
+        self.compiled += 1
+
+        del self.shaders[old_key]
+        for other_files, other_key in list(self.files.items()):
+            if other_key == old_key and other_files != files:
+                del self.files[other_files]
+                del self.modification_times[other_files]
+        self.files[files] = key
+        if key in self.shaders:
+            # identical to a shader loaded from other files, which stays the one handed out
+            return shader
+        self.shaders[key] = shader
+        self.store_binary(key, shader)
+        return shader
+
+
+# run_game turns the binary cache on, see its shader_cache_directory
+SHADER_REGISTRY = ShaderRegistry(watch=os.environ.get("GAME_ENGINE_WATCH_SHADERS", "") not in ["", "0"])
@@ -0,0 +1,306 @@
+import logging
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import cv2
+import numpy as np
+from pyglet.gl import GL_BGR, GL_UNSIGNED_BYTE, GL_TRIANGLES, glDrawElementsBaseVertex
+
+from game_engine.asset import Texture, get_texture_mesh_shader, decode_image_file
+from game_engine.dynamic_buffer import DynamicBuffer
+from game_engine.math import identity
+from game_engine.render_stats import RENDER_STATS
+from game_engine.vertex_objects import VAO, VertexAttribute, Uniform, index_buffer
+
+LOG = logging.getLogger()
+
+FLOATS_PER_SPRITE_VERTEX = 5
+SPRITE_VERTEX_BYTES = FLOATS_PER_SPRITE_VERTEX * 4
+# quad corners in the order they are written, relative to the sprite's bottom left
+QUAD_CORNERS = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32)
+QUAD_INDICES = np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32)
+
+
+class AtlasRegion(NamedTuple):
+    atlas: "TextureAtlas"
+    x: int
+    y: int
+    width: int
+    height: int
+    uvs: np.ndarray
+
+
+class TextureAtlas:
+    """
+    One texture that many images are packed into with a bottom-left skyline packer
+    """
+
+    def __init__(self, width: int = 2048, height: int = 2048, padding: int = 1):
+        self.width = width
+        self.height = height
+        self.padding = padding
+        # skyline segments as [x, y, width], sorted by x and covering the whole atlas width
+        self.skyline = [[0, 0, width]]
+        self.texture = Texture(np.zeros((height, width, 3), dtype=np.uint8), GL_BGR, GL_UNSIGNED_BYTE)
+        self.used_area = 0
+
+    @property
+    def occupancy(self) -> float:
+        return self.used_area / (self.width * self.height)
+
+    def find_position(self, width: int, height: int):
+        best = None
+        for index, (x, _, _) in enumerate(self.skyline):
+            if x + width > self.width:
+                break
+            # the rectangle rests on the highest segment it spans
+            y = 0
+            remaining = width
+            end = index
+            while remaining > 0:
+                y = max(y, self.skyline[end][1])
+                remaining -= self.skyline[end][2]
+                end += 1
+            if y + height > self.height:
+                continue
+            if best is None or y < best[1] or (y == best[1] and x < best[0]):
+                best = (x, y, index)
+        return best
+
+    def place(self, x: int, y: int, width: int, height: int, index: int):
+        new_segment = [x, y + height, width]
+        end = x + width
+        remaining = []
+        for segment in self.skyline[index:]:
+            seg_x, seg_y, seg_width = segment
+            if seg_x + seg_width <= end:
+                continue
+            if seg_x < end:
+                segment = [end, seg_y, seg_x + seg_width - end]
+            remaining.append(segment)
+        skyline = self.skyline[:index] + [new_segment] + remaining
+
+        # merge neighbours of the same height
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1] = [merged[-1][0], merged[-1][1], merged[-1][2] + segment[2]]
+            else:
+                merged.append(segment)
+        self.skyline = merged
+
+    def add(self, image: np.ndarray) -> Optional[AtlasRegion]:
+        """
+        Copies the image into the atlas, returns None if there is no space left
+        """
+        if image.ndim == 2 or image.shape[2] == 1:
+            # grayscale, the atlas is BGR
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        padded_width = width + 2 * self.padding
+        padded_height = height + 2 * self.padding
+        position = self.find_position(padded_width, padded_height)
+        if position is None:
+            return None
+        x, y, index = position
+        self.place(x, y, padded_width, padded_height, index)
+
+        x += self.padding
+        y += self.padding
+        atlas_image = self.texture.image
+        atlas_image[y:y + height, x:x + width] = image[:, :, :3]
+        # repeat the border into the padding so linear filtering doesn't bleed neighbours in
+        if self.padding:
+            p = self.padding
+            atlas_image[y - p:y, x:x + width] = atlas_image[y, x:x + width]
+            atlas_image[y + height:y + height + p, x:x + width] = atlas_image[y + height - 1, x:x + width]
+            atlas_image[y - p:y + height + p, x - p:x] = atlas_image[y - p:y + height + p, x:x + 1]
+            atlas_image[y - p:y + height + p, x + width:x + width + p] = \
+                atlas_image[y - p:y + height + p, x + width - 1:x + width]
+        self.texture.uploaded = False
+        self.used_area += width * height
+
+        uvs = np.array([x / self.width, y / self.height,
+                        (x + width) / self.width, (y + height) / self.height], dtype=np.float32)
+        return AtlasRegion(self, x, y, width, height, uvs)
+
+
+class SpriteBatch:
+    """
+    Collects sprite quads during a frame and draws them with one draw call per atlas.
+    Images are packed into shared atlas textures, all quads of a frame go into one vertex buffer.
+    """
+
+    def __init__(self, atlas_size: int = 2048, pixels_per_unit: float = 1.0, padding: int = 1):
+        self.atlas_size = atlas_size
+        # pixels around each image in the atlases
+        self.padding = padding
+        self.pixels_per_unit = pixels_per_unit
+        self.atlases: List[TextureAtlas] = []
+        self.regions: Dict[str, AtlasRegion] = {}
+
+        self.shader = get_texture_mesh_shader()
+        self.vao = VAO()
+        self.attributes = [VertexAttribute('a_Position', 3, FLOATS_PER_SPRITE_VERTEX, 0),
+                           VertexAttribute('a_UV', 2, FLOATS_PER_SPRITE_VERTEX, 3)]
+        self.uniforms = [Uniform("u_Model", identity()), Uniform("u_TextureSampler", 0)]
+        # quads are rebuilt every frame, they go into a ring buffer instead of reallocating a buffer each frame
+        self.vertex_buffer = DynamicBuffer()
+        self.index_buffer = None
+        self.capacity = 0
+        # (shader version, vertex buffer handle) the VAO was set up for
+        self.setup_key = None
+
+        # per atlas: lists of sprite positions (x, y, z), sizes (w, h) and uv rects
+        self.pending: Dict[int, tuple] = {}
+        self.draw_calls = 0
+
+    def add_image(self, image: np.ndarray, name: str = None) -> AtlasRegion:
+        """
+        Packs an image (as returned by decode_image_file) into an atlas
+        """
+        height, width = image.shape[:2]
+        if width + 2 * self.padding > self.atlas_size or height + 2 * self.padding > self.atlas_size:
+            raise AttributeError(f"Image of size {width}x{height} does not fit into an atlas of {self.atlas_size}")
+
+        region = None
+        for atlas in self.atlases:
+            region = atlas.add(image)
+            if region is not None:
+                break
+        if region is None:
+            atlas = TextureAtlas(self.atlas_size, self.atlas_size, self.padding)
+            self.atlases.append(atlas)
+            LOG.info(f"Created texture atlas {len(self.atlases)}")
+            region = atlas.add(image)
+
+        if name is not None:
+            self.regions[name] = region
+        return region
+
+    def add_file(self, file_name: str) -> Optional[AtlasRegion]:
+        region = self.regions.get(file_name)
+        if region is not None:
+            return region
+        # only the pixels are needed, a cached texture would allocate GL storage that is never drawn
+        image = decode_image_file(file_name)
+        if image is None:
+            return None
+        return self.add_image(image, file_name)
+
+    def add_texture(self, texture: Texture, name: str = None) -> AtlasRegion:
+        # e.g. a texture from load_image_from_file, its image is copied into an atlas
+        return self.add_image(texture.image, name)
+
+    def begin(self):
+        self.pending = {}
+
+    def draw(self, region: Union[AtlasRegion, str], x: float, y: float, z: float = 0.0,
+             width: float = None, height: float = None):
+        """
+        Queues a sprite with its bottom left corner at (x, y, z), sized by the region unless given
+        """
+        if type(region) == str:
+            region = self.regions[region]
+        if width is None:
+            width = region.width / self.pixels_per_unit
+        if height is None:
+            height = region.height / self.pixels_per_unit
+
+        key = self.atlases.index(region.atlas)
+        positions, sizes, uvs = self.pending.setdefault(key, ([], [], []))
+        positions.append((x, y, z))
+        sizes.append((width, height))
+        uvs.append(region.uvs)
+
+    def draw_many(self, region: AtlasRegion, positions, sizes=None):
+        """
+        Queues many sprites of the same region, positions is (N, 3) and sizes (N, 2)
+        """
+        positions = np.asarray(positions, dtype=np.float32).reshape((-1, 3))
+        if sizes is None:
+            sizes = np.array([[region.width, region.height]], dtype=np.float32) / self.pixels_per_unit
+        sizes = np.broadcast_to(np.asarray(sizes, dtype=np.float32), (len(positions), 2))
+
+        key = self.atlases.index(region.atlas)
+        pending_positions, pending_sizes, pending_uvs = self.pending.setdefault(key, ([], [], []))
+        pending_positions.extend(positions)
+        pending_sizes.extend(sizes)
+        pending_uvs.extend(np.broadcast_to(region.uvs, (len(positions), 4)))
+
+    @staticmethod
+    def build_quads(positions: np.ndarray, sizes: np.ndarray, uvs: np.ndarray) -> np.ndarray:
+        count = len(positions)
+        vertices = np.empty((count, 4, FLOATS_PER_SPRITE_VERTEX), dtype=np.float32)
+        vertices[:, :, 0:2] = positions[:, np.newaxis, 0:2] + QUAD_CORNERS * sizes[:, np.newaxis, :]
+        vertices[:, :, 2] = positions[:, np.newaxis, 2]
+        # uv rect is (u0, v0, u1, v1), pick u0/u1 and v0/v1 per corner
+        vertices[:, :, 3] = np.where(QUAD_CORNERS[:, 0] == 0, uvs[:, np.newaxis, 0], uvs[:, np.newaxis, 2])
+        vertices[:, :, 4] = np.where(QUAD_CORNERS[:, 1] == 0, uvs[:, np.newaxis, 1], uvs[:, np.newaxis, 3])
+        return vertices.reshape((count * 4, FLOATS_PER_SPRITE_VERTEX))
+
+    def ensure_capacity(self, sprite_count: int):
+        if sprite_count <= self.capacity:
+            return
+        capacity = max(sprite_count, 2 * self.capacity, 64)
+        offsets = np.arange(capacity, dtype=np.uint32)[:, np.newaxis] * 4
+        indices = (QUAD_INDICES[np.newaxis, :] + offsets).ravel()
+        if self.index_buffer is not None:
+            self.index_buffer.delete()
+        self.index_buffer = index_buffer(indices, capacity * 4)
+        self.capacity = capacity
+        # the VAO has to pick up the new index buffer
+        self.vao.delete()
+        self.setup_key = None
+
+    def setup(self):
+        self.shader.bind()
+        self.vao.bind()
+        self.vertex_buffer.bind()
+        self.index_buffer.bind()
+        for index, attrib in enumerate(self.attributes):
+            attrib.bind(index, self.shader)
+        self.setup_key = (self.shader.version, self.vertex_buffer.handle.value)
+
+    def end(self, uniforms: List[Uniform]):
+        """
+        Writes all queued sprites into the vertex buffer and draws them, one call per atlas
+        """
+        self.draw_calls = 0
+        if not self.pending:
+            return
+
+        keys = sorted(self.pending)
+        batches = []
+        for key in keys:
+            positions, sizes, uvs = self.pending[key]
+            batches.append(self.build_quads(np.asarray(positions, dtype=np.float32),
+                                            np.asarray(sizes, dtype=np.float32),
+                                            np.asarray(uvs, dtype=np.float32)))
+        vertices = np.concatenate(batches)
+        sprite_count = len(vertices) // 4
+        self.ensure_capacity(sprite_count)
+
+        # the attribute pointers start at the beginning of the buffer, the draws add the base vertex of this frame
+        offset = self.vertex_buffer.write(vertices, SPRITE_VERTEX_BYTES)
+        base_vertex = offset // SPRITE_VERTEX_BYTES
+        if self.setup_key != (self.shader.version, self.vertex_buffer.handle.value):
+            self.setup()
+
+        self.shader.bind()
+        self.vao.bind()
+        for uniform in self.uniforms + uniforms:
+            uniform.bind(self.shader)
+
+        index_size = self.index_buffer.data.itemsize
+        first_sprite = 0
+        for key, batch in zip(keys, batches):
+            count = len(batch) // 4
+            self.atlases[key].texture.bind()
+            glDrawElementsBaseVertex(GL_TRIANGLES, count * 6, self.index_buffer.element_type,
+                                     first_sprite * 6 * index_size, base_vertex)
+            RENDER_STATS.count_draw(count * 6)
+            first_sprite += count
+            self.draw_calls += 1
+        # the region is written again once the GPU finished these draws
+        self.vertex_buffer.fence()
+        self.pending = {}
@@ -1,11 +1,15 @@
+#version 140
+
 uniform sampler2D u_TextureSampler;
 
-varying vec2 v_UV;
-varying vec3 v_Position;
+in vec2 v_UV;
+in vec3 v_Position;
+
+out vec4 o_Color;
 
 void main() {
-    // gl_FragColor = vec4(u_Color, 1.0);
-    gl_FragColor = texture2D(u_TextureSampler, v_UV);
-    // gl_FragColor = vec4(1.0, 1.0, 1.0, 1.0);
-    // gl_FragColor = vec4(v_UV, 0.0, 1.0);
+    // o_Color = vec4(u_Color, 1.0);
+    o_Color = texture(u_TextureSampler, v_UV);
+    // o_Color = vec4(1.0, 1.0, 1.0, 1.0);
+    // o_Color = vec4(v_UV, 0.0, 1.0);
 }
@@ -0,0 +1,12 @@
+#version 140
+
+uniform sampler2D u_TextureSampler;
+
+in vec2 v_UV;
+in vec4 v_Tint;
+
+out vec4 o_Color;
+
+void main() {
+    o_Color = texture(u_TextureSampler, v_UV) * v_Tint;
+}
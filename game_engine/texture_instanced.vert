@@ -0,0 +1,22 @@
+#version 140
+
+in vec3 a_Position;
+in vec2 a_UV;
+in mat4 a_Model;
+in vec4 a_Tint;
+in vec2 a_UVOffset;
+
+layout(std140, row_major) uniform FrameUniforms {
+    mat4 u_View;
+    mat4 u_Projection;
+    mat4 u_ViewProjection;
+};
+
+out vec2 v_UV;
+out vec4 v_Tint;
+
+void main() {
+    gl_Position = u_ViewProjection * a_Model * vec4(a_Position, 1);
+    v_UV = a_UV + a_UVOffset;
+    v_Tint = a_Tint;
+}
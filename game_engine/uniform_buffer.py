@@ -0,0 +1,116 @@
+import logging
+from typing import List
+
+import numpy as np
+from pyglet.gl import GLfloat, GL_UNIFORM_BUFFER, GL_DYNAMIC_DRAW, glBindBufferBase
+
+from game_engine.math import mat4, identity
+from game_engine.render_state import RENDER_STATE
+from game_engine.shader import UNIFORM_BLOCK_BINDINGS
+from game_engine.vertex_objects import VBO, Uniform
+
+LOG = logging.getLogger()
+
+FRAME_UNIFORMS_BINDING = UNIFORM_BLOCK_BINDINGS["FrameUniforms"]
+
+# std140 layout of the FrameUniforms block, mat4 members are 64 bytes each without padding.
+# The block is declared row_major, so the row-major mat4 numbers are copied as they are.
+FRAME_UNIFORMS_LAYOUT = np.dtype([
+    ("view", np.float32, (4, 4)),
+    ("projection", np.float32, (4, 4)),
+    ("view_projection", np.float32, (4, 4)),
+])
+
+
+class UniformBuffer(VBO):
+    """
+    Buffer backing a uniform block, bound to a fixed binding point
+    """
+
+    def __init__(self, binding: int, layout: np.dtype):
+        self.binding = binding
+        self.layout = layout
+        self.values = np.zeros(1, dtype=layout)
+        super().__init__(GL_UNIFORM_BUFFER, 1, self.values.view(np.float32), GLfloat)
+
+    def upload(self, usage=GL_DYNAMIC_DRAW):
+        # glBufferData orphans the storage of the previous frame, which the GPU may still be reading
+        super().upload(usage)
+        self.bind_base()
+
+    def bind_base(self):
+        # binding points are per context state
+        RENDER_STATE.bind_buffer(GL_UNIFORM_BUFFER, self.handle)
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.binding, self.handle)
+
+
+class FrameUniforms:
+    """
+    View, projection and view-projection shared by all draws of a frame.
+    set() uploads them once into the FrameUniforms block, instead of every draw uploading them to its program.
+    The window calls set() with data.view_matrix and data.projection_matrix before game.render,
+    calling it again during render switches the camera for the following draws.
+    Draws in the render queue are only issued at the end of the frame and see the camera set last.
+    The shaders don't declare u_View and u_Projection outside of the block anymore, draws that still
+    pass them as uniforms get them copied into the block by set_from_uniforms().
+    """
+
+    def __init__(self):
+        self.buffer = None
+        # None until the first set(), the render queue only culls with a known camera
+        self.view = None
+        self.projection = None
+        self.view_projection = None
+        self.warned = False
+
+    def set(self, view: mat4, projection: mat4):
+        self.view = view
+        self.projection = projection
+        # reuses the matrix of the last frame
+        self.view_projection = projection.multiply(view, self.view_projection)
+
+        if self.buffer is None:
+            self.buffer = UniformBuffer(FRAME_UNIFORMS_BINDING, FRAME_UNIFORMS_LAYOUT)
+        values = self.buffer.values[0]
+        values["view"] = view.numbers
+        values["projection"] = projection.numbers
+        values["view_projection"] = self.view_projection.numbers
+        self.buffer.upload()
+
+    def set_from_uniforms(self, uniforms: List[Uniform]):
+        """
+        Fallback for draws passing u_View or u_Projection, uploads them if they differ from the block
+        """
+        view = None
+        projection = None
+        for uniform in uniforms:
+            if uniform.name == "u_View":
+                view = uniform.data
+            elif uniform.name == "u_Projection":
+                projection = uniform.data
+        if view is None and projection is None:
+            return
+        if not self.warned:
+            LOG.warning("u_View and u_Projection are read from the FrameUniforms block, "
+                        "set data.view_matrix and data.projection_matrix instead of passing them to draws")
+            self.warned = True
+
+        if view is None:
+            view = self.view if self.view is not None else identity()
+        if projection is None:
+            projection = self.projection if self.projection is not None else identity()
+        if self.buffer is not None:
+            # compared with what was uploaded, the caller may have changed the same matrix in place
+            values = self.buffer.values[0]
+            if np.array_equal(values["view"], view.numbers) and np.array_equal(values["projection"],
+                                                                               projection.numbers):
+                return
+        self.set(view, projection)
+
+    def delete(self):
+        if self.buffer is not None:
+            self.buffer.delete()
+            self.buffer = None
+
+
+FRAME_UNIFORMS = FrameUniforms()
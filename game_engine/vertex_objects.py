@@ -2,64 +2,162 @@ from ctypes import sizeof
 from typing import List
 import logging
 
-from pyglet.gl import GL_STATIC_DRAW, glBufferData, glBindBuffer, glGenBuffers
-from pyglet.gl import GLuint, GLfloat, GLint, GL_FLOAT, glGenVertexArrays, glBindVertexArray
-from pyglet.gl import GL_TRIANGLES, glDrawArrays, GL_FALSE, GL_ARRAY_BUFFER
-from pyglet.gl import glVertexAttribPointer, glEnableVertexAttribArray, glBindAttribLocation
+import numpy as np
+
+from pyglet.gl import GL_STATIC_DRAW, glBufferData, glGenBuffers
+from pyglet.gl import GLuint, GLfloat, GLint, GL_FLOAT, glGenVertexArrays
+from pyglet.gl import GL_TRIANGLES, glDrawArrays, GL_FALSE, GL_ARRAY_BUFFER, GL_ELEMENT_ARRAY_BUFFER
+from pyglet.gl import GLushort, GL_UNSIGNED_SHORT, GL_UNSIGNED_INT, GL_INT
+from pyglet.gl import glVertexAttribPointer, glEnableVertexAttribArray, glVertexAttribDivisor
+from pyglet.gl import glDeleteBuffers, glDeleteVertexArrays, GL_DYNAMIC_DRAW
 
 from game_engine.shader import Shader
+from game_engine.render_state import RENDER_STATE
+from game_engine.render_stats import RENDER_STATS
 
 LOG = logging.getLogger()
 
+GL_DATA_TYPES = {
+    GLfloat: GL_FLOAT,
+    GLint: GL_INT,
+    GLuint: GL_UNSIGNED_INT,
+    GLushort: GL_UNSIGNED_SHORT,
+}
+
+
+def as_buffer_array(data, dtype) -> np.ndarray:
+    """
+    Returns data as a contiguous numpy array of the given dtype.
+    Contiguous arrays of the right dtype and other buffer-protocol objects are not copied.
+    """
+    if isinstance(data, np.ndarray):
+        return np.ascontiguousarray(data, dtype=dtype)
+    if isinstance(data, (list, tuple)):
+        return np.array(data, dtype=dtype)
+    return np.frombuffer(data, dtype=dtype)
+
 
 class VBO:
     def __init__(self, buffer_type, nums_per_vertex, data, data_type):
         self.type = buffer_type
         self.nums_per_vertex = nums_per_vertex
         self.uploaded = False
-        self.data = data
         self.data_type = data_type
+        self.data = data
+        self.handle = None
+        self.create_handle()
+
+    def create_handle(self):
         self.handle = GLuint()
         glGenBuffers(1, self.handle)
 
+    def delete(self):
+        """
+        Frees the GL buffer, the data is kept and uploaded again on the next bind
+        """
+        if self.handle is None:
+            return
+        RENDER_STATE.forget_buffer(self.handle)
+        glDeleteBuffers(1, self.handle)
+        self.handle = None
+        self.uploaded = False
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = as_buffer_array(value, np.dtype(self.data_type))
+        self.uploaded = False
+
     def bind(self):
-        glBindBuffer(self.type, self.handle)
         if not self.uploaded:
             self.upload()
+        else:
+            RENDER_STATE.bind_buffer(self.type, self.handle)
 
     def unbind(self):
-        glBindBuffer(self.type, 0)
+        RENDER_STATE.bind_buffer(self.type, 0)
 
     def upload(self, usage=GL_STATIC_DRAW):
-        glBindBuffer(self.type, self.handle)
-        data_gl = (self.data_type * len(self.data))(*self.data)
-        size = sizeof(data_gl)
-        glBufferData(self.type, size, data_gl, usage)
+        if self.handle is None:
+            self.create_handle()
+        RENDER_STATE.bind_buffer(self.type, self.handle)
+        # hand the array memory straight to GL, no intermediate ctypes array
+        glBufferData(self.type, self.data.nbytes, self.data.ctypes.data, usage)
         self.uploaded = True
+        RENDER_STATS.buffer_uploads += 1
+        RENDER_STATS.buffer_upload_bytes += self.data.nbytes
+
+    @property
+    def element_type(self) -> int:
+        return GL_DATA_TYPES[self.data_type]
 
     def __len__(self):
-        return len(self.data) // self.nums_per_vertex
+        return self.data.size // self.nums_per_vertex
 
 
-def array_buffer(vertices: list, nums_per_vertex=3):
+def array_buffer(vertices, nums_per_vertex=3):
     return VBO(GL_ARRAY_BUFFER, nums_per_vertex, vertices, GLfloat)
 
 
-def index_buffer(indices: list):
-    return VBO(GL_ELEMENT_ARRAY_BUFFER, 2, indices, GLint)
+def index_data_type(vertex_count: int):
+    # 16 bit indices are enough for most meshes and halve the index memory
+    if vertex_count <= 1 << 16:
+        return GLushort
+    return GLuint
+
+
+def index_buffer(indices, vertex_count: int = None):
+    if vertex_count is None:
+        vertex_count = int(np.max(indices)) + 1 if len(indices) > 0 else 0
+    return VBO(GL_ELEMENT_ARRAY_BUFFER, 1, indices, index_data_type(vertex_count))
+
+
+def deduplicate_vertices(vertices):
+    """
+    Merges identical interleaved vertices, keeping the order of their first occurrence.
+    Returns the (M, k) unique vertices and the indices that rebuild the original (N, k) data.
+    """
+    # adding 0 turns -0.0 into 0.0, so both hash to the same bytes
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32) + np.float32(0)
+    row_type = np.dtype((np.void, vertices.dtype.itemsize * vertices.shape[1]))
+    rows = vertices.view(row_type).ravel()
+    _, first_index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+    # np.unique sorts by bytes, renumber the unique vertices by first occurrence
+    order = np.argsort(first_index)
+    renumber = np.empty_like(order)
+    renumber[order] = np.arange(len(order))
+    indices = renumber[inverse.ravel()]
+    return vertices[first_index[order]], indices.astype(np.dtype(index_data_type(len(order))))
 
 
 class VAO:
     def __init__(self):
+        self.handle = None
+        self.create_handle()
+
+    def create_handle(self):
         self.handle = GLuint()
         glGenVertexArrays(1, self.handle)
 
+    def delete(self):
+        if self.handle is None:
+            return
+        RENDER_STATE.forget_vertex_array(self.handle)
+        glDeleteVertexArrays(1, self.handle)
+        self.handle = None
+
     def bind(self):
-        glBindVertexArray(self.handle)
+        if self.handle is None:
+            self.create_handle()
+        RENDER_STATE.bind_vertex_array(self.handle)
 
     @staticmethod
     def unbind():
-        glBindVertexArray(0)
+        RENDER_STATE.bind_vertex_array(0)
 
     def __repr__(self):
         return f"VAO({self.handle})"
@@ -69,20 +167,80 @@ class VAO:
 
 
 class VertexAttribute:
-    def __init__(self, name, vertex_size, stride, offset):
+    def __init__(self, name, vertex_size, stride, offset, divisor=0):
+        """
+        divisor 0 advances the attribute per vertex, 1 per instance.
+        A vertex_size of 16 describes a mat4, which occupies 4 consecutive locations (one per column).
+        """
         self.name = name
         self.vertex_size = vertex_size
         self.stride = stride
         self.offset = offset
+        self.divisor = divisor
 
     def bind(self, location: int, shader: Shader):
+        # the location is taken from the linked program, the index is only a fallback
+        shader_location = shader.get_attribute_location(self.name)
+        if shader_location != -1:
+            location = shader_location
+        elif shader.linked:
+            # the attribute is not used by the program
+            return
+
         stride = self.stride * sizeof(GLfloat)
-        offset = self.offset * sizeof(GLfloat)
-        glEnableVertexAttribArray(location)
-        glVertexAttribPointer(location, self.vertex_size,
-                              GL_FLOAT, GL_FALSE, stride, offset)
-        glBindAttribLocation(shader.handle, location,
-                             bytes(self.name, "utf-8"))
+        columns = (self.vertex_size + 3) // 4 if self.vertex_size > 4 else 1
+        column_size = self.vertex_size // columns
+        for column in range(columns):
+            offset = (self.offset + column * column_size) * sizeof(GLfloat)
+            glEnableVertexAttribArray(location + column)
+            glVertexAttribPointer(location + column, column_size,
+                                  GL_FLOAT, GL_FALSE, stride, offset)
+            if self.divisor:
+                glVertexAttribDivisor(location + column, self.divisor)
+
+
+# per instance: column-major model matrix, tint color and uv offset
+INSTANCE_FLOATS = 22
+INSTANCE_ATTRIBUTES = [
+    VertexAttribute('a_Model', 16, INSTANCE_FLOATS, 0, divisor=1),
+    VertexAttribute('a_Tint', 4, INSTANCE_FLOATS, 16, divisor=1),
+    VertexAttribute('a_UVOffset', 2, INSTANCE_FLOATS, 20, divisor=1),
+]
+
+
+class InstanceBuffer(VBO):
+    """
+    Per-instance attributes for instanced draws, one row of INSTANCE_FLOATS per instance
+    """
+
+    def __init__(self, models=None, tints=None, uv_offsets=None):
+        super().__init__(GL_ARRAY_BUFFER, INSTANCE_FLOATS,
+                         np.zeros((0, INSTANCE_FLOATS), dtype=np.float32), GLfloat)
+        self.attributes = INSTANCE_ATTRIBUTES
+        if models is not None:
+            self.set_instances(models, tints, uv_offsets)
+
+    def set_instances(self, models, tints=None, uv_offsets=None):
+        """
+        models: TransformBatch or (N, 4, 4) row-major matrices
+        tints: (N, 4) or one (4,) color, defaults to white
+        uv_offsets: (N, 2) or one (2,) offset, defaults to 0
+        """
+        matrices = getattr(models, "matrices", models)
+        matrices = np.asarray(matrices, dtype=np.float32).reshape((-1, 4, 4))
+        count = len(matrices)
+
+        data = self.data
+        if data.shape[0] != count:
+            data = np.empty((count, INSTANCE_FLOATS), dtype=np.float32)
+        # GLSL reads mat4 attributes column by column
+        data[:, :16] = matrices.transpose((0, 2, 1)).reshape((count, 16))
+        data[:, 16:20] = 1 if tints is None else tints
+        data[:, 20:22] = 0 if uv_offsets is None else uv_offsets
+        self.data = data
+
+    def upload(self, usage=GL_DYNAMIC_DRAW):
+        super().upload(usage)
 
 
 class Uniform:
@@ -1,17 +1,41 @@
 import math
-from datetime import datetime
+import time
+from typing import Optional
 
+import numpy as np
 import pyglet
 from pyglet.gl import glEnable, GL_DEPTH_TEST, GL_BLEND, glBlendFunc, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA
-from pyglet.gl import glClearColor, glViewport
+from pyglet.gl import glClearColor, glViewport, GL_RGBA
 
-from game_engine.math import identity, mat4, vec2
+from game_engine.math import mat4, vec2
 from game_engine.game import BaseGame, BaseData
+from game_engine.render_state import RENDER_STATE
+from game_engine.loader import ASSET_LOADER
+from game_engine.render_queue import RENDER_QUEUE
+from game_engine.profiler import PROFILER
+from game_engine.render_stats import RENDER_STATS, RenderStatsOverlay
+from game_engine.framebuffer import Framebuffer, read_pixels
+from game_engine.shader_registry import SHADER_REGISTRY, DEFAULT_CACHE_DIRECTORY
+from game_engine.uniform_buffer import FRAME_UNIFORMS
+
+# how run_game schedules frames
+INTERVAL_PACING = "interval"
+VSYNC_PACING = "vsync"
+UNCAPPED_PACING = "uncapped"
 
 
 class Window(pyglet.window.Window):
-    def __init__(self,  name: str, width: int, height: int, resizable: bool = False, game: BaseGame = None, data: BaseData = None):
-        super(Window, self).__init__(width, height, resizable=resizable)
+    def __init__(self,  name: str, width: int, height: int, resizable: bool = False, game: BaseGame = None,
+                 data: BaseData = None, fixed_time_step: Optional[float] = None, max_updates_per_frame: int = 5,
+                 vsync: Optional[bool] = None, offscreen: bool = False, fixed_frame_time: Optional[float] = None):
+        """
+        offscreen: render into a Framebuffer instead of the window, which stays hidden
+        fixed_frame_time: pretend every frame took this long, for deterministic runs
+        """
+        super(Window, self).__init__(width, height, resizable=resizable, vsync=vsync, visible=not offscreen)
+        # the new context starts with nothing bound and has none of the old context's queries
+        RENDER_STATE.invalidate()
+        PROFILER.discard_queries()
 
         glEnable(GL_DEPTH_TEST)
         glEnable(GL_BLEND)
@@ -22,10 +46,29 @@ class Window(pyglet.window.Window):
 
         self.name = name
         self.num_frames = 0
-        self.start_time = datetime.now()
-        self.frame_start_time = datetime.now()
+        # monotonic and high resolution, unlike datetime.now()
+        self.clock = time.perf_counter
+        self.start_time = self.clock()
+        self.frame_start_time = None
+        self.fixed_frame_time = fixed_frame_time
+
+        # None updates once per frame with the measured frame time
+        self.fixed_time_step = fixed_time_step
+        # caps the catch up after a long frame, the rest of the backlog is dropped
+        self.max_updates_per_frame = max_updates_per_frame
+        self.accumulator = 0.0
+        self.dropped_time = 0.0
 
-        self.projection_matrix = identity()
+        # draws the render counters of the last frame on top of the game
+        self.show_render_stats = False
+        self.render_stats_overlay: Optional[RenderStatsOverlay] = None
+
+        self.framebuffer = Framebuffer(width, height) if offscreen else None
+        # hidden and headless windows might never get a resize event
+        self.perspective_projection(width, height)
+        self.asset_upload_budget = 0.004
+        # create every pending asset before each frame instead of spreading them out, for deterministic runs
+        self.wait_for_assets = False
 
         if game is None:
             game = BaseGame()
@@ -38,13 +81,13 @@ class Window(pyglet.window.Window):
 
     def show_average_time(self):
         self.num_frames += 1
-        end = datetime.now()
+        end = self.clock()
         diff = end - self.start_time
-        average = diff.total_seconds() * 1000.0 / self.num_frames
+        average = diff * 1000.0 / self.num_frames
         caption = f"{self.name} {'%.5f' % average}"
         self.set_caption(caption)
 
-        if diff.total_seconds() > 1:
+        if diff > 1:
             self.start_time = end
             self.num_frames = 0
 
@@ -54,21 +97,98 @@ class Window(pyglet.window.Window):
         self.data.frame_time = frame_time
         self.data.projection_matrix = self.projection_matrix
 
+    def measure_frame_time(self) -> float:
+        if self.fixed_frame_time is not None:
+            return self.fixed_frame_time
+        now = self.clock()
+        if self.frame_start_time is None:
+            # first frame, don't count the time spent loading
+            frame_time = self.fixed_time_step or 0.0
+        else:
+            frame_time = now - self.frame_start_time
+        self.frame_start_time = now
+        return frame_time
+
+    def run_updates(self, frame_time: float):
+        if self.fixed_time_step is None:
+            self.data.alpha = 1.0
+            self.data.updates = 1
+            self.data.simulation_time += frame_time
+            self.game.update(self.data)
+            return
+
+        step = self.fixed_time_step
+        self.data.frame_time = step
+        self.accumulator += frame_time
+        updates = 0
+        while self.accumulator >= step and updates < self.max_updates_per_frame:
+            self.game.update(self.data)
+            self.data.simulation_time += step
+            self.accumulator -= step
+            updates += 1
+        if self.accumulator >= step:
+            # too far behind, slow the simulation down instead of spiralling
+            dropped = self.accumulator - self.accumulator % step
+            self.dropped_time += dropped
+            self.accumulator -= dropped
+
+        self.data.updates = updates
+        # how far render is between the last and the next simulation step
+        self.data.alpha = self.accumulator / step
+
     def on_draw(self, *args):
-        end = datetime.now()
-        frame_time = (end - self.frame_start_time).total_seconds()
-        self.frame_start_time = datetime.now()
+        frame_time = self.measure_frame_time()
+        PROFILER.begin_frame()
+        RENDER_STATS.begin_frame()
 
+        # pyglet may have touched the GL state between frames
+        RENDER_STATE.invalidate()
+        if self.framebuffer is not None:
+            self.framebuffer.bind()
         self.clear()
 
         self.update_game_data(frame_time)
+        # recompiles edited shaders when watching them
+        SHADER_REGISTRY.poll()
+
+        # create assets that finished decoding in the background
+        with PROFILER.scope("assets", gpu=True):
+            if self.wait_for_assets:
+                ASSET_LOADER.wait_all()
+            else:
+                ASSET_LOADER.update(self.asset_upload_budget)
 
-        self.game.update(self.data)
-        self.game.render(self.data)
+        with PROFILER.scope("update"):
+            self.run_updates(frame_time)
+        with PROFILER.scope("render", gpu=True):
+            # one upload of the camera matrices for all draws of the frame
+            FRAME_UNIFORMS.set(self.data.view_matrix, self.data.projection_matrix)
+            self.game.render(self.data)
+            # draws submitted to the render queue are issued sorted at the end of the frame
+            with PROFILER.scope("render queue", gpu=True):
+                RENDER_QUEUE.flush()
 
+        RENDER_STATS.end_frame()
+        if self.show_render_stats:
+            if self.render_stats_overlay is None:
+                self.render_stats_overlay = RenderStatsOverlay(RENDER_STATS)
+            self.render_stats_overlay.draw(self.width, self.height)
+
+        PROFILER.end_frame()
         self.show_average_time()
 
+    def read_pixels(self, pixel_format: int = GL_RGBA, flip: bool = True) -> np.ndarray:
+        """
+        Reads back the last rendered frame, see framebuffer.read_pixels
+        """
+        if self.framebuffer is not None:
+            return self.framebuffer.read_pixels(pixel_format, flip)
+        RENDER_STATE.bind_framebuffer(0)
+        return read_pixels(self.width, self.height, pixel_format, flip)
+
     def on_resize(self, width, height):
+        if self.framebuffer is not None:
+            self.framebuffer.resize(width, height)
         glViewport(0, 0, width, height)
 
         # if self.game_data.show_overview:
@@ -114,9 +234,48 @@ class Window(pyglet.window.Window):
         self.data.mouse.movement = vec2(dx, dy)
 
 
-def run_game(name: str, game: BaseGame, data: BaseData):
-    window = Window(name=name, width=1280, height=720,
-                    resizable=True, game=game, data=data)
+def tick(dt: float):
+    # pyglet's event loop calls on_draw and flip once after any scheduled function ran,
+    # so the schedule only has to wake the loop up at the frame rate
+    pass
+
+
+def run_game(name: str, game: BaseGame, data: BaseData, fixed_time_step: Optional[float] = None,
+             pacing: str = INTERVAL_PACING, frame_rate: float = 120.0, max_updates_per_frame: int = 5,
+             frame_count: Optional[int] = None, offscreen: bool = False, width: int = 1280,
+             height: int = 720, shader_cache_directory: Optional[str] = DEFAULT_CACHE_DIRECTORY) -> Window:
+    """
+    fixed_time_step: e.g. 1 / 60, game.update then runs at that rate independent of the frame rate
+    pacing: INTERVAL_PACING draws at frame_rate, VSYNC_PACING draws once per display refresh and
+    UNCAPPED_PACING draws as fast as possible (for benchmarks)
+    frame_count: draw exactly this many frames as fast as possible and return the window, every frame
+    counts as 1 / frame_rate seconds and waits for pending assets, so runs are deterministic
+    offscreen: render into a framebuffer, read it with window.read_pixels()
+    shader_cache_directory: where linked shader programs are cached, None compiles them on every start
+    Set GAME_ENGINE_HEADLESS=1 to run without a display (EGL).
+    """
+    if pacing not in [INTERVAL_PACING, VSYNC_PACING, UNCAPPED_PACING]:
+        raise AttributeError(f"Unknown pacing: {pacing}")
+    SHADER_REGISTRY.cache_directory = shader_cache_directory
+    vsync = {INTERVAL_PACING: None, VSYNC_PACING: True, UNCAPPED_PACING: False}[pacing]
+    if frame_count is not None:
+        vsync = False
+    window = Window(name=name, width=width, height=height, resizable=True, game=game, data=data,
+                    fixed_time_step=fixed_time_step, max_updates_per_frame=max_updates_per_frame, vsync=vsync,
+                    offscreen=offscreen, fixed_frame_time=None if frame_count is None else 1 / frame_rate)
+
+    if frame_count is not None:
+        window.wait_for_assets = True
+        for _ in range(frame_count):
+            window.dispatch_events()
+            window.on_draw()
+            window.flip()
+        return window
 
-    pyglet.clock.schedule_interval(window.on_draw, 1 / 120.0)
+    if pacing == INTERVAL_PACING:
+        pyglet.clock.schedule_interval(tick, 1 / frame_rate)
+    else:
+        # every loop iteration, with vsync the buffer flip blocks until the next refresh
+        pyglet.clock.schedule(tick)
     pyglet.app.run()
+    return window
@@ -1,8 +1,8 @@
 import logging
 import threading
 from typing import List
-import cv2
 import numpy as np
+from pyglet.gl import GL_BGR, GL_UNSIGNED_BYTE
 
 import game_engine.window
 import game_engine.game
@@ -10,8 +10,11 @@ from game_engine.helper import timer
 from game_engine.camera import Camera
 from game_engine.shader import Shader
 from game_engine.vertex_objects import VAO, array_buffer, VertexAttribute, Uniform
-from game_engine.asset import TextureMeshSurface, ColorMeshSurface, load_image_from_file, load_image_from_mat
-from game_engine.math import vec3, vec2, identity, scale, translate, rotate
+from game_engine.asset import TextureMeshSurface, ColorMeshSurface
+from game_engine.asset import Texture, VideoSource, GPU_MIPMAPS
+from game_engine.loader import ASSET_LOADER
+from game_engine.scene import SceneGraph, SceneNode
+from game_engine.math import vec3, vec2, scale, rotate
 
 LOG = logging.getLogger()
 
@@ -61,59 +64,61 @@ def get_points_and_uvs(width: int, height: int):
 
 
 class Image:
-    def __init__(self, path):
-        texture = load_image_from_file(path)
-        points, uvs = get_points_and_uvs(texture.width, texture.height)
-        self.surface = TextureMeshSurface(points, uvs, texture)
-        self.model_matrix = identity()
+    def __init__(self, path, node: SceneNode):
+        # the image is shown smaller than its resolution, mipmaps keep it from shimmering
+        self.texture = ASSET_LOADER.load_texture(path, mipmaps=GPU_MIPMAPS, anisotropy=8)
+        self.surface = None
+        self.node = node
 
     def draw(self, uniforms: List[Uniform]):
-        uniforms.append(Uniform("u_Model", self.model_matrix))
-        self.surface.draw(uniforms)
+        if self.surface is None:
+            if not self.texture.ready:
+                return
+            texture = self.texture.asset
+            points, uvs = get_points_and_uvs(texture.width, texture.height)
+            self.surface = TextureMeshSurface(points, uvs, texture)
+
+        self.surface.draw(uniforms + [Uniform("u_Model", self.node.world_matrix)])
 
 
 class Video:
-    def __init__(self):
-        self.video = cv2.VideoCapture(0)
-        self.get_next_frame(True)
+    def __init__(self, node: SceneNode):
+        self.node = node
+        self.video = VideoSource(0, flip_code=-1, scale=0.75)
+        frame = self.video.poll()
 
-        texture = load_image_from_mat(self.next_frame)
+        texture = Texture(frame.image, GL_BGR, GL_UNSIGNED_BYTE, streaming=True, pixel_buffers=True)
         points, uvs = get_points_and_uvs(texture.width, texture.height)
         self.surface = TextureMeshSurface(points, uvs, texture)
 
-    def get_next_frame(self, init=False):
-        ret, self.next_frame = self.video.read()
-        self.next_frame = cv2.flip(self.next_frame, -1)
-        self.next_frame = cv2.resize(self.next_frame, (0, 0), fx=0.75, fy=0.75)
-        if not init:
-            self.surface.texture.image = self.next_frame
+    def get_next_frame(self):
+        # never blocks, keeps showing the last frame until the decoder has a new one
+        frame = self.video.poll()
+        if frame is not None:
+            self.surface.texture.image = frame.image
 
     def draw(self, uniforms: List[Uniform]):
         self.get_next_frame()
-        self.model_matrix = identity()
-
-        uniforms.append(Uniform("u_Model", self.model_matrix))
-        self.surface.draw(uniforms)
+        self.surface.draw(uniforms + [Uniform("u_Model", self.node.world_matrix)])
 
 
 class Game(game_engine.game.BaseGame):
     def init(self):
-        self.image = Image("sandbox/cat.jpg")
-        self.video = Video()
+        self.scene = SceneGraph()
+        self.image = Image("sandbox/cat.jpg", self.scene.create_node(position=vec3(0, 10, 0)))
+        self.video = Video(self.scene.create_node())
 
     def update(self, data: game_engine.game.BaseData):
         LOG.info("Updating", data)
         data.camera.update(data)
+        # only recomputes world matrices of nodes that were moved
+        self.scene.update()
 
     def render(self, data: game_engine.game.BaseData):
         LOG.info("Rendering", data)
 
-        projection = Uniform("u_Projection", data.projection_matrix)
-        view = Uniform("u_View", data.camera.get_view_matrix())
-        uniforms = [projection, view]
-
-        self.image.model_matrix = identity()
-        translate(self.image.model_matrix, vec3(0, 10, 0))
+        # view and projection come from the FrameUniforms block, see Data.view_matrix
+        uniforms = []
 
         self.image.draw(uniforms)
         self.video.draw(uniforms)
@@ -123,6 +128,7 @@ class Data(game_engine.game.BaseData):
     def __init__(self):
         super().__init__()
         self.camera = Camera(vec3(0, 0, 15), vec3(0, 0, 0))
+        self.view_matrix = self.camera.get_view_matrix()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+import pyglet
+
+from game_engine.cache import AssetCache
+from game_engine.render_state import RENDER_STATE
+
+
+class Resource:
+    """
+    Stands in for a MeshSurface, records when the cache deletes it
+    """
+
+    def __init__(self, gpu_bytes: int):
+        self.gpu_bytes = gpu_bytes
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+
+class AssetCacheTest(unittest.TestCase):
+    def test_get_creates_once(self):
+        cache = AssetCache(budget_bytes=100)
+        created = []
+
+        def create():
+            created.append(Resource(10))
+            return created[-1]
+
+        first = cache.get_mesh("mesh", create)
+        self.assertIs(first, cache.get_mesh("mesh", create))
+        self.assertEqual(1, len(created))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(10, cache.gpu_bytes)
+        self.assertIn("mesh", cache)
+
+    def test_failed_create_is_not_stored(self):
+        cache = AssetCache()
+        self.assertIsNone(cache.get_mesh("mesh", lambda: None))
+        self.assertEqual(0, len(cache))
+
+    def test_evicts_least_recently_used_released_entries(self):
+        cache = AssetCache(budget_bytes=30)
+        resources = {name: cache.get_mesh(name, lambda: Resource(10)) for name in ["a", "b", "c"]}
+        for resource in resources.values():
+            cache.release(resource)
+        # a becomes the most recently used
+        cache.release(cache.get_mesh("a", None))
+
+        cache.release(cache.get_mesh("d", lambda: Resource(10)))
+        self.assertTrue(resources["b"].deleted)
+        self.assertNotIn("b", cache)
+        self.assertEqual(["c", "a", "d"], list(cache.entries))
+        self.assertEqual(30, cache.gpu_bytes)
+        self.assertEqual(1, cache.evictions)
+
+    def test_entries_in_use_are_not_evicted(self):
+        cache = AssetCache(budget_bytes=15)
+        used = cache.get_mesh("used", lambda: Resource(10))
+        released = cache.get_mesh("released", lambda: Resource(10))
+        cache.release(released)
+        self.assertTrue(released.deleted)
+        self.assertFalse(used.deleted)
+
+        # over budget, but everything is in use
+        other = cache.get_mesh("other", lambda: Resource(10))
+        self.assertEqual(20, cache.gpu_bytes)
+        self.assertFalse(used.deleted or other.deleted)
+        cache.release(used)
+        self.assertTrue(used.deleted)
+        self.assertFalse(other.deleted)
+
+    def test_release_errors(self):
+        cache = AssetCache()
+        resource = cache.get_mesh("mesh", lambda: Resource(10))
+        with self.assertRaises(AttributeError):
+            cache.release(Resource(10))
+        cache.release(resource)
+        with self.assertRaises(AttributeError):
+            cache.release(resource)
+
+    def test_remove(self):
+        cache = AssetCache()
+        resource = cache.get_mesh("mesh", lambda: Resource(10))
+        with self.assertRaises(AttributeError):
+            cache.remove("mesh")
+        cache.release(resource)
+        cache.remove("mesh")
+        self.assertTrue(resource.deleted)
+        self.assertEqual(0, cache.gpu_bytes)
+
+    def test_clear_deletes_entries_in_use(self):
+        cache = AssetCache()
+        resource = cache.get_mesh("mesh", lambda: Resource(10))
+        cache.clear()
+        self.assertTrue(resource.deleted)
+        self.assertEqual(0, len(cache))
+
+
+class TextureCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.window = pyglet.window.Window(8, 8, visible=False)
+        except Exception as e:
+            raise unittest.SkipTest(f"No GL context: {e}")
+        RENDER_STATE.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.window.close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = self.write_image("image.png", 0)
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.clear()
+        self.directory.cleanup()
+
+    def create_cache(self, **options) -> AssetCache:
+        cache = AssetCache(**options)
+        self.caches.append(cache)
+        return cache
+
+    def write_image(self, name: str, value: int) -> str:
+        file_name = os.path.join(self.directory.name, name)
+        cv2.imwrite(file_name, np.full((4, 8, 3), value, dtype=np.uint8))
+        return file_name
+
+    def test_same_content_under_different_paths_is_shared(self):
+        cache = self.create_cache()
+        copy = os.path.join(self.directory.name, "copy.png")
+        shutil.copy(self.file_name, copy)
+        texture = cache.get_texture(self.file_name)
+        self.assertIs(texture, cache.get_texture(copy))
+        self.assertEqual(1, len(cache))
+        self.assertIs(texture, cache.cached_texture(copy))
+        self.assertIsNot(texture, cache.get_texture(self.write_image("other.png", 255)))
+
+    def test_without_content_hashing_paths_are_not_shared(self):
+        cache = self.create_cache(hash_contents=False)
+        copy = os.path.join(self.directory.name, "copy.png")
+        shutil.copy(self.file_name, copy)
+        self.assertIsNot(cache.get_texture(self.file_name), cache.get_texture(copy))
+
+    def test_options_are_part_of_the_key(self):
+        cache = self.create_cache()
+        plain = cache.get_texture(self.file_name)
+        filtered = cache.get_texture(self.file_name, anisotropy=4.0)
+        self.assertIsNot(plain, filtered)
+        self.assertEqual(4.0, filtered.anisotropy)
+        self.assertIs(filtered, cache.get_texture(self.file_name, anisotropy=4.0))
+        self.assertEqual(2, len(cache))
+
+    def test_missing_file(self):
+        cache = self.create_cache()
+        with self.assertLogs(level="ERROR"):
+            self.assertIsNone(cache.get_texture(os.path.join(self.directory.name, "missing.png")))
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import math
+import random
+import unittest
+
+import numpy as np
+
+from game_engine.culling import Bounds, Frustum, frustum_planes, world_spheres, world_boxes
+from game_engine.math import mat4, vec3, identity, rotate, translate, scale, TransformBatch
+
+
+def perspective(fovy: float = 90.0, aspect_ratio: float = 1.5, z_near: float = 1.0, z_far: float = 100.0) -> mat4:
+    # same projection as Window.perspective_projection
+    f = 1 / math.tan(fovy * math.pi / 360)
+    return mat4([
+        [f / aspect_ratio, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (z_far + z_near) / (z_near - z_far), (2 * z_far * z_near) / (z_near - z_far)],
+        [0, 0, -1, 0],
+    ])
+
+
+def camera() -> mat4:
+    view = identity()
+    translate(view, vec3(-3, -1, 2))
+    rotate(view, vec3(10, 30, 0))
+    return view
+
+
+def inside_clip_space(view_projection: mat4, point) -> bool:
+    x, y, z, w = view_projection.numbers.astype(np.float64) @ np.append(point, 1.0)
+    return w > 0 and all(-w <= value <= w for value in (x, y, z))
+
+
+class FrustumTest(unittest.TestCase):
+    def setUp(self):
+        self.projection = perspective()
+        self.view = camera()
+        self.frustum = Frustum.from_matrices(self.projection, self.view)
+        self.rng = random.Random(4)
+
+    def random_points(self, count: int) -> np.ndarray:
+        return np.array([[self.rng.uniform(-120, 120) for _ in range(3)] for _ in range(count)], dtype=np.float32)
+
+    def test_planes_are_normalized(self):
+        planes = frustum_planes(self.projection * self.view)
+        self.assertEqual((6, 4), planes.shape)
+        np.testing.assert_allclose(np.ones(6), np.linalg.norm(planes[:, :3], axis=1), rtol=1e-6)
+
+    def test_points_match_clip_space(self):
+        view_projection = self.projection * self.view
+        points = self.random_points(2000)
+        expected = [inside_clip_space(view_projection, point) for point in points]
+        self.assertTrue(any(expected))
+        mask = self.frustum.cull_spheres(points, np.zeros(len(points)))
+        # points within float precision of a plane may go either way
+        distances = np.abs(points @ self.frustum.planes[:, :3].T + self.frustum.planes[:, 3]).min(axis=1)
+        clear = distances > 1e-3
+        np.testing.assert_array_equal(np.array(expected)[clear], mask[clear])
+
+    def test_sphere_radius_reaches_into_the_frustum(self):
+        # camera space: 10 units in front, the left plane of a 90 degree fov with aspect 1.5
+        projection = perspective()
+        frustum = Frustum(projection)
+        left = frustum.planes[0]
+        inside = np.array([0, 0, -10], dtype=np.float32)
+        distance = float(left[:3] @ inside + left[3])
+        outside = inside - left[:3] * (distance + 2.0)
+        self.assertTrue(frustum.cull_spheres(inside, [0.0])[0])
+        self.assertFalse(frustum.cull_spheres(outside, [1.9])[0])
+        self.assertTrue(frustum.cull_spheres(outside, [2.1])[0])
+        # behind the camera and beyond the far plane
+        self.assertFalse(frustum.cull_spheres([0, 0, 5], [1.0])[0])
+        self.assertFalse(frustum.cull_spheres([0, 0, -105], [1.0])[0])
+
+    def test_boxes_are_conservative(self):
+        view_projection = self.projection * self.view
+        centers = self.random_points(300)
+        extents = np.array([[self.rng.uniform(0.1, 10) for _ in range(3)] for _ in range(300)], dtype=np.float32)
+        mask = self.frustum.cull_boxes(centers, extents)
+        corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+        for center, extent, visible in zip(centers, extents, mask):
+            if any(inside_clip_space(view_projection, center + corner * extent) for corner in corners):
+                self.assertTrue(visible)
+        self.assertFalse(mask.all())
+
+    def test_world_spheres_contain_the_transformed_bounds(self):
+        points = self.random_points(50) / 20
+        bounds = Bounds.from_points(points)
+        self.assertTrue(np.all(np.linalg.norm(points - bounds.center, axis=1) <= bounds.radius + 1e-5))
+
+        models = TransformBatch.from_trs([[1, 2, 3], [-4, 0, 2]], [[30, 60, 90], [0, 0, 0]],
+                                         [[1, 2, 0.5], [3, 3, 3]]).matrices
+        centers, radii = world_spheres(models, np.repeat(bounds.center[np.newaxis], 2, axis=0),
+                                       np.full(2, bounds.radius, dtype=np.float32))
+        box_centers, box_extents = world_boxes(models, np.repeat(bounds.center[np.newaxis], 2, axis=0),
+                                               np.repeat(bounds.extents[np.newaxis], 2, axis=0))
+        for index, model in enumerate(models):
+            world = points @ model[:3, :3].T + model[:3, 3]
+            self.assertTrue(np.all(np.linalg.norm(world - centers[index], axis=1) <= radii[index] + 1e-4))
+            self.assertTrue(np.all(np.abs(world - box_centers[index]) <= box_extents[index] + 1e-4))
+
+    def test_scaled_model_matrix(self):
+        model = identity()
+        scale(model, vec3(1, 4, 1))
+        _, radii = world_spheres(model.numbers[np.newaxis], np.zeros((1, 3)), np.ones(1))
+        self.assertAlmostEqual(4.0, float(radii[0]), places=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from game_engine.ktx import KTXImage, KTX_HEADER, KTX_IDENTIFIER, read_ktx, write_ktx, padding
+
+GL_UNSIGNED_BYTE = 0x1401
+GL_RGB = 0x1907
+GL_RGB8 = 0x8051
+GL_COMPRESSED_RGB_S3TC_DXT1_EXT = 0x83F0
+
+
+def rgb_level(width: int, height: int, seed: int) -> bytes:
+    # rows padded to 4 bytes, as write_ktx expects
+    row = bytes((seed + index) % 256 for index in range(width * 3))
+    return (row + b"\0" * padding(len(row))) * height
+
+
+class KTXTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "texture.ktx")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def round_trip(self, image: KTXImage) -> KTXImage:
+        write_ktx(self.file_name, image)
+        return read_ktx(self.file_name)
+
+    def test_uncompressed_round_trip(self):
+        levels = [rgb_level(5, 3, 0), rgb_level(2, 1, 7), rgb_level(1, 1, 9)]
+        image = KTXImage(GL_UNSIGNED_BYTE, 1, GL_RGB, GL_RGB8, GL_RGB, 5, 3, levels)
+        loaded = self.round_trip(image)
+        self.assertEqual(image, loaded)
+        self.assertFalse(loaded.compressed)
+        self.assertEqual([(5, 3), (2, 1), (1, 1)], [loaded.level_size(level) for level in range(3)])
+        self.assertEqual([48, 8, 4], [len(level) for level in loaded.levels])
+
+    def test_compressed_round_trip(self):
+        # one 8 byte block per 4x4 pixels, odd sizes check the padding between levels
+        levels = [bytes(range(32)), bytes(range(8)), b"\x01\x02\x03"]
+        image = KTXImage(0, 1, 0, GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_RGB, 8, 8, levels)
+        loaded = self.round_trip(image)
+        self.assertEqual(image, loaded)
+        self.assertTrue(loaded.compressed)
+        self.assertEqual(0, os.path.getsize(self.file_name) % 4)
+
+    def test_key_value_data_is_skipped(self):
+        level = rgb_level(1, 1, 3)
+        with open(self.file_name, "wb") as f:
+            f.write(KTX_IDENTIFIER)
+            f.write(KTX_HEADER.pack(0x04030201, GL_UNSIGNED_BYTE, 1, GL_RGB, GL_RGB8, GL_RGB, 1, 1, 0, 0, 1, 1, 8))
+            f.write(b"\x04\0\0\0abc\0")
+            f.write(len(level).to_bytes(4, "little") + level)
+        self.assertEqual([level], read_ktx(self.file_name).levels)
+
+    def test_invalid_files(self):
+        with open(self.file_name, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + b"\0" * 64)
+        with self.assertRaises(IOError):
+            read_ktx(self.file_name)
+
+        image = KTXImage(GL_UNSIGNED_BYTE, 1, GL_RGB, GL_RGB8, GL_RGB, 2, 2, [rgb_level(2, 2, 0)])
+        write_ktx(self.file_name, image)
+        with open(self.file_name, "rb") as f:
+            data = f.read()
+        # cut inside the level data and inside the image size
+        for size in (len(data) - 1, len(KTX_IDENTIFIER) + KTX_HEADER.size + 2):
+            with open(self.file_name, "wb") as f:
+                f.write(data[:size])
+            with self.assertRaises(IOError):
+                read_ktx(self.file_name)
+
+
+if __name__ == "__main__":
+    unittest.main()
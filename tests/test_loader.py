@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import cv2
+import numpy as np
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+import pyglet
+
+from game_engine.asset import Texture
+from game_engine.cache import ASSET_CACHE
+from game_engine.loader import AssetLoader
+from game_engine.render_state import RENDER_STATE
+
+
+class LoadMeshTest(unittest.TestCase):
+    """
+    Mesh loads take plain callbacks, no GL is involved
+    """
+
+    def setUp(self):
+        self.loader = AssetLoader(max_workers=2)
+
+    def tearDown(self):
+        self.loader.shutdown()
+
+    def test_parse_on_a_worker_and_create_on_update(self):
+        threads = {}
+
+        def parse(value):
+            threads["parse"] = threading.current_thread()
+            return value * 2
+
+        def create(data):
+            threads["create"] = threading.current_thread()
+            return data + 1
+
+        handle = self.loader.load_mesh("mesh", parse, create, 20)
+        self.assertFalse(handle.done)
+        self.assertTrue(self.loader.wait_all(timeout=5.0))
+        self.assertTrue(handle.ready)
+        self.assertFalse(handle.failed)
+        self.assertEqual(41, handle.asset)
+        self.assertIsNot(threading.main_thread(), threads["parse"])
+        self.assertIs(threading.main_thread(), threads["create"])
+        self.assertEqual(0, self.loader.pending)
+
+    def assert_failed(self, handle):
+        self.assertTrue(handle.done)
+        self.assertTrue(handle.failed)
+        self.assertFalse(handle.ready)
+        self.assertIsNone(handle.asset)
+        self.assertIsNotNone(handle.error)
+
+    def test_failures(self):
+        def broken_parse():
+            raise ValueError("broken")
+
+        with self.assertLogs(level="ERROR"):
+            handles = [self.loader.load_mesh("raises", broken_parse, lambda data: data),
+                       self.loader.load_mesh("parses nothing", lambda: None, lambda data: data),
+                       self.loader.load_mesh("creates nothing", lambda: 1, lambda data: None)]
+            self.assertTrue(self.loader.wait_all(timeout=5.0))
+        for handle in handles:
+            self.assert_failed(handle)
+        self.assertIsInstance(handles[0].error, ValueError)
+        self.assertIsInstance(handles[2].error, IOError)
+
+    def test_update_creates_at_least_one_asset(self):
+        handles = [self.loader.load_mesh(f"mesh {index}", lambda value: value, lambda data: data, index)
+                   for index in range(3)]
+        for handle in handles:
+            while not handle.done:
+                # no time budget left, still one asset per call
+                self.loader.update(0.0)
+        self.assertEqual([0, 1, 2], [handle.asset for handle in handles])
+
+
+class LoadTextureTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.window = pyglet.window.Window(8, 8, visible=False)
+        except Exception as e:
+            raise unittest.SkipTest(f"No GL context: {e}")
+        RENDER_STATE.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.window.close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "image.png")
+        image = np.zeros((8, 16, 3), dtype=np.uint8)
+        image[:4] = (255, 0, 0)
+        cv2.imwrite(self.file_name, image)
+        self.loader = AssetLoader()
+
+    def tearDown(self):
+        self.loader.shutdown()
+        ASSET_CACHE.clear()
+        self.directory.cleanup()
+
+    def test_texture_is_uploaded_and_cached(self):
+        handle = self.loader.load_texture(self.file_name)
+        self.assertTrue(self.loader.wait_all(timeout=5.0))
+        self.assertTrue(handle.ready)
+        texture = handle.asset
+        self.assertIsInstance(texture, Texture)
+        self.assertTrue(texture.uploaded)
+        self.assertEqual((16, 8), (texture.width, texture.height))
+
+        # cached, the handle is done right away
+        cached = self.loader.load_texture(self.file_name)
+        self.assertTrue(cached.ready)
+        self.assertIs(texture, cached.asset)
+        self.assertEqual(0, self.loader.pending)
+        self.assertEqual(2, ASSET_CACHE.entries[ASSET_CACHE.aliases[(self.file_name, ())]].users)
+
+    def test_missing_file_fails(self):
+        with self.assertLogs(level="ERROR"):
+            handle = self.loader.load_texture(os.path.join(self.directory.name, "missing.png"))
+            self.assertTrue(self.loader.wait_all(timeout=5.0))
+        self.assertTrue(handle.failed)
+        self.assertIsNone(handle.asset)
+
+
+if __name__ == "__main__":
+    unittest.main()
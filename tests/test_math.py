@@ -0,0 +1,209 @@
+import math
+import random
+import unittest
+
+import numpy as np
+
+from game_engine.math import mat4, vec3, identity, scale, translate, rotate, transform_points, TransformBatch
+
+
+def multiply(a, b):
+    return [[sum(a[r][k] * b[k][c] for k in range(4)) for c in range(4)] for r in range(4)]
+
+
+def reference_identity():
+    return [[1.0 if r == c else 0.0 for c in range(4)] for r in range(4)]
+
+
+# the list based operations of the original mat4, each one is applied on top of m
+
+
+def reference_scale(m, s):
+    return multiply([[s[0], 0, 0, 0], [0, s[1], 0, 0], [0, 0, s[2], 0], [0, 0, 0, 1]], m)
+
+
+def reference_translate(m, v):
+    return multiply([[1, 0, 0, v[0]], [0, 1, 0, v[1]], [0, 0, 1, v[2]], [0, 0, 0, 1]], m)
+
+
+def reference_rotate(m, v):
+    x, y, z = (angle * math.pi / 180 for angle in v)
+    rot_x = [[1, 0, 0, 0], [0, math.cos(x), -math.sin(x), 0], [0, math.sin(x), math.cos(x), 0], [0, 0, 0, 1]]
+    rot_y = [[math.cos(y), 0, math.sin(y), 0], [0, 1, 0, 0], [-math.sin(y), 0, math.cos(y), 0], [0, 0, 0, 1]]
+    rot_z = [[math.cos(z), -math.sin(z), 0, 0], [math.sin(z), math.cos(z), 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]
+    return multiply(multiply(multiply(rot_x, rot_y), rot_z), m)
+
+
+def random_vector(rng: random.Random, low: float, high: float):
+    return [rng.uniform(low, high) for _ in range(3)]
+
+
+class Mat4Test(unittest.TestCase):
+    def assert_matrix(self, expected, actual: mat4):
+        self.assertEqual(np.float32, actual.numbers.dtype)
+        np.testing.assert_allclose(np.array(expected, dtype=np.float64), actual.numbers, rtol=1e-5, atol=1e-5)
+
+    def test_construction(self):
+        self.assert_matrix(reference_identity(), identity())
+        self.assert_matrix([[1, 2, 0, 0], [3, 0, 0, 0], [0] * 4, [0] * 4], mat4([[1, 2], [3]]))
+        self.assert_matrix([[0] * 4] * 4, mat4())
+        numbers = np.arange(16, dtype=np.float32).reshape((4, 4))
+        self.assertIs(numbers, mat4.from_numbers(numbers).numbers)
+        self.assertEqual(list(range(16)), mat4(numbers).to_list())
+        self.assertEqual(numbers.T.ravel().tolist(), mat4(numbers).to_list(column_major=True))
+
+    def test_transforms_match_the_list_implementation(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            expected = reference_identity()
+            m = identity()
+            for _ in range(6):
+                operation = rng.choice(["scale", "translate", "rotate"])
+                if operation == "scale":
+                    v = random_vector(rng, 0.1, 3.0)
+                    expected = reference_scale(expected, v)
+                    scale(m, vec3(*v))
+                elif operation == "translate":
+                    v = random_vector(rng, -10.0, 10.0)
+                    expected = reference_translate(expected, v)
+                    translate(m, vec3(*v))
+                else:
+                    v = random_vector(rng, -180.0, 180.0)
+                    expected = reference_rotate(expected, v)
+                    rotate(m, vec3(*v))
+            self.assert_matrix(expected, m)
+
+    def test_uniform_scale(self):
+        m = identity()
+        scale(m, 2)
+        self.assert_matrix(reference_scale(reference_identity(), [2, 2, 2]), m)
+
+    def test_out_leaves_the_input_alone(self):
+        m = identity()
+        translate(m, vec3(1, 2, 3))
+        before = m.numbers.copy()
+        out = identity()
+        for operation, argument in [(scale, vec3(2, 3, 4)), (translate, vec3(4, 5, 6)), (rotate, vec3(10, 20, 30))]:
+            operation(m, argument, out=out)
+            np.testing.assert_array_equal(before, m.numbers)
+            expected = m.copy()
+            operation(expected, argument)
+            np.testing.assert_array_equal(expected.numbers, out.numbers)
+
+    def test_multiply(self):
+        rng = random.Random(2)
+        a = [[rng.uniform(-2, 2) for _ in range(4)] for _ in range(4)]
+        b = [[rng.uniform(-2, 2) for _ in range(4)] for _ in range(4)]
+        expected = multiply(a, b)
+        self.assert_matrix(expected, mat4(a) * mat4(b))
+        self.assert_matrix(expected, mat4(a) @ mat4(b))
+
+        out = mat4()
+        result = mat4(a).multiply(mat4(b), out)
+        self.assertIs(out, result)
+        self.assert_matrix(expected, out)
+
+        m = mat4(a)
+        numbers = m.numbers
+        m *= mat4(b)
+        self.assertIs(numbers, m.numbers)
+        self.assert_matrix(expected, m)
+        m = mat4(a)
+        m @= mat4(b)
+        self.assert_matrix(expected, m)
+        with self.assertRaises(AttributeError):
+            m *= 2
+
+    def test_multiply_point(self):
+        m = identity()
+        rotate(m, vec3(0, 0, 90))
+        translate(m, vec3(1, 2, 3))
+        point = m * vec3(1, 0, 0)
+        np.testing.assert_allclose([1, 3, 3], point.to_list(), atol=1e-6)
+        out = vec3()
+        self.assertIs(out, m.multiply(vec3(1, 0, 0), out))
+        np.testing.assert_allclose([1, 3, 3], out.to_list(), atol=1e-6)
+        np.testing.assert_allclose([[1, 3, 3], [1, 2, 4]], transform_points(m, [[1, 0, 0], [0, 0, 1]]), atol=1e-6)
+
+    def test_equality_and_copy(self):
+        m = identity()
+        copy = m.copy()
+        self.assertEqual(m, copy)
+        translate(copy, vec3(1, 0, 0))
+        self.assertNotEqual(m, copy)
+        self.assertNotEqual(m, m.numbers)
+
+
+class TransformBatchTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.count = 20
+        self.positions = np.array([random_vector(rng, -10, 10) for _ in range(self.count)], dtype=np.float32)
+        self.rotations = np.array([random_vector(rng, -180, 180) for _ in range(self.count)], dtype=np.float32)
+        self.scales = np.array([random_vector(rng, 0.1, 3) for _ in range(self.count)], dtype=np.float32)
+
+    def model(self, index: int, rotation: bool = True, scales=None) -> mat4:
+        # T * R * S built from single mat4 operations, applied right to left
+        m = identity()
+        if scales is not None:
+            scale(m, vec3(*scales[index]) if np.ndim(scales[index]) else float(scales[index]))
+        if rotation:
+            rotate(m, vec3(*self.rotations[index]))
+        translate(m, vec3(*self.positions[index]))
+        return m
+
+    def assert_batch(self, expected, batch: TransformBatch):
+        self.assertEqual(len(expected), len(batch))
+        for index, m in enumerate(expected):
+            np.testing.assert_allclose(m.numbers, batch[index].numbers, rtol=1e-5, atol=1e-5)
+
+    def test_from_trs_matches_mat4(self):
+        batch = TransformBatch.from_trs(self.positions, self.rotations, self.scales)
+        self.assert_batch([self.model(index, scales=self.scales) for index in range(self.count)], batch)
+
+    def test_from_trs_optional_parts(self):
+        self.assert_batch([self.model(index, rotation=False) for index in range(self.count)],
+                          TransformBatch.from_trs(self.positions))
+        uniform = self.scales[:, 0].copy()
+        self.assert_batch([self.model(index, scales=uniform) for index in range(self.count)],
+                          TransformBatch.from_trs(self.positions, self.rotations, uniform))
+        radians = np.radians(self.rotations)
+        self.assert_batch([self.model(index) for index in range(self.count)],
+                          TransformBatch.from_trs(self.positions, radians, radians=True))
+
+    def test_from_trs_into_out(self):
+        out = TransformBatch(self.count)
+        self.assertIs(out, TransformBatch.from_trs(self.positions, self.rotations, out=out))
+        with self.assertRaises(AttributeError):
+            TransformBatch.from_trs(self.positions, out=TransformBatch(self.count + 1))
+
+    def test_products_match_mat4(self):
+        batch = TransformBatch.from_trs(self.positions, self.rotations, self.scales)
+        models = [self.model(index, scales=self.scales) for index in range(self.count)]
+        view = identity()
+        rotate(view, vec3(10, 20, 30))
+        translate(view, vec3(1, 2, 3))
+        self.assert_batch([view * m for m in models], batch.premultiply(view))
+        self.assert_batch([m * view for m in models], batch.multiply(view))
+        self.assert_batch([m * m for m in models], batch.multiply(batch))
+
+        points = self.positions[::-1]
+        expected = [transform_points(m, points[index:index + 1])[0] for index, m in enumerate(models)]
+        np.testing.assert_allclose(expected, batch.transform_points(points), rtol=1e-5, atol=1e-4)
+        cloud = self.positions[:5]
+        np.testing.assert_allclose([transform_points(m, cloud) for m in models], batch.transform_cloud(cloud),
+                                   rtol=1e-5, atol=1e-4)
+
+    def test_views_and_layout(self):
+        batch = TransformBatch(3)
+        translate(batch[1], vec3(1, 2, 3))
+        np.testing.assert_array_equal([1, 2, 3], batch.matrices[1, :3, 3])
+        batch[2] = batch[1]
+        np.testing.assert_array_equal(batch.matrices[1], batch.matrices[2])
+        np.testing.assert_array_equal(batch.matrices.transpose((0, 2, 1)), batch.to_array(column_major=True))
+        with self.assertRaises(AttributeError):
+            TransformBatch(matrices=np.zeros((2, 3, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import unittest
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+from game_engine.math import identity, translate, vec3
+from game_engine.render_queue import RenderQueue, PASS_SHIFT, SHADER_BITS, TEXTURE_BITS, DEPTH_BITS, SEQUENCE_BITS
+from game_engine.render_queue import OPAQUE_PASS, BLENDED_PASS, MAX_DEPTH_VALUE
+from game_engine.vertex_objects import Uniform
+
+
+class Handle:
+    def __init__(self, handle: int):
+        self.handle = handle
+
+
+class Surface:
+    """
+    Records the order draws are issued in, no GL involved
+    """
+
+    def __init__(self, name: str, shader: int, texture: int = None, blended: bool = False, log: list = None):
+        self.name = name
+        self.shader = Handle(shader)
+        self.texture = None if texture is None else Handle(texture)
+        self.blended = blended
+        self.uniforms = []
+        self.bounds = None
+        self.log = log
+
+    def render(self, uniforms):
+        self.log.append(self.name)
+
+
+def at_depth(depth: float):
+    # the camera sits at the origin and looks down -z
+    model = identity()
+    translate(model, vec3(0, 0, -depth))
+    return [Uniform("u_View", identity()), Uniform("u_Model", model)]
+
+
+def fields(key: int, blended: bool) -> dict:
+    def take(shift: int, bits: int) -> int:
+        return (key >> shift) & ((1 << bits) - 1)
+
+    if blended:
+        return {"pass": key >> PASS_SHIFT,
+                "depth": MAX_DEPTH_VALUE - take(SHADER_BITS + TEXTURE_BITS + SEQUENCE_BITS, DEPTH_BITS),
+                "shader": take(TEXTURE_BITS + SEQUENCE_BITS, SHADER_BITS),
+                "texture": take(SEQUENCE_BITS, TEXTURE_BITS),
+                "sequence": take(0, SEQUENCE_BITS)}
+    return {"pass": key >> PASS_SHIFT,
+            "shader": take(TEXTURE_BITS + DEPTH_BITS + SEQUENCE_BITS, SHADER_BITS),
+            "texture": take(DEPTH_BITS + SEQUENCE_BITS, TEXTURE_BITS),
+            "depth": take(SEQUENCE_BITS, DEPTH_BITS),
+            "sequence": take(0, SEQUENCE_BITS)}
+
+
+class RenderQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = RenderQueue(far=100.0, culling=False)
+        self.log = []
+
+    def surface(self, name: str, shader: int, texture: int = None, blended: bool = False) -> Surface:
+        return Surface(name, shader, texture, blended, self.log)
+
+    def test_key_fits_into_64_bits(self):
+        self.assertEqual(64, PASS_SHIFT + 2)
+        self.assertEqual(PASS_SHIFT, SHADER_BITS + TEXTURE_BITS + DEPTH_BITS + SEQUENCE_BITS)
+
+    def test_key_fields(self):
+        opaque = self.surface("opaque", shader=7, texture=3)
+        blended = self.surface("blended", shader=7, texture=3, blended=True)
+        opaque_key = self.queue.make_key(opaque, at_depth(25.0), 5)
+        blended_key = self.queue.make_key(blended, at_depth(25.0), 6)
+        self.assertLess(opaque_key, 1 << 64)
+        self.assertLess(blended_key, 1 << 64)
+
+        depth = int(0.25 * MAX_DEPTH_VALUE)
+        self.assertEqual({"pass": OPAQUE_PASS, "shader": 0, "texture": 0, "depth": depth, "sequence": 5},
+                         fields(opaque_key, blended=False))
+        self.assertEqual({"pass": BLENDED_PASS, "shader": 0, "texture": 0, "depth": depth, "sequence": 6},
+                         fields(blended_key, blended=True))
+
+        # a second shader and texture get the next small ids, without a texture the id is 0
+        other = self.surface("other", shader=9, texture=4)
+        other_fields = fields(self.queue.make_key(other, at_depth(1.0), 0), blended=False)
+        self.assertEqual((1, 1), (other_fields["shader"], other_fields["texture"]))
+        untextured = fields(self.queue.make_key(self.surface("plain", shader=9), [], 0), blended=False)
+        self.assertEqual((1, 0, 0), (untextured["shader"], untextured["texture"], untextured["depth"]))
+
+    def test_depth_is_clamped(self):
+        surface = self.surface("surface", shader=1)
+        self.assertEqual(MAX_DEPTH_VALUE, fields(self.queue.make_key(surface, at_depth(500.0), 0), False)["depth"])
+        self.assertEqual(0, fields(self.queue.make_key(surface, at_depth(-5.0), 0), False)["depth"])
+
+    def test_flush_order(self):
+        draws = [
+            (self.surface("glass far", shader=1, blended=True), 50.0),
+            (self.surface("b near", shader=2, texture=1), 5.0),
+            (self.surface("a far", shader=1, texture=1), 40.0),
+            (self.surface("glass near", shader=1, blended=True), 10.0),
+            (self.surface("a near", shader=1, texture=1), 20.0),
+            (self.surface("a other texture", shader=1, texture=2), 1.0),
+            (self.surface("b far", shader=2, texture=1), 30.0),
+        ]
+        for surface, depth in draws:
+            self.queue.submit(surface, at_depth(depth))
+        self.queue.flush()
+        # opaque grouped by shader and texture in submission order of first use, front to back inside a group,
+        # then blended back to front
+        self.assertEqual(["a near", "a far", "a other texture", "b near", "b far", "glass far", "glass near"],
+                         self.log)
+        self.assertEqual(0, len(self.queue))
+        self.assertEqual(7, self.queue.draw_calls)
+
+    def test_equal_keys_keep_submission_order(self):
+        for index in range(5):
+            self.queue.submit(self.surface(str(index), shader=1), at_depth(10.0))
+        self.queue.flush()
+        self.assertEqual(["0", "1", "2", "3", "4"], self.log)
+
+    def test_ids_are_reset_every_frame(self):
+        for texture in range(1 << TEXTURE_BITS):
+            self.queue.submit(self.surface("surface", shader=1, texture=texture + 1), [])
+        self.assertEqual(1 << TEXTURE_BITS, len(self.queue.texture_ids))
+        self.queue.flush()
+        self.assertEqual({}, self.queue.texture_ids)
+        self.assertEqual({}, self.queue.shader_ids)
+        key = self.queue.make_key(self.surface("surface", shader=1, texture=99999), [], 0)
+        self.assertEqual(0, fields(key, blended=False)["texture"])
+
+
+if __name__ == "__main__":
+    unittest.main()
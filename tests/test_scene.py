@@ -0,0 +1,155 @@
+import math
+import os
+import random
+import unittest
+
+import numpy as np
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+from game_engine.scene import SpatialIndex
+
+
+def sphere_in_radius(center, radius, query_center, query_radius) -> bool:
+    return np.linalg.norm(np.subtract(center, query_center)) <= radius + query_radius
+
+
+def ray_distance(center, radius, origin, direction, max_distance):
+    """
+    Distance along the ray to the sphere, 0 if the origin is inside, None if it misses
+    """
+    to_center = [c - o for c, o in zip(center, origin)]
+    length_squared = sum(v * v for v in to_center)
+    if length_squared <= radius * radius:
+        return 0.0
+    along = sum(v * d for v, d in zip(to_center, direction))
+    closest_squared = length_squared - along * along
+    if closest_squared > radius * radius:
+        return None
+    distance = along - math.sqrt(radius * radius - closest_squared)
+    if distance < 0 or distance > max_distance:
+        return None
+    return distance
+
+
+class SpatialIndexTest(unittest.TestCase):
+    """
+    Compares the octree queries against checking every sphere, after random inserts, moves and removes
+    """
+
+    world_half_size = 100.0
+
+    def random_sphere(self, rng: random.Random):
+        # some spheres leave the world bounds, they end up in the outside list
+        extent = 1.2 * self.world_half_size
+        center = [rng.uniform(-extent, extent) for _ in range(3)]
+        radius = rng.choice([0.0, rng.uniform(0.01, 1.0), rng.uniform(1.0, 10.0), rng.uniform(10.0, 80.0),
+                             rng.uniform(80.0, 300.0)])
+        return center, radius
+
+    def random_direction(self, rng: random.Random):
+        while True:
+            direction = [rng.gauss(0, 1) for _ in range(3)]
+            length = math.sqrt(sum(v * v for v in direction))
+            if length > 1e-6:
+                return [v / length for v in direction]
+
+    def check_queries(self, index: SpatialIndex, spheres, rng: random.Random):
+        for _ in range(20):
+            query_center, _ = self.random_sphere(rng)
+            query_radius = rng.uniform(0.0, 60.0)
+            expected = {item for item, (center, radius) in spheres.items()
+                        if sphere_in_radius(center, radius, query_center, query_radius)}
+            result = index.query_radius(query_center, query_radius)
+            self.assertEqual(len(result), len(set(result)))
+            self.assertEqual(expected, set(result))
+
+        for _ in range(20):
+            origin, _ = self.random_sphere(rng)
+            direction = self.random_direction(rng)
+            max_distance = rng.choice([math.inf, rng.uniform(10.0, 300.0)])
+            expected = {}
+            for item, (center, radius) in spheres.items():
+                distance = ray_distance(center, radius, origin, direction, max_distance)
+                if distance is not None:
+                    expected[item] = distance
+            hits = index.query_ray(origin, direction, max_distance)
+            self.assertEqual(set(expected), {item for _, item in hits})
+            for distance, item in hits:
+                self.assertAlmostEqual(expected[item], distance, places=6)
+            self.assertEqual(sorted(distance for distance, _ in hits), [distance for distance, _ in hits])
+
+    def test_queries_match_brute_force(self):
+        for seed in range(5):
+            rng = random.Random(seed)
+            index = SpatialIndex(world_half_size=self.world_half_size, max_depth=6)
+            spheres = {}
+            proxy_ids = {}
+            for item in range(300):
+                center, radius = self.random_sphere(rng)
+                proxy_ids[item] = index.insert(item, center, radius)
+                spheres[item] = (center, radius)
+            self.check_queries(index, spheres, rng)
+
+            next_item = len(spheres)
+            for _ in range(4):
+                for item in rng.sample(sorted(spheres), 100):
+                    if rng.random() < 0.5:
+                        # small moves mostly stay in their cell, large ones relink
+                        center, radius = spheres[item]
+                        step = rng.choice([0.5, 50.0])
+                        center = [v + rng.uniform(-step, step) for v in center]
+                        if rng.random() < 0.3:
+                            radius = self.random_sphere(rng)[1]
+                            index.move(proxy_ids[item], center, radius)
+                        else:
+                            index.move(proxy_ids[item], center)
+                    else:
+                        center, radius = self.random_sphere(rng)
+                        index.move(proxy_ids[item], center, radius)
+                    spheres[item] = (center, radius)
+
+                for item in rng.sample(sorted(spheres), 50):
+                    index.remove(proxy_ids.pop(item))
+                    del spheres[item]
+                for _ in range(30):
+                    center, radius = self.random_sphere(rng)
+                    proxy_ids[next_item] = index.insert(next_item, center, radius)
+                    spheres[next_item] = (center, radius)
+                    next_item += 1
+
+                self.assertEqual(len(spheres), len(index))
+                self.check_queries(index, spheres, rng)
+
+    def test_objects_larger_than_the_world(self):
+        index = SpatialIndex(world_half_size=self.world_half_size)
+        small = index.insert("small", (0, 0, 0), 1.0)
+        huge = index.insert("huge", (90, 90, 90), 400.0)
+        # far outside the loose bounds of the root, but inside the huge sphere
+        self.assertEqual(["huge"], index.query_radius((-250, 0, 0), 1.0))
+        self.assertEqual(["huge"], [item for _, item in index.query_ray((-250, 0, -500), (0, 0, 1))])
+
+        # shrinking it moves it into the tree, growing it again moves it back out
+        index.move(huge, (90, 90, 90), 5.0)
+        self.assertEqual([], index.query_radius((-250, 0, 0), 1.0))
+        index.move(huge, (90, 90, 90), 400.0)
+        self.assertEqual({"small", "huge"}, set(index.query_radius((0, 0, 0), 2.0)))
+        index.remove(small)
+        index.remove(huge)
+        self.assertEqual(0, len(index))
+
+    def test_empty_after_removing_everything(self):
+        rng = random.Random(42)
+        index = SpatialIndex(world_half_size=self.world_half_size)
+        proxy_ids = [index.insert(item, *self.random_sphere(rng)) for item in range(50)]
+        for proxy_id in proxy_ids:
+            index.remove(proxy_id)
+        self.assertEqual(0, len(index))
+        self.assertEqual(0, index.root.count)
+        self.assertEqual([], index.query_radius((0, 0, 0), 1000.0))
+        self.assertEqual([], index.query_ray((0, 0, -500), (0, 0, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+import pyglet
+
+from game_engine.asset import get_current_directory
+from game_engine.render_state import RENDER_STATE
+from game_engine.shader_registry import ShaderRegistry
+
+
+class ShaderRegistryTest(unittest.TestCase):
+    """
+    Works on copies of the built-in color shader in a temporary directory
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.window = pyglet.window.Window(8, 8, visible=False)
+        except Exception as e:
+            raise unittest.SkipTest(f"No GL context: {e}")
+        RENDER_STATE.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.window.close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry = ShaderRegistry(watch=True, poll_interval=0.0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def copy_shader(self, name: str):
+        files = []
+        for extension in ["vert", "frag"]:
+            file_name = os.path.join(self.directory.name, f"{name}.{extension}")
+            shutil.copy(os.path.join(get_current_directory(), f"color.{extension}"), file_name)
+            files.append(file_name)
+        return tuple(files)
+
+    @staticmethod
+    def edit(file_name: str, source: str):
+        # make sure the modification time changes
+        time.sleep(0.01)
+        with open(file_name, "w") as f:
+            f.write(source)
+        stat = os.stat(file_name)
+        os.utime(file_name, (stat.st_atime, stat.st_mtime + 1))
+
+    def test_identical_sources_share_a_shader(self):
+        first = self.registry.get(*self.copy_shader("first"))
+        self.assertIs(first, self.registry.get(*self.copy_shader("second")))
+        self.assertEqual(1, len(self.registry))
+        self.assertEqual(1, self.registry.compiled)
+
+    def test_reload_of_a_shared_shader_updates_it_in_place(self):
+        first_files = self.copy_shader("first")
+        second_files = self.copy_shader("second")
+        shader = self.registry.get(*first_files)
+        self.registry.get(*second_files)
+        version = shader.version
+
+        with open(first_files[1]) as f:
+            source = f.read()
+        self.edit(first_files[1], source + "\n// edited\n")
+        self.assertEqual([shader], self.registry.poll())
+        self.assertEqual(version + 1, shader.version)
+        self.assertTrue(shader.linked)
+        self.assertIs(shader, self.registry.get(*first_files))
+
+        # the unchanged files get their own program again
+        second = self.registry.get(*second_files)
+        self.assertIsNot(shader, second)
+        self.assertEqual(2, len(self.registry))
+
+    def test_broken_edit_keeps_the_program(self):
+        files = self.copy_shader("first")
+        shader = self.registry.get(*files)
+        handle = shader.handle
+        with self.assertLogs(level="ERROR"):
+            self.edit(files[1], "broken")
+            self.assertEqual([], self.registry.poll())
+        self.assertTrue(shader.linked)
+        self.assertEqual(handle, shader.handle)
+
+    def test_binary_cache(self):
+        files = self.copy_shader("first")
+        cache_directory = os.path.join(self.directory.name, "cache")
+        self.registry.get(*files)
+        self.assertFalse(os.path.exists(cache_directory))
+
+        registry = ShaderRegistry(cache_directory)
+        registry.get(*files)
+        if not os.path.exists(cache_directory):
+            self.skipTest("The driver has no program binary formats")
+        self.assertEqual(1, len(os.listdir(cache_directory)))
+
+        registry = ShaderRegistry(cache_directory)
+        shader = registry.get(*files)
+        self.assertEqual(1, registry.loaded_binaries)
+        self.assertEqual(0, registry.compiled)
+        self.assertTrue(shader.linked)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+from ctypes import byref, c_char_p, c_int, c_uint, cast, POINTER, c_char
+
+import numpy as np
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+import pyglet
+from pyglet.gl import glGetUniformBlockIndex, glGetActiveUniformBlockiv, glGetUniformIndices, glGetActiveUniformsiv
+from pyglet.gl import glGetBufferSubData, GL_UNIFORM_BLOCK_DATA_SIZE, GL_UNIFORM_OFFSET, GL_UNIFORM_BUFFER
+
+from game_engine.asset import get_color_mesh_shader
+from game_engine.math import mat4
+from game_engine.render_state import RENDER_STATE
+from game_engine.uniform_buffer import FrameUniforms, FRAME_UNIFORMS_LAYOUT
+from game_engine.vertex_objects import Uniform
+
+MEMBERS = ["u_View", "u_Projection", "u_ViewProjection"]
+
+
+def numbered_matrix(start: float) -> mat4:
+    return mat4(np.arange(start, start + 16, dtype=np.float32).reshape((4, 4)))
+
+
+class FrameUniformsTest(unittest.TestCase):
+    """
+    Checks the numpy layout against the std140 layout GL reports for the block of the built-in shaders
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.window = pyglet.window.Window(8, 8, visible=False)
+        except Exception as e:
+            raise unittest.SkipTest(f"No GL context: {e}")
+        RENDER_STATE.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.window.close()
+
+    def test_numpy_layout(self):
+        self.assertEqual(192, FRAME_UNIFORMS_LAYOUT.itemsize)
+        self.assertEqual([0, 64, 128], [FRAME_UNIFORMS_LAYOUT.fields[name][1]
+                                        for name in ["view", "projection", "view_projection"]])
+
+    def test_matches_the_shader_block(self):
+        shader = get_color_mesh_shader()
+        block = glGetUniformBlockIndex(shader.handle, b"FrameUniforms")
+        size = c_int(0)
+        glGetActiveUniformBlockiv(shader.handle, block, GL_UNIFORM_BLOCK_DATA_SIZE, byref(size))
+        self.assertEqual(FRAME_UNIFORMS_LAYOUT.itemsize, size.value)
+
+        names = (c_char_p * len(MEMBERS))(*[name.encode("utf-8") for name in MEMBERS])
+        indices = (c_uint * len(MEMBERS))()
+        glGetUniformIndices(shader.handle, len(MEMBERS), cast(names, POINTER(POINTER(c_char))), indices)
+        offsets = (c_int * len(MEMBERS))()
+        glGetActiveUniformsiv(shader.handle, len(MEMBERS), indices, GL_UNIFORM_OFFSET, offsets)
+        self.assertEqual([0, 64, 128], list(offsets))
+
+    def read_block(self, frame_uniforms: FrameUniforms) -> np.ndarray:
+        values = np.zeros(1, dtype=FRAME_UNIFORMS_LAYOUT)
+        RENDER_STATE.bind_buffer(GL_UNIFORM_BUFFER, frame_uniforms.buffer.handle)
+        glGetBufferSubData(GL_UNIFORM_BUFFER, 0, values.nbytes, values.ctypes.data)
+        return values[0]
+
+    def test_set_uploads_row_major_matrices(self):
+        frame_uniforms = FrameUniforms()
+        view = numbered_matrix(0)
+        projection = numbered_matrix(100)
+        frame_uniforms.set(view, projection)
+        block = self.read_block(frame_uniforms)
+        np.testing.assert_array_equal(view.numbers, block["view"])
+        np.testing.assert_array_equal(projection.numbers, block["projection"])
+        np.testing.assert_allclose(projection.numbers @ view.numbers, block["view_projection"], rtol=1e-6)
+        frame_uniforms.delete()
+
+    def test_uniforms_fall_back_to_the_block(self):
+        frame_uniforms = FrameUniforms()
+        frame_uniforms.set(numbered_matrix(0), numbered_matrix(100))
+        view = numbered_matrix(200)
+        with self.assertLogs(level="WARNING"):
+            frame_uniforms.set_from_uniforms([Uniform("u_Model", numbered_matrix(300)), Uniform("u_View", view)])
+        block = self.read_block(frame_uniforms)
+        np.testing.assert_array_equal(view.numbers, block["view"])
+        # the projection of the last set() stays
+        np.testing.assert_array_equal(numbered_matrix(100).numbers, block["projection"])
+        frame_uniforms.delete()
+
+
+if __name__ == "__main__":
+    unittest.main()
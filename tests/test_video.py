@@ -0,0 +1,126 @@
+import os
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+# no display needed, must be set before game_engine pulls in pyglet.gl
+os.environ.setdefault("GAME_ENGINE_HEADLESS", "1")
+
+from game_engine.asset import VideoSource, DROP_OLDEST, BLOCK
+
+FRAME_COUNT = 30
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 48
+
+
+def frame_value(index: int) -> int:
+    # far enough apart to survive the lossy codec
+    return 8 * index
+
+
+def wait_until_finished(source: VideoSource, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not source.finished:
+        if time.monotonic() > deadline:
+            raise AssertionError("The video source did not finish decoding")
+        time.sleep(0.01)
+
+
+class VideoSourceTest(unittest.TestCase):
+    """
+    Decodes a small generated video, every frame is filled with a value derived from its index
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.file_name = os.path.join(cls.directory.name, "frames.avi")
+        writer = cv2.VideoWriter(cls.file_name, cv2.VideoWriter_fourcc(*"MJPG"), 30.0, (FRAME_WIDTH, FRAME_HEIGHT))
+        if not writer.isOpened():
+            cls.directory.cleanup()
+            raise unittest.SkipTest("cv2 can't write MJPG videos")
+        for index in range(FRAME_COUNT):
+            writer.write(np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), frame_value(index), dtype=np.uint8))
+        writer.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def assert_frame(self, frame):
+        self.assertEqual((FRAME_HEIGHT, FRAME_WIDTH, 3), frame.image.shape)
+        self.assertLess(abs(float(frame.image.mean()) - frame_value(frame.index)), 3.0)
+
+    def drain(self, source: VideoSource):
+        frames = []
+        while True:
+            frame = source.wait_for_frame(timeout=5.0)
+            if frame is None:
+                break
+            self.assert_frame(frame)
+            frames.append((frame.index, frame.timestamp))
+        self.assertTrue(source.exhausted)
+        return frames
+
+    def test_block_keeps_every_frame(self):
+        source = VideoSource(self.file_name, capacity=2, policy=BLOCK, flip_code=None)
+        try:
+            # the ring fills up, the worker has to wait instead of dropping
+            time.sleep(0.2)
+            self.assertFalse(source.finished)
+            frames = self.drain(source)
+        finally:
+            source.stop()
+        self.assertEqual(0, source.dropped_frames)
+        self.assertEqual(list(range(FRAME_COUNT)), [index for index, _ in frames])
+        timestamps = [timestamp for _, timestamp in frames]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+    def test_drop_oldest_keeps_the_newest_frames(self):
+        source = VideoSource(self.file_name, capacity=2, policy=DROP_OLDEST, flip_code=None)
+        try:
+            # never waits for the renderer, decodes the whole file while nobody polls
+            wait_until_finished(source)
+            frames = self.drain(source)
+        finally:
+            source.stop()
+        indices = [index for index, _ in frames]
+        self.assertGreater(source.dropped_frames, 0)
+        self.assertEqual(FRAME_COUNT, len(indices) + source.dropped_frames)
+        self.assertEqual(list(range(FRAME_COUNT - len(indices), FRAME_COUNT)), indices)
+
+    def test_poll_latest_skips_to_the_newest_frame(self):
+        source = VideoSource(self.file_name, capacity=2, policy=DROP_OLDEST, flip_code=None)
+        try:
+            wait_until_finished(source)
+            frame = source.poll(latest=True)
+            self.assert_frame(frame)
+            self.assertEqual(FRAME_COUNT - 1, frame.index)
+            self.assertIsNone(source.poll())
+            self.assertTrue(source.exhausted)
+        finally:
+            source.stop()
+
+    def test_flip_and_scale(self):
+        source = VideoSource(self.file_name, flip_code=0, scale=0.5)
+        try:
+            self.assertEqual((FRAME_HEIGHT // 2, FRAME_WIDTH // 2, 3), source.shape)
+            frame = source.wait_for_frame(timeout=5.0)
+            self.assertEqual(source.shape, frame.image.shape)
+        finally:
+            source.stop()
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(AttributeError):
+            VideoSource(self.file_name, policy="newest")
+        with self.assertRaises(AttributeError):
+            VideoSource(self.file_name, capacity=0)
+        with self.assertRaises(IOError):
+            VideoSource(os.path.join(self.directory.name, "missing.avi"))
+
+
+if __name__ == "__main__":
+    unittest.main()